@@ -0,0 +1,319 @@
+# Controle de admissão: cada requisição pesada estima o próprio custo antes
+# de começar (tamanho da entrada, número de páginas e DPI) e só roda quando
+# cabe nos orçamentos globais de CPU e de memória do worker. As que não cabem
+# esperam numa fila FIFO por até ADMISSION_MAX_WAIT segundos; com a fila cheia
+# ou o tempo esgotado, a resposta é 429 com Retry-After. Assim dez pdf2img de
+# 1.000 páginas ao mesmo tempo viram fila (e 429), e não falta de memória.
+#
+# Nas rotas em streaming o custo fica reservado até o fim do envio da
+# resposta (dependência admission_ticket); nas demais, só durante o trabalho
+# (admitted()).
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+import metrics
+from logs import get_logger
+
+log = get_logger("admission")
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+# Segundos de CPU (estimados) em andamento ao mesmo tempo, por worker do uvicorn
+ADMISSION_CPU_BUDGET = float(os.environ.get("ADMISSION_CPU_BUDGET", (os.cpu_count() or 1) * 30))
+# Bytes de memória (estimados) em uso ao mesmo tempo (padrão: metade da RAM)
+ADMISSION_MEMORY_BUDGET = int(os.environ.get("ADMISSION_MEMORY_BUDGET", _physical_memory() // 2))
+# Espera máxima (s) na fila antes do 429, e tamanho máximo da fila
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 10))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 32))
+
+# Perfis de custo por tipo de trabalho:
+#   cpu: segundos por página (rasterização: a 72 dpi, crescendo com (dpi/72)²)
+#   memory: bytes por byte de entrada (objetos do PyPDF2/MuPDF, cópias de saída)
+#   base: bytes fixos por requisição
+# Calibrados com o corpus do bench (python -m bench) numa CPU; são
+# estimativas conservadoras, não medições.
+COST_PROFILES = {
+    "edit": {"cpu": 0.002, "memory": 6, "base": 16 * 1024 ** 2},
+    "compress": {"cpu": 0.004, "memory": 8, "base": 32 * 1024 ** 2},
+    "split": {"cpu": 0.002, "memory": 4, "base": 16 * 1024 ** 2},
+    "merge": {"cpu": 0.001, "memory": 4, "base": 16 * 1024 ** 2},
+    "compare": {"cpu": 0.004, "memory": 8, "base": 32 * 1024 ** 2},
+    "pdf2img": {"cpu": 0.02, "memory": 2, "base": 16 * 1024 ** 2},
+    # Imagens comprimidas (JPEG/PNG) ocupam bem mais depois de decodificadas
+    "img2pdf": {"cpu": 0.02, "memory": 10, "base": 16 * 1024 ** 2},
+}
+# Página de referência para estimar o tamanho dos bitmaps (Carta, em pontos)
+_PAGE_POINTS = (612, 792)
+
+QUEUE_DEPTH = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftoolkit_admission_queue_depth", "Requisições esperando admissão.",
+    fn=lambda: len(get_controller()._waiters)))
+IN_USE = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftoolkit_admission_in_use", "Custo admitido em andamento (cpu em segundos estimados, memory em bytes).", ("resource",),
+    fn=lambda: {("cpu",): get_controller().cpu, ("memory",): get_controller().memory}))
+ADMITTED = metrics.REGISTRY.register(metrics.Counter(
+    "pdftoolkit_admission_admitted_total", "Requisições admitidas, por rota.", ("route",)))
+REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    "pdftoolkit_admission_rejected_total", "Requisições recusadas com 429, por rota e motivo (queue_full, timeout).", ("route", "reason")))
+WAIT = metrics.REGISTRY.register(metrics.Histogram(
+    "pdftoolkit_admission_wait_seconds", "Tempo na fila até a admissão, por rota.", ("route",)))
+
+
+class Cost:
+    __slots__ = ("cpu", "memory")
+
+    def __init__(self, cpu, memory):
+        self.cpu = cpu
+        self.memory = memory
+
+    def __repr__(self):
+        return f"Cost(cpu={self.cpu:.2f}s, memory={self.memory / 1024 ** 2:.1f}MB)"
+
+
+def raster_bytes(dpi):
+    """Bytes de um bitmap RGB de uma página de referência no DPI dado."""
+    scale = dpi / 72
+    return int(_PAGE_POINTS[0] * scale) * int(_PAGE_POINTS[1] * scale) * 3
+
+
+def estimate(profile, size, pages=1, dpi=None, steps=1, in_flight=1):
+    """Custo estimado de uma requisição.
+
+    size: bytes de entrada; pages: páginas processadas; steps: operações
+    aplicadas (pipeline); dpi e in_flight (páginas renderizadas ao mesmo
+    tempo): para rasterização.
+    """
+    p = COST_PROFILES[profile]
+    cpu = p["cpu"] * max(pages, 1) * max(steps, 1)
+    memory = p["base"] + p["memory"] * size
+    if dpi:
+        cpu *= (dpi / 72) ** 2
+        # Bitmap + imagem codificada de cada página em voo
+        memory += 2 * raster_bytes(dpi) * in_flight
+    return Cost(cpu, memory)
+
+
+def _count_pages(path=None, data=None):
+    try:
+        import fitz  # PyMuPDF
+        doc = fitz.open(path, filetype="pdf") if path is not None else fitz.open(stream=data, filetype="pdf")
+        with doc:
+            return max(doc.page_count, 1)
+    except Exception:
+        return 1
+
+
+def measure_path(path):
+    """(bytes, páginas) de um PDF em disco; o MuPDF só lê a xref e a árvore de páginas."""
+    try:
+        return os.path.getsize(path), _count_pages(path)
+    except OSError:
+        return 0, 1
+
+
+def measure(upload, doc_id=None):
+    """(bytes, páginas) de um upload ou documento armazenado, sem analisar o PDF inteiro.
+
+    Entradas inválidas ou ausentes contam como uma página: o erro de verdade
+    fica para a rota.
+    """
+    if doc_id:
+        from docstore import get_store
+        try:
+            return measure_path(get_store().path(doc_id))
+        except KeyError:
+            return 0, 1
+    if upload is None:
+        return 0, 1
+    stream = upload.file
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if getattr(stream, "_rolled", True):
+        # Upload já em disco: o MuPDF lê pelo descritor, sem copiar o arquivo para a memória
+        try:
+            stream.flush()
+            fd_path = f"/proc/self/fd/{stream.fileno()}"
+        except (OSError, ValueError, AttributeError):
+            fd_path = None
+        if fd_path and os.path.exists(fd_path):
+            return size, _count_pages(fd_path)
+    data = stream.read()
+    stream.seek(0)
+    return size, _count_pages(data=data)
+
+
+def measure_all(sources):
+    """Soma de (bytes, páginas) de vários pares (upload, doc_id)."""
+    size = pages = 0
+    for upload, doc_id in sources:
+        s, p = measure(upload, doc_id)
+        size += s
+        pages += p
+    return size, pages
+
+
+class AdmissionController:
+    """Orçamentos de CPU e memória de um worker, com fila FIFO de espera (só usado no event loop)."""
+
+    def __init__(self, cpu_budget=ADMISSION_CPU_BUDGET, memory_budget=ADMISSION_MEMORY_BUDGET,
+                 max_wait=ADMISSION_MAX_WAIT, max_queue=ADMISSION_MAX_QUEUE):
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.cpu = 0.0
+        self.memory = 0
+        self.running = 0
+        self._waiters = deque()
+
+    def _clamp(self, cost):
+        # Uma requisição maior que o orçamento inteiro roda sozinha, em vez de nunca rodar
+        return Cost(min(cost.cpu, self.cpu_budget), min(cost.memory, self.memory_budget))
+
+    def _fits(self, cost):
+        return self.cpu + cost.cpu <= self.cpu_budget and self.memory + cost.memory <= self.memory_budget
+
+    def _take(self, cost):
+        self.cpu += cost.cpu
+        self.memory += cost.memory
+        self.running += 1
+
+    def retry_after(self):
+        """Segundos sugeridos no Retry-After: o trabalho em andamento dividido pelos núcleos."""
+        return max(1, min(60, math.ceil(self.cpu / (os.cpu_count() or 1))))
+
+    def _reject(self, route, reason):
+        REJECTED.inc(1, route, reason)
+        log.warning("admission_rejected", route=route, reason=reason, queued=len(self._waiters),
+                    cpu=round(self.cpu, 2), memory=self.memory)
+        raise HTTPException(
+            status_code=429,
+            detail="Servidor ocupado, tente novamente em instantes.",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def acquire(self, route, cost):
+        """Reserva o custo (já limitado ao orçamento) e devolve o que foi reservado; HTTPException 429 se não der."""
+        cost = self._clamp(cost)
+        if not self._waiters and self._fits(cost):
+            self._take(cost)
+            ADMITTED.inc(1, route)
+            return cost
+        if len(self._waiters) >= self.max_queue:
+            self._reject(route, "queue_full")
+        future = asyncio.get_running_loop().create_future()
+        entry = (cost, future)
+        self._waiters.append(entry)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._waiters.remove(entry)
+                # Ela podia estar segurando a fila: as seguintes que já cabem entram agora
+                self._wake()
+                self._reject(route, "timeout")
+        except BaseException:
+            # Requisição cancelada na fila: devolve o custo, se ele chegou a ser reservado
+            if future.done() and not future.cancelled():
+                self.release(cost)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                self._wake()
+            raise
+        WAIT.observe(time.perf_counter() - started, route)
+        ADMITTED.inc(1, route)
+        return cost
+
+    def _wake(self):
+        # FIFO estrito: a primeira da fila que não cabe segura as seguintes (senão as grandes nunca rodariam)
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if self.running and not self._fits(cost):
+                break
+            self._waiters.popleft()
+            self._take(cost)
+            future.set_result(None)
+
+    def release(self, cost):
+        self.cpu = max(0.0, self.cpu - cost.cpu)
+        self.memory = max(0, self.memory - cost.memory)
+        self.running -= 1
+        self._wake()
+
+
+_controller = None
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+class Ticket:
+    """Custo reservado por uma requisição; liberado uma única vez, ao final."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.cost = None
+
+    async def admit(self, route, profile, size, pages=1, **params):
+        """Espera o custo estimado (estimate(profile, size, pages, **params)) caber nos orçamentos; 429 se não der."""
+        if not ADMISSION_ENABLED or self.cost is not None:
+            return
+        cost = estimate(profile, size, pages, **params)
+        self.cost = await self.controller.acquire(route, cost)
+        log.debug("admitted", sample=0.1, route=route, pages=pages, cost=repr(self.cost))
+
+    async def admit_inputs(self, route, profile, sources, **params):
+        """admit() medindo as entradas ((upload, doc_id), ...) numa thread."""
+        if ADMISSION_ENABLED and self.cost is None:
+            size, pages = await asyncio.to_thread(measure_all, sources)
+            await self.admit(route, profile, size, pages, **params)
+
+    async def admit_paths(self, route, profile, paths, **params):
+        """admit() medindo PDFs já em disco numa thread."""
+        if ADMISSION_ENABLED and self.cost is None:
+            measured = await asyncio.to_thread(lambda: [measure_path(p) for p in paths])
+            await self.admit(route, profile, sum(s for s, _ in measured), sum(p for _, p in measured), **params)
+
+    def release(self):
+        if self.cost is not None:
+            self.controller.release(self.cost)
+            self.cost = None
+
+
+async def admission_ticket():
+    """Dependência FastAPI: o custo admitido fica reservado até o fim do envio da resposta (FastAPI >= 0.118, ver scratch.scratch_dir)."""
+    ticket = Ticket(get_controller())
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
+
+@asynccontextmanager
+async def admitted(route, profile, sources, **params):
+    """Reserva o custo das entradas ((upload, doc_id), ...) durante o bloco (rotas que respondem só depois do trabalho)."""
+    ticket = Ticket(get_controller())
+    try:
+        await ticket.admit_inputs(route, profile, sources, **params)
+        yield ticket
+    finally:
+        ticket.release()
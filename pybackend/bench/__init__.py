@@ -0,0 +1 @@
+# Benchmark do backend: `python -m bench --help` (rodar de dentro de pybackend/).
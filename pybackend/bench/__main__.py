@@ -0,0 +1,87 @@
+# Linha de comando do benchmark.
+#   python -m bench corpus [--full]                 gera o corpus sintético
+#   python -m bench run --out baseline.json         mede todas as rotas
+#   python -m bench compare baseline.json atual.json  aponta regressões (sai com código 1)
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(HERE, "tmp", "bench-corpus")
+
+
+def _isolate():
+    """Diretórios temporários próprios: o benchmark não mexe nos dados do servidor."""
+    root = tempfile.mkdtemp(prefix="pdftoolkit-bench-")
+    # Inclui os caches (resultados, miniaturas): um cache quente de outra execução distorceria as latências
+    dirs = (
+        ("SCRATCH_DIR", "scratch"), ("DOC_STORE_DIR", "docs"), ("JOB_STORE_DIR", "jobs"),
+        ("RESULT_CACHE_DIR", "results"), ("RENDER_CACHE_DIR", "render"), ("UPLOAD_SESSION_DIR", "uploads"),
+    )
+    for var, sub in dirs:
+        os.environ.setdefault(var, os.path.join(root, sub))
+    return root
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark das rotas do PDF Toolkit.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    corpus_cmd = sub.add_parser("corpus", help="gera o corpus sintético")
+    corpus_cmd.add_argument("--dir", default=DEFAULT_CORPUS)
+    corpus_cmd.add_argument("--full", action="store_true", help="inclui o documento de 10.000 páginas")
+
+    run_cmd = sub.add_parser("run", help="executa o benchmark")
+    run_cmd.add_argument("--dir", default=DEFAULT_CORPUS)
+    run_cmd.add_argument("--full", action="store_true", help="inclui o documento de 10.000 páginas")
+    run_cmd.add_argument("--out", help="arquivo JSON do relatório (baseline)")
+    run_cmd.add_argument("--filter", help="regex aplicada ao nome do cenário (ex.: 'pagenum|merge')")
+    run_cmd.add_argument("--iterations", type=int, default=5, help="requisições sequenciais por cenário (latência)")
+    run_cmd.add_argument("--concurrency", type=int, default=4, help="clientes simultâneos na medição de vazão")
+    run_cmd.add_argument("--requests", type=int, default=8, help="requisições na medição de vazão")
+    run_cmd.add_argument("--warmup", type=int, default=1)
+    run_cmd.add_argument("--budget", type=float, default=60.0, help="segundos máximos por cenário")
+
+    compare_cmd = sub.add_parser("compare", help="compara dois relatórios")
+    compare_cmd.add_argument("baseline")
+    compare_cmd.add_argument("current")
+    compare_cmd.add_argument("--threshold", type=float, default=0.15, help="piora relativa tolerada (0.15 = 15%%)")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        from bench.runner import compare
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        lines, regressions = compare(baseline, current, args.threshold)
+        print("\n".join(lines))
+        print(f"\n{regressions} regressão(ões) acima de {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    from bench import corpus
+    docs, images = corpus.build(args.dir, full=args.full)
+    if args.command == "corpus":
+        print(f"corpus em {args.dir}: {len(docs)} documentos, {len(images)} imagens")
+        return 0
+
+    # Os módulos do backend (main.py etc.) são importados da pasta pybackend
+    sys.path.insert(0, HERE)
+    _isolate()
+    from bench.runner import run
+    report = asyncio.run(run(
+        docs, images, iterations=args.iterations, concurrency=args.concurrency, requests=args.requests,
+        warmup=args.warmup, budget=args.budget, name_filter=args.filter,
+    ))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"relatório salvo em {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# Corpus sintético e reprodutível para o benchmark.
+# Tudo é gerado a partir de uma semente fixa (reportlab em modo "invariant",
+# sem datas), então o mesmo corpus sai byte a byte igual em qualquer máquina
+# (exceto o documento criptografado, cujo /ID o PyPDF2 sorteia).
+# Os arquivos ficam em cache no diretório do corpus e só são gerados uma vez.
+import glob
+import io
+import json
+import os
+import random
+
+CORPUS_VERSION = 1
+PASSWORD = "bench"
+
+_WORDS = (
+    "pdf pagina documento texto fonte imagem compressao tabela relatorio contrato "
+    "anexo sumario capitulo figura nota rodape cabecalho versao revisao assinatura"
+).split()
+
+
+def _canvas(path):
+    from reportlab.pdfgen import canvas
+    return canvas.Canvas(path, invariant=1)
+
+
+def _noise(rng, size, mode="RGB"):
+    """Imagem com "textura de foto": ruído semeado em baixa resolução, ampliado."""
+    from PIL import Image
+    width, height = size
+    small = (max(1, width // 8), max(1, height // 8))
+    bands = len(mode)
+    img = Image.frombytes(mode, small, rng.randbytes(small[0] * small[1] * bands))
+    return img.resize(size, Image.BILINEAR)
+
+
+def make_text_pdf(path, pages, seed=1):
+    """Páginas só com texto (Helvetica), ~40 linhas por página."""
+    rng = random.Random(seed)
+    c = _canvas(path)
+    for n in range(pages):
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(72, 760, f"Página {n + 1} de {pages}")
+        c.setFont("Helvetica", 10)
+        for line in range(40):
+            c.drawString(72, 730 - line * 16, " ".join(rng.choice(_WORDS) for _ in range(12)))
+        c.showPage()
+    c.save()
+
+
+def make_image_pdf(path, pages, seed=2):
+    """Cada página com uma foto JPEG (ruído) e um PNG com transparência, todos distintos."""
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    rng = random.Random(seed)
+    c = _canvas(path)
+    for n in range(pages):
+        photo = _noise(rng, (1200, 900))
+        jpg = io.BytesIO()
+        photo.save(jpg, "JPEG", quality=90)
+        logo = Image.new("RGBA", (300, 300), (rng.randrange(256), 80, 160, 140))
+        c.setFont("Helvetica", 14)
+        c.drawString(72, 760, f"Imagem {n + 1}")
+        c.drawImage(ImageReader(io.BytesIO(jpg.getvalue())), 72, 300, width=450, height=338)
+        c.drawImage(ImageReader(logo), 380, 80, width=150, height=150, mask="auto")
+        c.showPage()
+    c.save()
+
+
+def _font_names():
+    """As 14 fontes padrão mais TrueTypes embutidas (Vera do reportlab + fontes do sistema, com vários apelidos)."""
+    import reportlab
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    names = [
+        "Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique",
+        "Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic",
+        "Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique",
+    ]
+    font_dir = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+    files = sorted(glob.glob(os.path.join(font_dir, "Vera*.ttf")))
+    files += sorted(glob.glob("/usr/share/fonts/**/*.ttf", recursive=True))[:16]
+    for i, ttf in enumerate(files):
+        # Cada apelido vira um subconjunto embutido separado no PDF
+        for alias in range(3):
+            name = f"BenchFont{i}-{alias}"
+            try:
+                pdfmetrics.registerFont(TTFont(name, ttf))
+            except Exception:
+                break
+            names.append(name)
+    return names
+
+
+def make_fonts_pdf(path, pages, seed=3):
+    """Páginas que alternam entre dezenas de fontes (muitos recursos de fonte por página)."""
+    rng = random.Random(seed)
+    fonts = _font_names()
+    c = _canvas(path)
+    for n in range(pages):
+        for line in range(45):
+            c.setFont(fonts[(n * 7 + line) % len(fonts)], 10)
+            c.drawString(50, 780 - line * 16, " ".join(rng.choice(_WORDS) for _ in range(10)))
+        c.showPage()
+    c.save()
+
+
+def make_encrypted_pdf(path, pages, seed=4):
+    """PDF de texto protegido com a senha PASSWORD."""
+    from PyPDF2 import PdfReader, PdfWriter
+    plain = io.BytesIO()
+    make_text_pdf(plain, pages, seed)
+    plain.seek(0)
+    writer = PdfWriter()
+    for page in PdfReader(plain).pages:
+        writer.add_page(page)
+    writer.encrypt(PASSWORD)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def make_images(directory, count, seed=5):
+    """Fotos JPEG e PNGs (RGB e com alfa) para o /api/img2pdf."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for n in range(count):
+        size = (rng.randrange(800, 2400), rng.randrange(600, 1800))
+        img = _noise(rng, size)
+        if n % 3 == 2:
+            img = img.convert("RGBA")
+            img.putalpha(180)
+            path = os.path.join(directory, f"img_{n:03d}.png")
+            img.save(path)
+        elif n % 3 == 1:
+            path = os.path.join(directory, f"img_{n:03d}.png")
+            img.save(path)
+        else:
+            path = os.path.join(directory, f"img_{n:03d}.jpg")
+            img.save(path, quality=88)
+        paths.append(path)
+    return paths
+
+
+# nome -> (gerador, páginas). "full" acrescenta os documentos muito grandes.
+DOCUMENTS = {
+    "text-1": (make_text_pdf, 1),
+    "text-10": (make_text_pdf, 10),
+    "text-100": (make_text_pdf, 100),
+    "text-1000": (make_text_pdf, 1000),
+    "images-20": (make_image_pdf, 20),
+    "fonts-50": (make_fonts_pdf, 50),
+    "encrypted-10": (make_encrypted_pdf, 10),
+}
+FULL_DOCUMENTS = {
+    "text-10000": (make_text_pdf, 10000),
+}
+IMAGE_COUNT = 24
+
+
+def build(directory, full=False, log=print):
+    """Gera (se ainda não existir) o corpus em directory e devolve {nome: caminho} mais a lista de imagens."""
+    os.makedirs(directory, exist_ok=True)
+    docs = dict(DOCUMENTS, **(FULL_DOCUMENTS if full else {}))
+    manifest_path = os.path.join(directory, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if manifest.get("version") != CORPUS_VERSION:
+        manifest = {"version": CORPUS_VERSION, "documents": {}}
+    paths = {}
+    for name, (make, pages) in docs.items():
+        path = os.path.join(directory, f"{name}.pdf")
+        if not os.path.exists(path) or name not in manifest["documents"]:
+            log(f"gerando {name} ({pages} páginas)...")
+            make(path, pages)
+            manifest["documents"][name] = {"pages": pages, "bytes": os.path.getsize(path)}
+        paths[name] = path
+    image_dir = os.path.join(directory, "images")
+    images = sorted(glob.glob(os.path.join(image_dir, "img_*")))
+    if len(images) != IMAGE_COUNT or "images" not in manifest:
+        log(f"gerando {IMAGE_COUNT} imagens...")
+        images = make_images(image_dir, IMAGE_COUNT)
+        manifest["images"] = {"count": IMAGE_COUNT, "bytes": sum(os.path.getsize(p) for p in images)}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return paths, images
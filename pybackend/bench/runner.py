@@ -0,0 +1,336 @@
+# Execução do benchmark: chama cada rota do app FastAPI em processo (ASGI,
+# via httpx.ASGITransport, sem rede nem uvicorn) e mede latência, vazão com
+# N clientes simultâneos, pico de memória (processo + pools) e tamanho da saída.
+import asyncio
+import base64
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from bench.corpus import PASSWORD
+
+
+class Scenario:
+    """Uma requisição a medir: rota + documento de entrada + parâmetros."""
+
+    def __init__(self, name, path, files=None, data=None):
+        self.name = name
+        self.path = path
+        # files: {campo: [caminhos]} (lidos uma vez e reenviados a cada requisição)
+        self.files = files or {}
+        self.data = data or {}
+
+
+def _signature():
+    from PIL import Image, ImageDraw
+    img = Image.new("RGBA", (300, 90), (255, 255, 255, 0))
+    ImageDraw.Draw(img).line([(10, 70), (80, 20), (150, 75), (290, 15)], fill=(0, 0, 120, 255), width=5)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+def _page_count(path):
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt(PASSWORD)
+    return len(reader.pages)
+
+
+def scenarios(docs, images):
+    """Todas as rotas de main.py sobre os documentos do corpus."""
+    signature = _signature()
+    result = []
+    # Documentos grandes só entram nas rotas que não rasterizam nem extraem texto
+    light = ("rotate", "remove", "extract", "reorder", "pagenum", "watermark", "split", "split-every", "compress", "content", "pipeline")
+    for doc, path in docs.items():
+        if doc.startswith("encrypted"):
+            continue
+        pages = _page_count(path)
+        big = pages > 1000
+        one = {"file": [path]}
+        edits = {
+            "rotate": ("/api/edit/rotate", {"rotations": json.dumps({"1": 90, str(pages): 180})}),
+            "remove": ("/api/edit/remove", {"pages": json.dumps([1])}),
+            "extract": ("/api/edit/extract", {"pages": json.dumps(list(range(1, min(pages, 10) + 1)))}),
+            "reorder": ("/api/edit/reorder", {"order": json.dumps(list(range(pages, 0, -1)))}),
+            "pagenum": ("/api/edit/pagenum", {"position": "bottom-center"}),
+            "watermark": ("/api/edit/watermark", {"watermark_text": "CONFIDENCIAL", "opacity": "0.2"}),
+            "sign": ("/api/edit/sign", {"x": "60", "y": "80", "signature_img": signature}),
+            "protect": ("/api/edit/protect", {"password": "segredo"}),
+            "content": ("/api/edit/content", {}),
+            "split": ("/api/edit/split", {"ranges": f"1-{max(1, pages // 2)},{max(1, pages // 2) + 1}-{pages}" if pages > 1 else "1-1"}),
+            "split-every": ("/api/edit/split", {"mode": "every", "every": "1"}),
+            "compress": ("/api/edit/compress", {"level": "default"}),
+            "pipeline": ("/api/pipeline", {"operations": json.dumps([
+                {"op": "rotate", "rotations": {"1": 90}},
+                {"op": "pagenum"},
+                {"op": "watermark", "watermark_text": "RASCUNHO"},
+            ])}),
+            "pdf2img": ("/api/pdf2img", {"dpi": "72", "format": "png", "pages": json.dumps(list(range(1, min(pages, 20) + 1)))}),
+        }
+        for op, (route, data) in edits.items():
+            if big and op not in light:
+                continue
+            result.append(Scenario(f"{op}/{doc}", route, one, data))
+        if not big:
+            result.append(Scenario(f"compare/{doc}", "/api/edit/compare", {"file1": [path], "file2": [docs.get("text-10", path)]}))
+    for doc, path in docs.items():
+        if doc.startswith("encrypted"):
+            result.append(Scenario(f"unprotect/{doc}", "/api/edit/unprotect", {"file": [path]}, {"password": PASSWORD}))
+    merge_inputs = [docs[d] for d in ("text-100", "images-20", "fonts-50") if d in docs]
+    if len(merge_inputs) >= 2:
+        result.append(Scenario("merge/text+images+fonts", "/api/merge", {"files": merge_inputs}))
+    if "images-20" in docs:
+        # Mesmo documento duas vezes: as imagens são gravadas uma vez só
+        result.append(Scenario("merge/images-20x2", "/api/merge", {"files": [docs["images-20"]] * 2}))
+    if images:
+        result.append(Scenario(f"img2pdf/{len(images)}-images", "/api/img2pdf", {"files": images}, {"conv_id": "bench"}))
+        jpegs = [p for p in images if p.endswith(".jpg")]
+        if jpegs:
+            result.append(Scenario(f"img2pdf/{len(jpegs)}-jpegs", "/api/img2pdf", {"files": jpegs}, {"conv_id": "bench"}))
+    return result
+
+
+class RssSampler:
+    """Amostra o RSS do processo e dos filhos (pools) numa thread; guarda o pico."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _rss(pid="self"):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @classmethod
+    def current(cls):
+        if not os.path.exists("/proc/self/status"):
+            # Fora do Linux: só o pico do próprio processo
+            import resource
+            scale = 1 if sys.platform == "darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        return cls._rss() + sum(cls._rss(child.pid) for child in multiprocessing.active_children())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def percentile(values, p):
+    """Percentil por posição mais próxima (nearest-rank)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def _measure(client, scenario, payload, iterations, concurrency, requests, warmup, budget):
+    async def call():
+        files = [(field, (os.path.basename(path), data)) for field, items in payload for path, data in items]
+        started = time.perf_counter()
+        response = await client.post(scenario.path, files=files, data=scenario.data)
+        body = response.content
+        return time.perf_counter() - started, response.status_code, len(body), body
+
+    result = {"route": scenario.path}
+    for _ in range(warmup):
+        elapsed, status, size, body = await call()
+        if status >= 400:
+            result.update(status=status, error=body[:300].decode("utf-8", "replace"))
+            return result
+    baseline_rss = RssSampler.current()
+    latencies = []
+    output_bytes = None
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        while len(latencies) < iterations:
+            elapsed, status, size, body = await call()
+            if status >= 400:
+                result.update(status=status, error=body[:300].decode("utf-8", "replace"))
+                return result
+            latencies.append(elapsed)
+            output_bytes = size
+            # Cenários lentos param antes de estourar o orçamento de tempo
+            if time.perf_counter() - started > budget:
+                break
+        throughput = None
+        if concurrency > 1 and requests and time.perf_counter() - started <= budget:
+            # Vazão: `requests` requisições com até `concurrency` em voo
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited():
+                async with semaphore:
+                    return await call()
+
+            t0 = time.perf_counter()
+            outcomes = await asyncio.gather(*(limited() for _ in range(requests)))
+            wall = time.perf_counter() - t0
+            ok = sum(1 for _, status, _, _ in outcomes if status < 400)
+            throughput = round(ok / wall, 3) if wall > 0 else None
+    result.update(
+        status=200,
+        iterations=len(latencies),
+        latency_ms={
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p90": round(percentile(latencies, 90) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+            "min": round(min(latencies) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        concurrency=concurrency,
+        throughput_rps=throughput,
+        peak_rss_mb=round(sampler.peak / 2**20, 1),
+        rss_growth_mb=round(max(0, sampler.peak - baseline_rss) / 2**20, 1),
+        output_bytes=output_bytes,
+    )
+    return result
+
+
+async def run(docs, images, iterations=5, concurrency=4, requests=8, warmup=1, budget=60.0, name_filter=None, log=print):
+    """Roda os cenários e devolve o relatório (dict pronto para json.dump)."""
+    import httpx
+    import main
+    selected = [s for s in scenarios(docs, images) if not name_filter or re.search(name_filter, s.name)]
+    cache = {}
+
+    def load(path):
+        if path not in cache:
+            with open(path, "rb") as f:
+                cache[path] = f.read()
+        return cache[path]
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "render_workers": main.RENDER_WORKERS,
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "requests": requests,
+        },
+        "results": {},
+    }
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scenario in selected:
+                payload = [(field, [(p, load(p)) for p in paths]) for field, paths in scenario.files.items()]
+                result = await _measure(client, scenario, payload, iterations, concurrency, requests, warmup, budget)
+                report["results"][scenario.name] = result
+                if result["status"] >= 400:
+                    log(f"{scenario.name:<32} ERRO {result['status']}: {result['error'][:80]}")
+                else:
+                    lat = result["latency_ms"]
+                    log(
+                        f"{scenario.name:<32} p50 {lat['p50']:>9.1f} ms  p90 {lat['p90']:>9.1f} ms  "
+                        f"{result['throughput_rps'] or 0:>7.2f} req/s  RSS {result['peak_rss_mb']:>7.1f} MB  "
+                        f"saída {result['output_bytes']:>10} B"
+                    )
+    return report
+
+
+# Métricas comparadas: (caminho, maior é pior, tolerância absoluta mínima)
+_METRICS = (
+    (("latency_ms", "p50"), True, 5.0),
+    (("latency_ms", "p90"), True, 5.0),
+    (("throughput_rps",), False, 0.05),
+    (("peak_rss_mb",), True, 16.0),
+    (("output_bytes",), True, 64),
+)
+
+
+def _get(result, path):
+    value = result
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _fmt(value):
+    return f"{value:,}" if isinstance(value, int) else f"{value:g}"
+
+
+def compare(baseline, current, threshold=0.15):
+    """Compara dois relatórios; devolve (linhas de texto, número de regressões)."""
+    lines = []
+    regressions = 0
+    base_results = baseline.get("results", {})
+    for name, result in current.get("results", {}).items():
+        base = base_results.get(name)
+        if base is None:
+            lines.append(f"{name:<32} (novo)")
+            continue
+        if result.get("status", 200) >= 400:
+            flagged = base.get("status", 200) < 400
+            regressions += flagged
+            lines.append(f"{name:<32} {'REGRESSÃO: ' if flagged else ''}erro {result['status']}")
+            continue
+        if base.get("status", 200) >= 400:
+            lines.append(f"{name:<32} (corrigido: antes erro {base['status']})")
+            continue
+        parts = []
+        flagged = False
+        for path, higher_is_worse, min_delta in _METRICS:
+            old, new = _get(base, path), _get(result, path)
+            if old is None or new is None:
+                continue
+            delta = new - old
+            change = delta / old if old else 0.0
+            worse = delta > 0 if higher_is_worse else delta < 0
+            bad = worse and abs(change) > threshold and abs(delta) > min_delta
+            flagged |= bad
+            parts.append(f"{'/'.join(path)} {_fmt(old)}→{_fmt(new)} ({change:+.0%}){' !' if bad else ''}")
+        regressions += flagged
+        lines.append(f"{name:<32} {'REGRESSÃO ' if flagged else ''}" + "; ".join(parts))
+    for name in base_results:
+        if name not in current.get("results", {}):
+            lines.append(f"{name:<32} (ausente na execução atual)")
+    return lines, regressions
@@ -0,0 +1,188 @@
+# Cache de bytes em dois níveis: LRU em memória (limitado em bytes) na
+# frente de um diretório em disco (limitado em bytes e por TTL).
+# A escrita vai sempre para o disco, então outros workers do uvicorn que
+# apontam para o mesmo diretório enxergam as mesmas entradas.
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_.-]{1,200}$")
+
+
+class TieredCache:
+    """Cache chave -> bytes com tier em memória e tier em disco."""
+
+    def __init__(self, directory, max_memory_bytes, max_disk_bytes, ttl, max_item_memory=None):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        # Itens maiores que isso ficam só no disco
+        self.max_item_memory = max_item_memory if max_item_memory is not None else max_memory_bytes // 4
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # chave -> (bytes, último acesso)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # chave -> tamanho, do menos para o mais recente
+        self._disk_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if _KEY_RE.match(name) and not name.endswith(".part") and os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        if not _KEY_RE.match(key):
+            raise ValueError(f"chave de cache inválida: {key!r}")
+        return os.path.join(self.directory, key)
+
+    def _expired(self, mtime, now):
+        return self.ttl and now - mtime > self.ttl
+
+    def path(self, key):
+        """Caminho do arquivo no tier em disco, ou None se a entrada não existir/expirou."""
+        path = self._path(key)
+        now = time.time()
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+            return None
+        if self._expired(st.st_mtime, now):
+            self.delete(key)
+            return None
+        # mtime funciona como "último acesso" para o TTL e para o LRU
+        os.utime(path, (now, now))
+        with self._lock:
+            if key not in self._disk:
+                self._disk_bytes += st.st_size
+            self._disk[key] = st.st_size
+            self._disk.move_to_end(key)
+        return path
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._memory[key] = (entry[0], now)
+                self._memory.move_to_end(key)
+                self.hits += 1
+                hit = entry[0]
+            else:
+                hit = None
+        if hit is not None:
+            # Mantém o TTL do tier em disco em dia com os acessos em memória
+            try:
+                os.utime(self._path(key), (now, now))
+            except FileNotFoundError:
+                pass
+            return hit
+        path = self.path(key)
+        if path is None:
+            with self._lock:
+                self._drop_memory(key)
+                self.misses += 1
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self.hits += 1
+            self._remember(key, data, now)
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._add_disk(key, len(data))
+            self._remember(key, data, time.time())
+            self._evict()
+
+    def put_file(self, key, src_path):
+        """Move um arquivo já escrito para o tier em disco (sem carregá-lo em memória)."""
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.part"
+        shutil.move(src_path, tmp)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._add_disk(key, size)
+            self._evict()
+        return path
+
+    def delete(self, key):
+        path = self._path(key)
+        with self._lock:
+            self._drop_memory(key)
+            self._forget(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict_expired(self):
+        """Remove entradas cujo último acesso passou do TTL."""
+        if not self.ttl:
+            return
+        now = time.time()
+        for key in list(self._disk):
+            try:
+                mtime = os.stat(self._path(key)).st_mtime
+            except FileNotFoundError:
+                with self._lock:
+                    self._forget(key)
+                continue
+            if self._expired(mtime, now):
+                self.delete(key)
+
+    # --- internos (chamados com self._lock adquirido) ---
+
+    def _remember(self, key, data, now):
+        if len(data) > self.max_item_memory:
+            return
+        self._drop_memory(key)
+        self._memory[key] = (data, now)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, (old, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def _drop_memory(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0])
+
+    def _add_disk(self, key, size):
+        self._forget(key)
+        self._disk[key] = size
+        self._disk_bytes += size
+
+    def _forget(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict(self):
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._drop_memory(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
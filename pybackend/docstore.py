@@ -0,0 +1,140 @@
+# Armazenamento de documentos endereçado por conteúdo (SHA-256).
+# O editor envia o PDF uma vez (/api/docs) e depois usa o doc_id em cada
+# edição; o resultado de cada edição volta como um novo doc_id.
+# Bytes ficam num TieredCache (memória + disco, com TTL e limite de tamanho) e
+# os PdfReader já analisados ficam num pool LRU para não reprocessar o arquivo.
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from cache import TieredCache
+
+DOC_STORE_DIR = os.environ.get(
+    "DOC_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "docs")
+)
+DOC_CACHE_MEMORY_BYTES = int(os.environ.get("DOC_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+DOC_CACHE_DISK_BYTES = int(os.environ.get("DOC_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+DOC_CACHE_TTL = int(os.environ.get("DOC_CACHE_TTL", 3600))
+DOC_CACHE_PARSED = int(os.environ.get("DOC_CACHE_PARSED", 16))
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_COPY_CHUNK = 1024 * 1024
+
+
+class DocumentStore:
+    """Documentos PDF identificados pelo hash do conteúdo."""
+
+    def __init__(self, directory=DOC_STORE_DIR, max_memory_bytes=DOC_CACHE_MEMORY_BYTES,
+                 max_disk_bytes=DOC_CACHE_DISK_BYTES, ttl=DOC_CACHE_TTL, max_parsed=DOC_CACHE_PARSED):
+        self.cache = TieredCache(directory, max_memory_bytes, max_disk_bytes, ttl)
+        self.max_parsed = max_parsed
+        # doc_id -> lista de PdfReader livres. Cada reader é emprestado com
+        # exclusividade a uma requisição (o stream do PyPDF2 não pode ser
+        # usado por duas ao mesmo tempo) e devolvido ao final.
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def valid_id(doc_id):
+        return bool(doc_id and _ID_RE.match(doc_id))
+
+    def put_stream(self, src):
+        """Armazena o conteúdo de um arquivo aberto (lido em blocos) e devolve o doc_id."""
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.cache.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = src.read(_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    out.write(chunk)
+            doc_id = h.hexdigest()
+            if self.cache.path(doc_id) is None:
+                self.cache.put_file(doc_id, tmp)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return doc_id
+
+    def put_path(self, src_path):
+        """Armazena um arquivo já em disco, movendo-o para o armazenamento (sem cópia), e devolve o doc_id."""
+        h = hashlib.sha256()
+        with open(src_path, "rb") as f:
+            while True:
+                chunk = f.read(_COPY_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+        doc_id = h.hexdigest()
+        if self.cache.path(doc_id) is None:
+            self.cache.put_file(doc_id, src_path)
+        else:
+            os.remove(src_path)
+        return doc_id
+
+    def path(self, doc_id):
+        """Caminho do documento no disco; KeyError se não existir (ou tiver expirado)."""
+        if not self.valid_id(doc_id):
+            raise KeyError(doc_id)
+        path = self.cache.path(doc_id)
+        if path is None:
+            with self._lock:
+                self._readers.pop(doc_id, None)
+            raise KeyError(doc_id)
+        return path
+
+    def size(self, doc_id):
+        return os.path.getsize(self.path(doc_id))
+
+    def checkout_reader(self, doc_id):
+        """Empresta um PdfReader do documento (reaproveitado se houver um livre)."""
+        from PyPDF2 import PdfReader
+        path = self.path(doc_id)
+        with self._lock:
+            free = self._readers.get(doc_id)
+            if free:
+                self._readers.move_to_end(doc_id)
+                return free.pop()
+        # Documentos pequenos vêm do tier em memória; os grandes são lidos do disco sob demanda
+        data = self.cache.get(doc_id) if os.path.getsize(path) <= self.cache.max_item_memory else None
+        stream = io.BytesIO(data) if data is not None else open(path, "rb")
+        return PdfReader(stream)
+
+    def release_reader(self, doc_id, reader):
+        """Devolve o reader ao pool. PDFs criptografados não voltam: decrypt() altera o estado do reader."""
+        if reader.is_encrypted:
+            return
+        with self._lock:
+            free = self._readers.setdefault(doc_id, [])
+            free.append(reader)
+            self._readers.move_to_end(doc_id)
+            while sum(len(r) for r in self._readers.values()) > self.max_parsed:
+                oldest = next(iter(self._readers))
+                self._readers[oldest].pop(0)
+                if not self._readers[oldest]:
+                    del self._readers[oldest]
+
+    def delete(self, doc_id):
+        if not self.valid_id(doc_id):
+            raise KeyError(doc_id)
+        with self._lock:
+            self._readers.pop(doc_id, None)
+        self.cache.delete(doc_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+    return _store
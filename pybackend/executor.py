@@ -0,0 +1,177 @@
+# Execução do trabalho CPU-bound das rotas fora do event loop.
+# PyPDF2, reportlab e Pillow rodam em Python puro e seguram o loop enquanto
+# trabalham: uma marca d'água num PDF grande congelaria as demais rotas do
+# worker (SPA, estáticos, /api/progress). As rotas entregam a parte pesada a
+# run(), que a executa num pool compartilhado de threads (padrão) ou de
+# processos (CPU_EXECUTOR=process; a função e os argumentos precisam ser
+# serializáveis, ex.: caminhos de arquivo), com um limite de execuções
+# simultâneas por rota. Se o cliente desconecta, a tarefa é cancelada:
+# antes de começar, não roda; numa thread, para no próximo checkpoint();
+# num processo, termina e o resultado é descartado.
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import metrics
+import startup
+from logs import get_logger
+
+log = get_logger("executor")
+
+CPU_EXECUTOR = os.environ.get("CPU_EXECUTOR", "thread").lower()
+if CPU_EXECUTOR not in ("thread", "process"):
+    raise ValueError("CPU_EXECUTOR deve ser thread ou process")
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", os.cpu_count() or 1))
+# Execuções simultâneas por rota; as excedentes esperam a vez (ex.: "watermark=2,compress=1")
+ROUTE_CONCURRENCY_DEFAULT = int(os.environ.get("ROUTE_CONCURRENCY_DEFAULT", CPU_WORKERS))
+# Intervalo (segundos) entre as verificações de desconexão do cliente
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", 0.25))
+
+
+def _parse_limits(spec):
+    limits = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        route, _, value = item.partition("=")
+        limits[route.strip()] = max(1, int(value))
+    return limits
+
+
+ROUTE_CONCURRENCY = _parse_limits(os.environ.get("ROUTE_CONCURRENCY", ""))
+
+ACTIVE = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftoolkit_executor_active", "Tarefas CPU-bound em execução no pool, por rota.", ("route",)))
+WAITING = metrics.REGISTRY.register(metrics.Gauge(
+    "pdftoolkit_executor_waiting", "Tarefas esperando o limite de concorrência da rota.", ("route",)))
+CANCELLED = metrics.REGISTRY.register(metrics.Counter(
+    "pdftoolkit_executor_cancelled_total", "Tarefas canceladas porque o cliente desconectou.", ("route",)))
+
+
+class Cancelled(Exception):
+    """A tarefa foi cancelada (cliente desconectou) e parou num checkpoint()."""
+
+
+# Evento de cancelamento da tarefa atual (só nas threads do pool)
+_cancel_event = contextvars.ContextVar("executor_cancel", default=None)
+
+
+def checkpoint():
+    """Ponto de parada das tarefas em thread: Cancelled se o cliente já desconectou. No-op fora do pool."""
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise Cancelled()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_limits = {}
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if CPU_EXECUTOR == "process":
+                # "spawn" evita herdar threads/locks do uvicorn via fork
+                _pool = ProcessPoolExecutor(
+                    max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=startup.warm_process, initargs=("reportlab", "pymupdf", "pikepdf"),
+                )
+            else:
+                _pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+    return _pool
+
+
+def uses_processes():
+    """True se run() executa em outro processo (argumentos por caminho, não objetos abertos)."""
+    return CPU_EXECUTOR == "process"
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def _limit(route):
+    semaphore = _limits.get(route)
+    if semaphore is None:
+        semaphore = _limits[route] = asyncio.Semaphore(ROUTE_CONCURRENCY.get(route, ROUTE_CONCURRENCY_DEFAULT))
+    return semaphore
+
+
+async def _wait_disconnect(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+def _cancel(task, future, event):
+    # Na fila: não começa. Numa thread: para no próximo checkpoint(). Num processo: termina e é descartada.
+    # Cancelar também o future do asyncio descarta o resultado (ou o Cancelled) que ainda vai chegar.
+    task.cancel()
+    future.cancel()
+    if event is not None:
+        event.set()
+
+
+async def run(route, fn, *args, request=None):
+    """Executa fn(*args) no pool, respeitando o limite da rota, e devolve o resultado.
+
+    Com request, a tarefa é cancelada se o cliente desconectar antes do fim
+    (HTTPException 499). Em modo thread, fn roda com o contexto da requisição
+    (métricas por rota, logs). A vaga da rota só é liberada quando a tarefa
+    de fato termina, mesmo se cancelada no meio.
+    """
+    semaphore = _limit(route)
+    WAITING.inc(1, route)
+    try:
+        await semaphore.acquire()
+    finally:
+        WAITING.dec(1, route)
+    loop = asyncio.get_running_loop()
+    event = None
+    try:
+        if uses_processes():
+            task = get_pool().submit(fn, *args)
+        else:
+            event = threading.Event()
+            context = contextvars.copy_context()
+            context.run(_cancel_event.set, event)
+            task = get_pool().submit(context.run, fn, *args)
+    except BaseException:
+        semaphore.release()
+        raise
+    ACTIVE.inc(1, route)
+
+    def finished(_):
+        ACTIVE.dec(1, route)
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            pass  # loop já encerrado (desligamento)
+
+    task.add_done_callback(finished)
+    future = asyncio.wrap_future(task)
+    try:
+        if request is None:
+            return await future
+        watcher = asyncio.ensure_future(_wait_disconnect(request))
+        try:
+            await asyncio.wait((future, watcher), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+        if future.done():
+            return future.result()
+    except asyncio.CancelledError:
+        _cancel(task, future, event)
+        raise
+    _cancel(task, future, event)
+    CANCELLED.inc(1, route)
+    log.info("task_cancelled", route=route)
+    raise HTTPException(status_code=499, detail="Cliente desconectou.")
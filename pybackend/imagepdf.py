@@ -0,0 +1,130 @@
+# Montagem incremental de PDF a partir de imagens (/api/img2pdf).
+# Cada imagem vira uma página gravada direto no arquivo de saída assim que
+# fica pronta; só a lista de offsets/páginas fica em memória. JPEGs entram
+# no PDF como estão (filtro DCTDecode), sem decodificar nem recomprimir.
+import shutil
+
+# Tamanhos de página em pontos (retrato)
+PAGE_SIZES = {
+    "a3": (841.89, 1190.55),
+    "a4": (595.28, 841.89),
+    "a5": (419.53, 595.28),
+    "letter": (612.0, 792.0),
+    "legal": (612.0, 1008.0),
+}
+
+
+def _num(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+class ImagePdfWriter:
+    """Escreve um PDF com uma imagem por página, uma página de cada vez.
+
+    add_image() recebe o dicionário produzido por workers.prepare_image():
+    width/height em pixels, colorspace, filter, decode_parms e decode (opcionais),
+    rotate, os dados do stream em "data" (bytes) ou "path" (arquivo copiado sem
+    alteração) e "smask" opcional (canal alfa já comprimido com Flate).
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self._offsets = {}
+        self._kids = []
+        # 1 = catálogo e 2 = árvore de páginas, gravados em close()
+        self._next = 3
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _alloc(self):
+        num = self._next
+        self._next += 1
+        return num
+
+    def _object(self, num, body):
+        self._offsets[num] = self.out.tell()
+        self.out.write(f"{num} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _stream(self, num, entries, data=None, path=None, length=None):
+        self._offsets[num] = self.out.tell()
+        if length is None:
+            length = len(data)
+        self.out.write(f"{num} 0 obj\n<< {entries} /Length {length} >>\nstream\n".encode())
+        if path is not None:
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, self.out)
+        else:
+            self.out.write(data)
+        self.out.write(b"\nendstream\nendobj\n")
+
+    def add_image(self, image, page_size=None, margin=0):
+        """Acrescenta uma página; page_size (ex.: "a4") encaixa a imagem centralizada na página."""
+        width, height = image["width"], image["height"]
+        rotate = image.get("rotate", 0)
+        turned = rotate in (90, 270)
+        # Dimensões como a imagem aparece depois do /Rotate
+        shown_w, shown_h = (height, width) if turned else (width, height)
+        if page_size:
+            page_w, page_h = PAGE_SIZES[page_size]
+            if shown_w > shown_h:
+                page_w, page_h = page_h, page_w
+            scale = min((page_w - 2 * margin) / shown_w, (page_h - 2 * margin) / shown_h)
+            box_w, box_h = (page_h, page_w) if turned else (page_w, page_h)
+        else:
+            # Sem tamanho de página: 1 pixel = 1 ponto (72 dpi), como o Pillow fazia
+            scale = 1
+            box_w, box_h = width, height
+        draw_w, draw_h = width * scale, height * scale
+        x, y = (box_w - draw_w) / 2, (box_h - draw_h) / 2
+
+        image_num = self._alloc()
+        smask_num = self._alloc() if image.get("smask") else None
+        contents_num = self._alloc()
+        page_num = self._alloc()
+
+        entries = (
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {image['colorspace']} /BitsPerComponent 8 /Filter {image['filter']}"
+        )
+        if image.get("decode_parms"):
+            entries += f" /DecodeParms {image['decode_parms']}"
+        if image.get("decode"):
+            entries += " /Decode [" + " ".join(str(v) for v in image["decode"]) + "]"
+        if smask_num:
+            entries += f" /SMask {smask_num} 0 R"
+        if image.get("path") is not None:
+            self._stream(image_num, entries, path=image["path"], length=image["length"])
+        else:
+            self._stream(image_num, entries, data=image["data"])
+        if smask_num:
+            self._stream(
+                smask_num,
+                f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode",
+                data=image["smask"],
+            )
+        ops = f"q {_num(draw_w)} 0 0 {_num(draw_h)} {_num(x)} {_num(y)} cm /Im0 Do Q".encode()
+        self._stream(contents_num, "", data=ops)
+        page = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_num(box_w)} {_num(box_h)}] "
+            f"/Resources << /XObject << /Im0 {image_num} 0 R >> >> /Contents {contents_num} 0 R"
+        )
+        if rotate:
+            page += f" /Rotate {rotate}"
+        self._object(page_num, (page + " >>").encode())
+        self._kids.append(page_num)
+
+    @property
+    def page_count(self):
+        return len(self._kids)
+
+    def close(self):
+        """Grava a árvore de páginas, o catálogo, a tabela xref e o trailer."""
+        kids = " ".join(f"{n} 0 R" for n in self._kids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._kids)} >>".encode())
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self.out.tell()
+        lines = [f"xref\n0 {self._next}\n", "0000000000 65535 f \n"]
+        for num in range(1, self._next):
+            lines.append(f"{self._offsets[num]:010d} 00000 n \n")
+        self.out.write("".join(lines).encode())
+        self.out.write(f"trailer\n<< /Size {self._next} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
@@ -0,0 +1,217 @@
+# Gravação por atualização incremental (PDF 1.7, seção 7.5.6).
+# Em vez de regravar o documento inteiro, os bytes originais são mantidos
+# intactos e ao final são anexados só os objetos alterados ou novos, mais uma
+# nova tabela xref (ou stream xref, se o original usa uma) com /Prev apontando
+# para a anterior. O custo cresce com o tamanho da alteração, não do arquivo,
+# e assinaturas digitais existentes continuam válidas.
+# Serve para edições que só mexem em dicionários de página (rotate, sign,
+# pagenum); remoção/reordenação de páginas e criptografia continuam usando o
+# EditDocument (regravação completa).
+import io
+import re
+import time
+import zlib
+
+from PyPDF2 import PdfWriter
+from PyPDF2._page import PageObject
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    NameObject,
+    NumberObject,
+)
+
+import metrics
+from pages import LazyPages
+
+# Bytes lidos do fim do arquivo para achar o último startxref
+_TAIL_SIZE = 2048
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)\s+%%EOF", re.S)
+_OBJ_RE = re.compile(rb"\s*\d+\s+\d+\s+obj\b")
+_COPY_CHUNK = 1024 * 1024
+
+
+def _source_size(stream):
+    stream.seek(0, io.SEEK_END)
+    return stream.tell()
+
+
+def _last_xref(stream):
+    """(offset do último startxref, "table" ou "stream"), ou None se o final do arquivo não for confiável."""
+    size = _source_size(stream)
+    stream.seek(max(0, size - _TAIL_SIZE))
+    matches = list(_STARTXREF_RE.finditer(stream.read(_TAIL_SIZE)))
+    if not matches:
+        return None
+    offset = int(matches[-1].group(1))
+    if not 0 < offset < size:
+        return None
+    stream.seek(offset)
+    head = stream.read(32)
+    if head.lstrip().startswith(b"xref"):
+        return offset, "table"
+    if _OBJ_RE.match(head):
+        return offset, "stream"
+    return None
+
+
+def _object_count(reader):
+    """/Size do original. O PyPDF2 não copia /Size do stream xref para reader.trailer, então vem também das tabelas lidas."""
+    numbers = [num for table in reader.xref.values() for num in table]
+    numbers.extend(reader.xref_objStm)
+    return max([int(reader.trailer.get("/Size", 0))] + [num + 1 for num in numbers])
+
+
+def supported(reader):
+    """True se o PDF aceita atualização incremental (sem criptografia e com xref final legível)."""
+    if reader.is_encrypted or "/Root" not in reader.trailer:
+        return False
+    return _last_xref(reader.stream) is not None
+
+
+class IncrementalDocument:
+    """Mesma interface do EditDocument (pages, writable, writer, finish) para edições que não mudam a ordem das páginas.
+
+    As páginas alteradas são cópias rasas dos dicionários do reader (que pode
+    ser compartilhado pelo cache de documentos e nunca é modificado); objetos
+    novos (overlays, fontes, imagens) vão para um PdfWriter cuja numeração
+    começa depois do /Size do original.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.pages = LazyPages(reader)
+        self.password = None
+        self._size = _object_count(reader)
+        self.writer = PdfWriter()
+        # Objetos novos recebem números a partir de /Size (os do próprio writer, 1-3, nunca são gravados)
+        self.writer._objects.extend([None] * max(0, self._size - 1 - len(self.writer._objects)))
+        self._first_new = len(self.writer._objects)
+        self._changed = {}
+        self._started = time.perf_counter()
+
+    def writable(self, index):
+        page = self.pages[index]
+        ref = page.indirect_reference
+        if ref.idnum not in self._changed:
+            copy = PageObject(self.reader, ref)
+            copy.update(page)
+            self._changed[ref.idnum] = copy
+            self.pages[index] = copy
+        return self._changed[ref.idnum]
+
+    def select(self, indices):
+        raise NotImplementedError("Atualização incremental não altera a ordem das páginas.")
+
+    def finish(self):
+        if self.password is not None:
+            raise NotImplementedError("Criptografia exige regravar o documento inteiro.")
+        update = IncrementalUpdate(
+            self.reader, self._size, self._changed.values(), self.writer._objects[self._first_new:], self._first_new + 1
+        )
+        metrics.observe_stage("transform", time.perf_counter() - self._started)
+        metrics.count_pages(len(self._changed))
+        return update
+
+
+class IncrementalUpdate:
+    """Original + seção anexada; write(out) grava o arquivo completo (mesma interface de PdfWriter.write)."""
+
+    def __init__(self, reader, object_count, changed_pages, new_objects, first_number):
+        self.source = reader.stream
+        self.original_size = _source_size(self.source)
+        prev, kind = _last_xref(self.source)
+        objects = [(page.indirect_reference.idnum, page.indirect_reference.generation, page) for page in changed_pages]
+        objects += [(first_number + i, 0, obj) for i, obj in enumerate(new_objects) if obj is not None]
+        objects.sort(key=lambda item: item[0])
+        size = max([object_count] + [num + 1 for num, _, _ in objects])
+        trailer = DictionaryObject()
+        for key in ("/Root", "/Info", "/ID"):
+            if key in reader.trailer:
+                trailer[NameObject(key)] = reader.trailer.raw_get(key)
+        trailer[NameObject("/Prev")] = NumberObject(prev)
+        self.tail = self._build_tail(objects, size, trailer, kind)
+        self.size = self.original_size + len(self.tail)
+
+    def _build_tail(self, objects, size, trailer, kind):
+        # O original pode não terminar em quebra de linha (ex.: "%%EOF" sem \n)
+        self.source.seek(self.original_size - 1)
+        out = io.BytesIO()
+        if self.source.read(1) not in (b"\n", b"\r"):
+            out.write(b"\n")
+        entries = []
+        for num, gen, obj in objects:
+            entries.append((num, gen, self.original_size + out.tell()))
+            out.write(f"{num} {gen} obj\n".encode())
+            obj.write_to_stream(out, None)
+            out.write(b"\nendobj\n")
+        xref_offset = self.original_size + out.tell()
+        if kind == "stream":
+            # O original usa stream xref: a atualização também usa (leitores só de PDF 1.5+ já são exigidos)
+            entries.append((size, 0, xref_offset))
+            self._write_xref_stream(out, entries, size + 1, trailer)
+        else:
+            self._write_xref_table(out, entries, size, trailer)
+        out.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+        return out.getvalue()
+
+    @staticmethod
+    def _subsections(entries):
+        """Agrupa as entradas em faixas de números consecutivos."""
+        groups = []
+        for entry in entries:
+            if groups and entry[0] == groups[-1][-1][0] + 1:
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+        return groups
+
+    def _write_xref_table(self, out, entries, size, trailer):
+        # Entrada 0 (livre) como na tabela original: alguns leitores esperam a primeira subseção começando em 0
+        out.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+        for group in self._subsections(entries):
+            out.write(f"{group[0][0]} {len(group)}\n".encode())
+            for _, gen, offset in group:
+                out.write(f"{offset:010d} {gen:05d} n\r\n".encode())
+        trailer[NameObject("/Size")] = NumberObject(size)
+        out.write(b"trailer\n")
+        trailer.write_to_stream(out, None)
+        out.write(b"\n")
+
+    def _write_xref_stream(self, out, entries, size, trailer):
+        width = max(4, (max(offset for _, _, offset in entries).bit_length() + 7) // 8)
+        groups = self._subsections(entries)
+        rows = b"".join(
+            b"\x01" + offset.to_bytes(width, "big") + gen.to_bytes(2, "big")
+            for group in groups for _, gen, offset in group
+        )
+        data = zlib.compress(rows)
+        trailer[NameObject("/Type")] = NameObject("/XRef")
+        trailer[NameObject("/Size")] = NumberObject(size)
+        trailer[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+        trailer[NameObject("/Index")] = ArrayObject(
+            [NumberObject(n) for group in groups for n in (group[0][0], len(group))]
+        )
+        trailer[NameObject("/Filter")] = NameObject("/FlateDecode")
+        trailer[NameObject("/Length")] = NumberObject(len(data))
+        out.write(f"{size - 1} 0 obj\n".encode())
+        trailer.write_to_stream(out, None)
+        out.write(b"\nstream\n")
+        out.write(data)
+        out.write(b"\nendstream\nendobj\n")
+
+    def iter_chunks(self, chunk_size=_COPY_CHUNK):
+        """Bytes do arquivo final em blocos: o original é lido aos poucos, sem cópia intermediária."""
+        position = 0
+        while position < self.original_size:
+            self.source.seek(position)
+            chunk = self.source.read(min(chunk_size, self.original_size - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+        yield self.tail
+
+    def write(self, out):
+        for chunk in self.iter_chunks():
+            out.write(chunk)
@@ -0,0 +1,287 @@
+# Fila de jobs para conversões longas (pdf2img, img2pdf, compress, merge).
+# O estado (fila, progresso, erro, arquivo de resultado) fica num banco SQLite
+# compartilhado: qualquer worker do uvicorn responde ao polling de qualquer
+# job, sem sessão "grudada". O trabalho roda num pool de processos limitado;
+# run_job() é executado nesses processos, por isso o módulo não importa nada
+# pesado no topo (mesma regra de workers.py).
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+
+JOB_STORE_DIR = os.environ.get(
+    "JOB_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "jobs")
+)
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+# Jobs aguardando ou em execução (em todos os processos) antes de recusar novos
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 100))
+# Limite de bytes em JOB_STORE_DIR (entradas enviadas e resultados; 0 = sem limite)
+JOB_QUOTA_BYTES = int(os.environ.get("JOB_QUOTA_BYTES", 8 * 1024 * 1024 * 1024))
+
+JOB_KINDS = ("pdf2img", "img2pdf", "compress", "merge")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result_name TEXT,
+    media_type TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class JobStore:
+    """Estado dos jobs (e do progresso das conversões síncronas) num SQLite compartilhado."""
+
+    def __init__(self, directory=JOB_STORE_DIR, ttl=JOB_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+        self._local = threading.local()
+        self._last_eviction = 0.0
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+
+    def _connect(self):
+        # Uma conexão por thread: sqlite3 não permite compartilhá-las
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def create(self, job_id, kind, state="queued"):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, kind, state, progress, created, updated) VALUES (?, ?, ?, 0, ?, ?)",
+            (job_id, kind, state, now, now),
+        )
+
+    def track(self, conv_id):
+        """Registra o progresso de uma conversão síncrona (se ainda não estiver registrada)."""
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR IGNORE INTO jobs (id, kind, state, progress, created, updated) VALUES (?, 'conversion', 'running', 0, ?, ?)",
+            (conv_id, now, now),
+        )
+
+    def pending(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running') AND kind != 'conversion'"
+        ).fetchone()
+        return row[0]
+
+    def set_state(self, job_id, state):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (state, time.time(), job_id)
+        )
+
+    def set_progress(self, job_id, progress):
+        self._connect().execute(
+            "UPDATE jobs SET progress = ?, updated = ? WHERE id = ?", (int(progress), time.time(), job_id)
+        )
+
+    def finish(self, job_id, result_name=None, media_type=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, progress = ?, error = ?, result_name = ?, media_type = ?, updated = ? WHERE id = ?",
+            ("error" if error else "done", 100, error, result_name, media_type, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def result_path(self, job):
+        return os.path.join(self.job_dir(job["id"]), job["result_name"])
+
+    def delete(self, job_id):
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def evict_expired(self, interval=60):
+        """Remove jobs terminados (e seus arquivos) sem atualização há mais de ttl segundos; roda no máximo a cada `interval`."""
+        now = time.time()
+        if not self.ttl or now - self._last_eviction < interval:
+            return
+        self._last_eviction = now
+        # Jobs na fila ou em execução ficam (um worker pode estar usando os arquivos);
+        # o progresso das conversões síncronas sai por idade, mesmo se o cliente sumiu no meio
+        rows = self._connect().execute(
+            "SELECT id FROM jobs WHERE updated < ? AND (state IN ('done', 'error') OR kind = 'conversion')",
+            (now - self.ttl,),
+        ).fetchall()
+        for row in rows:
+            self.delete(row["id"])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+    return _store
+
+
+def validate(kind, params, n_inputs):
+    """Confere o tipo e os parâmetros antes de enfileirar; ValueError com a mensagem para o cliente."""
+    import workers
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Tipo de job inválido. Use {', '.join(JOB_KINDS)}.")
+    if kind == "merge" and n_inputs < 2:
+        raise ValueError("Envie pelo menos dois arquivos PDF.")
+    if kind != "merge" and kind != "img2pdf" and n_inputs != 1:
+        raise ValueError("Envie exatamente um arquivo ou doc_id.")
+    if kind == "img2pdf" and n_inputs < 1:
+        raise ValueError("Envie pelo menos uma imagem.")
+    if kind == "pdf2img":
+        if str(params.get("format", "png")).lower() not in workers.IMAGE_FORMATS:
+            raise ValueError("Formato inválido. Use png, jpeg ou webp.")
+        if not 1 <= int(params.get("dpi", 72)) <= 600:
+            raise ValueError("DPI deve estar entre 1 e 600.")
+        if params.get("pages"):
+            from pages import parse_pages
+            # Só a sintaxe: o número de páginas ainda não é conhecido (ver _pdf2img)
+            try:
+                parse_pages(params["pages"], 0)
+            except ValueError as e:
+                raise ValueError(f"Seleção de páginas inválida: {e}")
+    if kind == "img2pdf":
+        from imagepdf import PAGE_SIZES
+        if params.get("page_size") and str(params["page_size"]).lower() not in PAGE_SIZES:
+            raise ValueError(f"Tamanho de página inválido. Use {', '.join(PAGE_SIZES)}.")
+    if kind == "compress":
+        if params.get("level", "default") not in workers.COMPRESSION_LEVELS:
+            raise ValueError("Nível inválido. Use low, default ou high.")
+        if params.get("image_dpi") is not None and not 36 <= int(params["image_dpi"]) <= 600:
+            raise ValueError("image_dpi deve estar entre 36 e 600.")
+
+
+class _Progress:
+    """Grava o progresso no banco só quando o percentual muda."""
+
+    def __init__(self, store, job_id, start=0, end=100):
+        self.store = store
+        self.job_id = job_id
+        self.start = start
+        self.end = end
+        self.last = None
+
+    def __call__(self, done, total):
+        value = self.start + int((self.end - self.start) * done / max(total, 1))
+        if value != self.last:
+            self.last = value
+            self.store.set_progress(self.job_id, value)
+
+
+def _pdf2img(inputs, params, job_dir, job_id, progress):
+    import workers
+    from pages import parse_pages
+    fmt = str(params.get("format", "png")).lower()
+    ext = workers.IMAGE_FORMATS[fmt]
+    dpi = int(params.get("dpi", 72))
+    quality = max(1, min(int(params.get("quality", 85)), 100))
+    doc = workers._get_doc(inputs[0])
+    total = doc.page_count
+    pages = params.get("pages")
+    if pages:
+        # Mesma gramática do /api/pdf2img; página fora do documento falha o job em vez de sumir do ZIP
+        try:
+            pages = [i + 1 for i in parse_pages(pages, total, strict=True)]
+        except ValueError as e:
+            raise ValueError(f"Seleção de páginas inválida: {e}")
+    else:
+        pages = list(range(1, total + 1))
+    name = f"pdf2img_{job_id}.zip"
+    # Imagens já são comprimidas: entram no ZIP sem deflate
+    with zipfile.ZipFile(os.path.join(job_dir, name), "w", zipfile.ZIP_STORED) as zf:
+        for done, page_num in enumerate(pages, 1):
+            _, data = workers.render_page(inputs[0], page_num, dpi, fmt, quality)
+            zf.writestr(f"{job_id}_page{page_num}.{ext}", data)
+            progress(done, len(pages))
+    return name, "application/zip"
+
+
+def _img2pdf(inputs, params, job_dir, job_id, progress):
+    import workers
+    max_size = params.get("max_size")
+    workers.images_to_pdf(
+        inputs, os.path.join(job_dir, "output.pdf"), progress=progress,
+        page_size=(params.get("page_size") or "").lower() or None,
+        margin=max(0, int(params.get("margin", 0))),
+        max_size=int(max_size) if max_size else None,
+    )
+    return "output.pdf", "application/pdf"
+
+
+def _compress(inputs, params, job_dir, job_id, progress):
+    import workers
+    dest = os.path.join(job_dir, "compressed.pdf")
+    image_dpi = params.get("image_dpi")
+    image_quality = params.get("image_quality")
+    workers.compress_document(
+        inputs[0], dest, params.get("level", "default"),
+        int(image_dpi) if image_dpi else None,
+        max(1, min(int(image_quality), 100)) if image_quality else None,
+    )
+    if os.path.getsize(dest) >= os.path.getsize(inputs[0]):
+        # Nada a ganhar: o resultado é o arquivo original
+        shutil.copyfile(inputs[0], dest)
+    return "compressed.pdf", "application/pdf"
+
+
+def _merge(inputs, params, job_dir, job_id, progress):
+    import workers
+    workers.merge_documents(inputs, os.path.join(job_dir, "merged.pdf"), progress=progress)
+    return "merged.pdf", "application/pdf"
+
+
+_RUNNERS = {"pdf2img": _pdf2img, "img2pdf": _img2pdf, "compress": _compress, "merge": _merge}
+
+
+def run_job(job_id, kind, inputs, params):
+    """Executa o job num processo do pool; o resultado fica em job_dir e o estado no banco."""
+    store = get_job_store()
+    if store.get(job_id) is None:
+        # Cancelado (ou expirado) enquanto aguardava na fila
+        return
+    store.set_state(job_id, "running")
+    job_dir = store.job_dir(job_id)
+    try:
+        result_name, media_type = _RUNNERS[kind](inputs, params, job_dir, job_id, _Progress(store, job_id, end=99))
+        if params.get("linearize") and media_type == "application/pdf":
+            from linearize import linearize_in_place
+            linearize_in_place(os.path.join(job_dir, result_name))
+    except Exception as e:
+        store.finish(job_id, error=str(e) or e.__class__.__name__)
+        return
+    finally:
+        # Entradas enviadas no job não são mais necessárias (doc_ids ficam no armazenamento)
+        for path in inputs:
+            if os.path.dirname(path) == job_dir and os.path.exists(path):
+                os.remove(path)
+    store.finish(job_id, result_name, media_type)
+
+
+def job_info(job):
+    info = {key: job[key] for key in ("id", "kind", "state", "progress", "error", "created", "updated")}
+    if job["state"] == "done":
+        info["result_url"] = f"/api/jobs/{job['id']}/result"
+    return info
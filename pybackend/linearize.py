@@ -0,0 +1,112 @@
+# Saída linearizada ("fast web view", linearize=true nas rotas que geram PDF):
+# dicionário de linearização e hint tables no início do arquivo, seguidos dos
+# objetos da primeira página. Um visualizador que baixa por Range (ex.: pelo
+# /api/docs/{doc_id}) mostra a primeira página antes de o resto do arquivo chegar.
+#
+# O MuPDF deixou de linearizar (o PyMuPDF atual recusa linear=True), então a
+# reescrita é feita pelo QPDF, via pikepdf. Ele é opcional: sem ele (e sem um
+# PyMuPDF antigo que ainda linearize), linearize=true responde 501. Usado
+# também nos processos dos pools: nada pesado no topo (como em workers.py).
+import functools
+import io
+import os
+
+import metrics
+
+
+@functools.lru_cache(maxsize=None)
+def _backend():
+    try:
+        import pikepdf  # noqa: F401
+        return "pikepdf"
+    except ImportError:
+        pass
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    doc.new_page()
+    try:
+        doc.tobytes(linear=True)
+        return "fitz"
+    except (ValueError, RuntimeError):
+        return None
+    finally:
+        doc.close()
+
+
+def available():
+    """True se há como linearizar (pikepdf instalado, ou PyMuPDF com suporte a linear=True)."""
+    return _backend() is not None
+
+
+def require(linearize):
+    """Falha cedo (501), antes de qualquer trabalho, se linearize=true não puder ser atendido."""
+    if linearize and not available():
+        from fastapi import HTTPException
+        raise HTTPException(status_code=501, detail="Linearização indisponível neste servidor (instale o pikepdf).")
+
+
+def output_password(steps):
+    """Senha com que a saída de steps (formato do /api/pipeline) é criptografada, ou None."""
+    for step in reversed(steps):
+        if step.get("op") == "protect":
+            return step.get("password")
+    return None
+
+
+def linearize_file(src, dest, password=None):
+    """Reescreve o PDF src linearizado em dest (caminhos ou arquivos abertos).
+
+    Com password, abre a entrada criptografada e mantém a criptografia na saída.
+    """
+    with metrics.stage("linearize"):
+        if _backend() == "pikepdf":
+            import pikepdf
+            with pikepdf.open(src, password=password or "") as pdf:
+                pdf.save(dest, linearize=True, encryption=bool(password))
+            return
+        import fitz  # PyMuPDF
+        doc = fitz.open(src) if isinstance(src, str) else fitz.open(stream=src.read(), filetype="pdf")
+        try:
+            if password:
+                doc.authenticate(password)
+            if isinstance(dest, str):
+                doc.save(dest, linear=True, garbage=1)
+            else:
+                dest.write(doc.tobytes(linear=True, garbage=1))
+        finally:
+            doc.close()
+
+
+def linearize_in_place(path, password=None):
+    """Lineariza o arquivo em path (via um arquivo ao lado, trocado no fim)."""
+    tmp = f"{path}.linear"
+    try:
+        linearize_file(path, tmp, password)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def linearize_spooled(out, password=None):
+    """Lineariza um arquivo temporário de saída (ver spool.spooled_file); fecha out e devolve o novo, no fim."""
+    from spool import spooled_file
+    linear = spooled_file()
+    try:
+        out.seek(0)
+        linearize_file(out, linear, password)
+    except BaseException:
+        linear.close()
+        raise
+    finally:
+        out.close()
+    linear.seek(0, os.SEEK_END)
+    return linear
+
+
+def linearize_bytes(data, password=None):
+    """Versão linearizada dos bytes de um PDF (ex.: partes do split, geradas em memória)."""
+    src = io.BytesIO(data)
+    dest = io.BytesIO()
+    linearize_file(src, dest, password)
+    return dest.getvalue()
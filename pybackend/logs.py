@@ -0,0 +1,97 @@
+# Logging estruturado do backend (substitui os print() espalhados nas rotas).
+# Cada evento é uma linha (JSON por padrão) com nível, nome do evento e campos:
+#   log = get_logger("pdf2img"); log.info("concluido", conv_id=conv_id, pages=10)
+# Eventos de laço quente usam amostragem: log.debug("pagina", sample=0.01, ...).
+# LOG_LEVEL=OFF desliga tudo; abaixo do nível configurado a chamada volta
+# antes de montar qualquer texto.
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# json (uma linha por evento, para agregadores) ou text (key=value, para o terminal)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# Multiplica a taxa de amostragem dos eventos amostrados (1 = como declarado, 0 = nenhum)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))
+
+_OFF = logging.CRITICAL + 10
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+_root = logging.getLogger("pdftoolkit")
+_root.propagate = False
+if LOG_LEVEL == "OFF":
+    _root.setLevel(_OFF)
+    _root.disabled = True
+else:
+    _root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(_TextFormatter() if LOG_FORMAT == "text" else _JsonFormatter())
+    _root.addHandler(_handler)
+
+
+class EventLogger:
+    """Logger com eventos nomeados, campos estruturados e amostragem opcional."""
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, event, sample, fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample is not None:
+            rate = sample * LOG_SAMPLE_RATE
+            if rate < 1 and random.random() >= rate:
+                return
+            fields["sample"] = rate
+        self._logger.log(level, event, extra={"fields": fields})
+
+    def debug(self, event, sample=None, **fields):
+        self._log(logging.DEBUG, event, sample, fields)
+
+    def info(self, event, sample=None, **fields):
+        self._log(logging.INFO, event, sample, fields)
+
+    def warning(self, event, sample=None, **fields):
+        self._log(logging.WARNING, event, sample, fields)
+
+    def error(self, event, sample=None, **fields):
+        self._log(logging.ERROR, event, sample, fields)
+
+    def exception(self, event, **fields):
+        if self._logger.isEnabledFor(logging.ERROR):
+            self._logger.error(event, exc_info=True, extra={"fields": fields})
+
+    def enabled(self, level=logging.DEBUG):
+        return self._logger.isEnabledFor(level)
+
+
+def get_logger(name):
+    return EventLogger(_root.getChild(name))
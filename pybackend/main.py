@@ -1,199 +1,501 @@
 # Imports principais (devem vir antes do uso do app)
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, BackgroundTasks, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+import functools
+import hashlib
+import json
 import shutil
 import os
 from uuid import uuid4
-from typing import List
+from typing import List, Optional
 import threading
 import io
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from starlette.background import BackgroundTask
+
+import workers
+import executor
+import admission
+import results
+import linearize as linearizer
+import uploads
+from streaming import ZipStream
+from spool import UploadSpool, upload_spool, spooled_file, spooled_response, write_spooled, OUTPUT_CHUNK_SIZE
+from docstore import get_store
+import operations
+from pages import page_count, parse_pages
+import jobs
+from jobs import get_job_store
+from scratch import ScratchDir, ScratchSpace, get_scratch, scratch_dir, SCRATCH_SWEEP_INTERVAL
+import metrics
+import thumbnails
+import startup
+import split
+import merge
+from logs import get_logger
+
+log = get_logger("api")
+
+# Pool de processos para trabalho CPU-bound (rasterização, comparação). Criado sob demanda.
+RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", os.cpu_count() or 1))
+_render_pool = None
+
+
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        # "spawn" evita herdar threads/locks do uvicorn via fork
+        _render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=startup.warm_process,
+            initargs=("pymupdf", "pillow"),
+        )
+    return _render_pool
+
+
+# Máximo de arquivos por requisição do /api/batch
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 1000))
+
+# Pool de processos dos jobs em segundo plano (/api/jobs)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+_job_pool = None
+
+
+def get_job_pool():
+    global _job_pool
+    if _job_pool is None:
+        _job_pool = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=startup.warm_process,
+            initargs=("pymupdf", "pillow", "pikepdf"),
+        )
+    return _job_pool
+
+
+_job_space = None
+
+
+def get_job_space():
+    """Cota de disco dos jobs: as entradas enviadas são copiadas para JOB_STORE_DIR respeitando JOB_QUOTA_BYTES."""
+    global _job_space
+    if _job_space is None:
+        # max_age=0: a limpeza de JOB_STORE_DIR fica com JobStore.evict_expired
+        _job_space = ScratchSpace(jobs.JOB_STORE_DIR, jobs.JOB_QUOTA_BYTES, max_age=0)
+    return _job_space
+
+
+async def janitor():
+    """Remove periodicamente o que ficou para trás: diretórios temporários órfãos, documentos, jobs e uploads expirados."""
+    while True:
+        try:
+            await asyncio.to_thread(get_scratch().sweep)
+            await asyncio.to_thread(get_store().cache.evict_expired)
+            await asyncio.to_thread(thumbnails.get_renderer().cache.evict_expired)
+            if results.RESULT_CACHE_ENABLED:
+                await asyncio.to_thread(results.get_results().cache.evict_expired)
+            await asyncio.to_thread(get_job_store().evict_expired, 0)
+            await asyncio.to_thread(uploads.get_uploads().evict_expired)
+        except Exception:
+            log.exception("janitor_failed")
+        await asyncio.sleep(SCRATCH_SWEEP_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    cleaner = asyncio.create_task(janitor())
+    if startup.PRELOAD:
+        # Processos dos pools sobem (e se aquecem) já na subida do worker, não na primeira requisição
+        startup.prestart(get_render_pool(), RENDER_WORKERS)
+        if executor.uses_processes():
+            startup.prestart(executor.get_pool(), executor.CPU_WORKERS)
+    yield
+    cleaner.cancel()
+    # Encerra os pools ao desligar o servidor
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+    if _job_pool is not None:
+        _job_pool.shutdown(cancel_futures=True)
+    executor.shutdown()
+
 
 # Definição do app
-app = FastAPI(title="PDF Toolkit Python Backend")
+app = FastAPI(title="PDF Toolkit Python Backend", lifespan=lifespan)
+
+
+async def run_edit(request, spool, file, doc_id, route, steps, filename, incremental=False, password=None,
+                   invalid="Parâmetros inválidos", password_error="PDF protegido: envie a senha correta em password.",
+                   timing=False, linearize=False):
+    """Aplica steps (formato do /api/pipeline) no executor, fora do event loop, e devolve a resposta com o PDF.
+
+    invalid é o prefixo da mensagem de erro 400 (None = mensagem por
+    operação, como no pipeline); timing acrescenta o tempo de cada etapa nos
+    headers; linearize reescreve a saída linearizada (ver linearize.py). O
+    trabalho só começa quando o custo estimado cabe nos orçamentos do
+    controle de admissão (429 se não couber a tempo). Com o cache de
+    resultados ligado, a mesma entrada com os mesmos steps devolve a resposta
+    já gerada (nunca para criptografia; ver results.py).
+    """
+    linearizer.require(linearize)
+    key, cached = await results.find(
+        route, {"steps": steps, "incremental": incremental, "linearize": linearize, "doc": bool(doc_id)},
+        file, doc_id, steps=steps, password=password,
+    )
+    if cached is not None:
+        return cached
+    try:
+        async with admission.admitted(route, "edit", [(file, doc_id)], steps=len(steps)):
+            response = await _run_edit(
+                request, spool, file, doc_id, route, steps, filename, incremental, password, timing, linearize
+            )
+    except operations.PasswordError:
+        raise HTTPException(status_code=400, detail=password_error)
+    except operations.StepError as e:
+        detail = f"{invalid}: {e}" if invalid else f"Operação {e.index + 1} ({e.op}): parâmetros inválidos ({e})."
+        raise HTTPException(status_code=400, detail=detail)
+    if key is not None:
+        response = await results.get_results().remember(key, response)
+    return response
+
+
+async def _run_edit(request, spool, file, doc_id, route, steps, filename, incremental, password, timing, linearize):
+    if executor.uses_processes():
+        return await _run_edit_process(
+            request, spool, file, doc_id, route, steps, filename, incremental, password, timing, linearize
+        )
+
+    def edit():
+        timings = operations.Timings()
+        doc = operations.apply(spool.open_pdf(file, doc_id), steps, incremental, password, timings)
+        headers = {"X-Save-Mode": operations.save_mode(doc)}
+        if linearize or (steps and steps[-1]["op"] == "compress"):
+            out = spooled_file()
+            workers.save_edit(doc, out, steps, timings)
+            if linearize:
+                # Linearizar reescreve o arquivo inteiro, mesmo com incremental=true
+                out = linearizer.linearize_spooled(out, linearizer.output_password(steps))
+                timings.mark("linearize")
+                headers["X-Save-Mode"] = "full"
+            response = spool.file_response(out, filename, headers)
+        else:
+            # Atualização incremental sobre upload: o spool envia direto do original
+            response = spool.pdf_response(doc.finish(), filename, headers)
+            timings.mark("serialize")
+        if timing:
+            response.headers.update(timings.headers())
+        return response
+
+    return await executor.run(route, edit, request=request)
+
+
+async def _run_edit_process(request, spool, file, doc_id, route, steps, filename, incremental, password, timing, linearize):
+    # CPU_EXECUTOR=process: entrada e saída passam por arquivos num diretório
+    # temporário, criado só aqui e apagado depois do envio da resposta
+    scratch = get_scratch().session()
+    try:
+        spool.doc_mode = bool(doc_id)
+        src = await asyncio.to_thread(input_path, file, doc_id, scratch, "input.pdf")
+        dest = scratch.file("output.pdf")
+        mode, timings = await executor.run(
+            route, workers.edit_document, src, dest, steps, incremental, password, linearize, request=request
+        )
+        response = await asyncio.to_thread(spool.file_response, open(dest, "rb"), filename, {"X-Save-Mode": mode})
+    except BaseException:
+        scratch.close()
+        raise
+    if timing:
+        response.headers.update(timings.headers())
+    response.background = BackgroundTask(scratch.close)
+    return response
 
-# Endpoint para assinar PDF (customizável)
 
 # Endpoint para proteger PDF com senha
-from fastapi.responses import StreamingResponse
 @app.post("/api/edit/protect")
-async def protect_pdf(file: UploadFile = File(...), password: str = Form(...)):
-    from PyPDF2 import PdfReader, PdfWriter
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    writer.encrypt(password)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=protegido.pdf"})
+async def protect_pdf(
+    request: Request,
+    file: UploadFile = File(None),
+    password: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    incremental: bool = Form(False),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
+):
+    # Criptografar muda todas as strings e streams: sempre regrava o documento
+    # inteiro, mesmo com incremental=true (X-Save-Mode: full)
+    steps = [{"op": "protect", "password": password}]
+    return await run_edit(request, spool, file, doc_id, "protect", steps, "protegido.pdf", linearize=linearize)
 
 # Endpoint para remover senha de PDF
-from fastapi.responses import StreamingResponse
 @app.post("/api/edit/unprotect")
-async def unprotect_pdf(file: UploadFile = File(...), password: str = Form(...)):
-    from PyPDF2 import PdfReader, PdfWriter
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    if reader.is_encrypted:
-        if not reader.decrypt(password):
-            raise HTTPException(status_code=400, detail="Senha incorreta ou PDF não pode ser desbloqueado.")
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    # Não define senha, PDF sai desbloqueado
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=desprotegido.pdf"})
+async def unprotect_pdf(request: Request, file: UploadFile = File(None), password: str = Form(...), doc_id: Optional[str] = Form(None), linearize: bool = Form(False), spool: UploadSpool = Depends(upload_spool)):
+    # Abre com a senha e regrava sem nenhuma: o PDF sai desbloqueado
+    return await run_edit(
+        request, spool, file, doc_id, "unprotect", [], "desprotegido.pdf", password=password,
+        password_error="Senha incorreta ou PDF não pode ser desbloqueado.", linearize=linearize,
+    )
 
 # Endpoint para assinar PDF com imagem (dataUrl base64)
 @app.post("/api/edit/sign")
 async def sign_pdf(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
     x: int = Form(50),
     y: int = Form(50),
-    signature_img: str = Form(None)
+    signature_img: str = Form(None),
+    incremental: bool = Form(False),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    from PyPDF2 import PdfReader, PdfWriter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.utils import ImageReader
-    import base64
-    import re
-    from PIL import Image
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for i, page in enumerate(reader.pages):
-        packet = io.BytesIO()
-        width = float(page.mediabox.width)
-        height = float(page.mediabox.height)
-        can = canvas.Canvas(packet, pagesize=(width, height))
-        # Só assina a primeira página
-        if i == 0 and signature_img:
-            # Extrair base64 puro
-            match = re.match(r"data:image/(png|jpeg);base64,(.*)", signature_img)
-            if match:
-                img_data = base64.b64decode(match.group(2))
-                img = Image.open(io.BytesIO(img_data))
-                # Ajustar tamanho da assinatura se necessário
-                max_w, max_h = 200, 60
-                ratio = min(max_w / img.width, max_h / img.height, 1)
-                new_w, new_h = int(img.width * ratio), int(img.height * ratio)
-                img = img.resize((new_w, new_h), Image.LANCZOS)
-                img_io = io.BytesIO()
-                img.save(img_io, format='PNG')
-                img_io.seek(0)
-                can.drawImage(ImageReader(img_io), x, height - y - new_h, width=new_w, height=new_h, mask='auto')
-        can.save()
-        packet.seek(0)
-        from PyPDF2 import PdfReader as RLReader
-        sig_pdf = RLReader(packet)
-        sig_page = sig_pdf.pages[0]
-        page.merge_page(sig_page)
-        writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=assinado.pdf"})
+    # Só assina a primeira página
+    steps = [{"op": "sign", "x": x, "y": y, "signature_img": signature_img}]
+    return await run_edit(request, spool, file, doc_id, "sign", steps, "assinado.pdf", incremental, linearize=linearize)
 
 
 # --- ENDPOINTS FUNCIONAIS PARA TODOS OS MENUS ---
 # (Bloco duplicado removido para evitar conflitos)
 
-# Controle de progresso global (simples, por id)
-conversion_progress = {}
-
-from PyPDF2 import PdfReader, PdfWriter
 @app.post("/api/edit/split")
-async def split_pdf(file: UploadFile = File(...), ranges: str = Form(...)):
-    """Divide o PDF conforme intervalos (ex: 1-1,2-2,3-5) e retorna ZIP."""
-    import zipfile
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    zip_buffer = io.BytesIO()
-    for idx, part in enumerate(ranges.split(",")):
-        writer = PdfWriter()
-        if "-" in part:
-            start, end = [int(x)-1 for x in part.split("-")]
-        else:
-            start = end = int(part)-1
-        for i in range(start, end+1):
-            if 0 <= i < len(reader.pages):
-                writer.add_page(reader.pages[i])
-        out = io.BytesIO()
-        writer.write(out)
-        out.seek(0)
-        with zipfile.ZipFile(zip_buffer, "a") as zipf:
-            zipf.writestr(f"split_{idx+1}.pdf", out.read())
-    zip_buffer.seek(0)
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": "attachment; filename=splits.zip"})
+async def split_pdf(
+    file: UploadFile = File(None),
+    ranges: Optional[str] = Form(None),
+    mode: str = Form("ranges"),
+    every: Optional[int] = Form(None),
+    max_bytes: Optional[int] = Form(None),
+    doc_id: Optional[str] = Form(None),
+    linearize: bool = Form(False),
+    scratch: ScratchDir = Depends(scratch_dir),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Divide o PDF e retorna um ZIP (em streaming) com as partes.
+
+    Modos: ranges (intervalos, ex: 1-1,2-2,3-5), every (a cada `every` páginas),
+    size (partes de até `max_bytes`, estimado) e bookmarks (uma parte por
+    marcador de primeiro nível). As partes são gravadas em paralelo no pool de
+    processos, cada uma só com os recursos que as suas páginas usam (e
+    linearizada, com linearize=true).
+    """
+    mode = mode.lower()
+    if mode not in split.SPLIT_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo inválido. Use {', '.join(split.SPLIT_MODES)}.")
+    if mode == "ranges" and not ranges:
+        raise HTTPException(status_code=400, detail="Informe os intervalos (ex: 1-3,4-4,5-8).")
+    if mode == "every" and (every is None or every < 1):
+        raise HTTPException(status_code=400, detail="every deve ser pelo menos 1.")
+    if mode == "size" and (max_bytes is None or max_bytes < 1024):
+        raise HTTPException(status_code=400, detail="max_bytes deve ser pelo menos 1024.")
+    linearizer.require(linearize)
+    pdf_path = await asyncio.to_thread(input_path, file, doc_id, scratch, "split.pdf")
+    await ticket.admit_paths("split", "split", [pdf_path])
+    try:
+        with metrics.stage("parse"):
+            parts = await asyncio.to_thread(split.plan, pdf_path, mode, ranges, every, max_bytes)
+    except ValueError as e:
+        detail = "Intervalos inválidos. Use o formato 1-3,4-4,5-8." if mode == "ranges" else str(e)
+        raise HTTPException(status_code=400, detail=detail)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Não foi possível ler o PDF.")
+
+    async def split_stream():
+        # Janela ordenada (como no img2pdf): até 2 partes por worker sendo
+        # gravadas, entregues ao ZIP na ordem do plano assim que ficam prontas
+        zs = ZipStream()
+        loop = asyncio.get_running_loop()
+        pool = get_render_pool()
+        pending = iter(parts)
+        window = []
+        started = time.perf_counter()
+        try:
+            while True:
+                while len(window) < RENDER_WORKERS * 2:
+                    part = next(pending, None)
+                    if part is None:
+                        break
+                    name, indices = part
+                    window.append((name, len(indices), loop.run_in_executor(pool, workers.split_part, pdf_path, indices, linearize)))
+                if not window:
+                    break
+                name, count, task = window.pop(0)
+                data = await task
+                metrics.count_pages(count)
+                # Deflate em thread (o zlib libera o GIL): não segura o event loop
+                yield await asyncio.to_thread(zs.add, name, data)
+            yield zs.close()
+            metrics.observe_stage("serialize", time.perf_counter() - started)
+        finally:
+            for _, _, task in window:
+                task.cancel()
+
+    return StreamingResponse(
+        split_stream(), media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=splits.zip", "X-Split-Parts": str(len(parts))},
+    )
 
 @app.post("/api/edit/compress")
-async def compress_pdf(file: UploadFile = File(...), level: str = Form("default")):
-    from PyPDF2 import PdfReader, PdfWriter
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=compressed.pdf"})
+async def compress_pdf(
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    level: str = Form("default"),
+    image_dpi: Optional[int] = Form(None),
+    image_quality: Optional[int] = Form(None),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
+):
+    """Comprime o PDF: recompacta streams, funde objetos duplicados, usa object streams e, no nível high, reamostra imagens.
+
+    Com linearize=true, o resultado (ou o original, se a compressão não
+    ganhar nada) sai linearizado.
+    """
+    if level not in workers.COMPRESSION_LEVELS:
+        raise HTTPException(status_code=400, detail="Nível inválido. Use low, default ou high.")
+    if image_dpi is not None and not 36 <= image_dpi <= 600:
+        raise HTTPException(status_code=400, detail="image_dpi deve estar entre 36 e 600.")
+    if image_quality is not None:
+        image_quality = max(1, min(image_quality, 100))
+    linearizer.require(linearize)
+    key, cached = await results.find(
+        "compress",
+        {"level": level, "image_dpi": image_dpi, "image_quality": image_quality, "linearize": linearize, "doc": bool(doc_id)},
+        file, doc_id,
+    )
+    if cached is not None:
+        return cached
+    # Com CPU_EXECUTOR=process, o processo do pool lê e grava por caminho
+    scratch = get_scratch().session() if executor.uses_processes() else None
+    out = None
+    try:
+        async with admission.admitted("compress", "compress", [(file, doc_id)]):
+            with metrics.stage("transform"):
+                if scratch is not None:
+                    spool.doc_mode = bool(doc_id)
+                    src = await asyncio.to_thread(input_path, file, doc_id, scratch, "input.pdf")
+                    original_size = os.path.getsize(src)
+                    dest = scratch.file("output.pdf")
+                    await executor.run("compress", workers.compress_document, src, dest, level, image_dpi, image_quality, request=request)
+                    out = open(dest, "r+b")
+                    out.seek(0, os.SEEK_END)
+                else:
+                    src = spool.open_buffer(file, doc_id)
+                    original_size = len(src)
+                    out = spooled_file()
+                    await executor.run("compress", workers.compress_document, src, out, level, image_dpi, image_quality, request=request)
+            compressed_size = out.tell()
+            if compressed_size >= original_size:
+                # Nada a ganhar: devolve o arquivo original em vez de um maior
+                out.seek(0)
+                out.truncate()
+                if scratch is not None:
+                    with open(src, "rb") as f:
+                        shutil.copyfileobj(f, out)
+                else:
+                    out.write(src)
+                compressed_size = original_size
+            if linearize:
+                out = await asyncio.to_thread(linearizer.linearize_spooled, out)
+                compressed_size = out.tell()
+        headers = {"X-Original-Size": str(original_size), "X-Compressed-Size": str(compressed_size), "X-Compression-Level": level}
+        response = await asyncio.to_thread(spool.file_response, out, "compressed.pdf", headers)
+    except BaseException as e:
+        if out is not None:
+            out.close()
+        if scratch is not None:
+            scratch.close()
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=400, detail=f"Não foi possível comprimir: {e}")
+        raise
+    if scratch is not None:
+        response.background = BackgroundTask(scratch.close)
+    if key is not None:
+        response = await results.get_results().remember(key, response)
+    return response
 
 # Editar conteúdo (stub: só regrava)
 @app.post("/api/edit/content")
-async def edit_content(file: UploadFile = File(...)):
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=edited.pdf"})
+async def edit_content(request: Request, file: UploadFile = File(None), doc_id: Optional[str] = Form(None), linearize: bool = Form(False), spool: UploadSpool = Depends(upload_spool)):
+    return await run_edit(request, spool, file, doc_id, "content", [], "edited.pdf", linearize=linearize)
 # Endpoint para juntar múltiplos PDFs
 @app.post("/api/merge")
-async def merge_pdfs(files: List[UploadFile] = File(...)):
+async def merge_pdfs(
+    files: List[UploadFile] = File(None),
+    doc_ids: Optional[str] = Form(None),
+    ranges: Optional[str] = Form(None),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Junta os PDFs na ordem enviada (arquivos e depois doc_ids) e devolve o resultado em streaming.
+
+    ranges: lista JSON com a seleção de páginas de cada entrada, na mesma
+    ordem (ex.: ["1-3", null, "2,5-"]; null ou "" = todas). As entradas são
+    lidas em paralelo; fontes e imagens idênticas entre elas são gravadas uma
+    vez só, e os marcadores de cada uma são mantidos. Com linearize=true, o
+    resultado é gravado inteiro e linearizado antes do envio (sem streaming).
+    """
+    linearizer.require(linearize)
+    files = files or []
     try:
-        from PyPDF2 import PdfMerger
-    except ImportError:
-        raise HTTPException(status_code=500, detail="PyPDF2 não instalado. Use: pip install pypdf2")
-    if not files or len(files) < 2:
+        ids = json.loads(doc_ids) if doc_ids else []
+        selections = json.loads(ranges) if ranges else []
+        if not isinstance(ids, list) or not isinstance(selections, list):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="doc_ids e ranges devem ser listas JSON.")
+    sources = [(f, None, f.filename or f"arquivo {i + 1}") for i, f in enumerate(files)]
+    sources += [(None, doc_id, doc_id[:12]) for doc_id in ids]
+    if len(sources) < 2:
         raise HTTPException(status_code=400, detail="Envie pelo menos dois arquivos PDF.")
-    merger = PdfMerger()
-    temp_paths = []
-    for f in files:
-        temp_path = os.path.join(UPLOAD_DIR, f"merge_{uuid4()}.pdf")
-        with open(temp_path, "wb") as out:
-            shutil.copyfileobj(f.file, out)
-        merger.append(temp_path)
-        temp_paths.append(temp_path)
-    output_stream = io.BytesIO()
-    merger.write(output_stream)
-    merger.close()
-    # Limpar temporários
-    for p in temp_paths:
-        os.remove(p)
-    output_stream.seek(0)
-    from starlette.responses import StreamingResponse
-    return StreamingResponse(output_stream, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=merged.pdf"})
+    if len(selections) > len(sources):
+        raise HTTPException(status_code=400, detail="ranges tem mais itens do que arquivos enviados.")
+    selections += [None] * (len(sources) - len(selections))
+    await ticket.admit_inputs("merge", "merge", [(upload, doc_id) for upload, doc_id, _ in sources])
+    streams = [spool.open(upload, doc_id) for upload, doc_id, _ in sources]
+
+    async def parse(stream, selection, name):
+        try:
+            return await asyncio.to_thread(merge.open_input, stream, selection, name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{name}: {e}")
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"{name}: não é um PDF válido.")
+
+    with metrics.stage("parse"):
+        inputs = await asyncio.gather(*(
+            parse(stream, selection, name) for stream, selection, (_, _, name) in zip(streams, selections, sources)
+        ))
+    metrics.count_pages(sum(len(doc.pages) for doc in inputs))
+
+    if linearize:
+        def write_linear():
+            # A linearização reordena o arquivo inteiro: grava tudo antes de enviar
+            out = spooled_file()
+            with metrics.stage("serialize"):
+                for chunk in merge.iter_merge(inputs, OUTPUT_CHUNK_SIZE):
+                    out.write(chunk)
+            return linearizer.linearize_spooled(out)
+
+        return spooled_response(await asyncio.to_thread(write_linear), "merged.pdf")
+
+    def merged():
+        # Gerador síncrono: o Starlette o consome em threadpool, fora do event loop
+        with metrics.stage("serialize"):
+            yield from merge.iter_merge(inputs, OUTPUT_CHUNK_SIZE)
+
+    return StreamingResponse(merged(), media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=merged.pdf"})
 # Permitir frontend local
 @app.post("/api/start")
 def start_conversion():
     conv_id = str(uuid4())
-    conversion_progress[conv_id] = 0
-    print(f"[LOG] Novo ID de conversão criado: {conv_id}")
+    # Progresso fica no banco de jobs, visível para todos os workers do uvicorn
+    get_job_store().track(conv_id)
+    log.debug("conversion_created", conv_id=conv_id)
     return {"id": conv_id}
 
 # Permitir frontend local
@@ -203,439 +505,978 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Clientes tus em outra origem precisam ler Location, Upload-Offset etc.
+    expose_headers=list(uploads.TUS_HEADERS),
 )
+# Métricas por rota (/api/metrics); com METRICS_ENABLED=0 nem é instalado
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
-# Pasta para arquivos temporários
-UPLOAD_DIR = "tmp"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# Servir frontend build (Vite)
-from fastapi.responses import HTMLResponse
-from starlette.requests import Request
-
-
-
-
-# Servir assets do Vite em /assets
-
+# Servir frontend build (Vite). Caminhos absolutos: não dependem do diretório
+# em que o servidor foi iniciado
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DIST_DIR = os.path.join(BASE_DIR, "dist")
 # Servir assets do build Vite
-app.mount("/assets", StaticFiles(directory="dist/assets"), name="assets")
+app.mount("/assets", StaticFiles(directory=os.path.join(DIST_DIR, "assets")), name="assets")
 # Servir arquivos públicos (ex: pdf.worker.min.js, logo)
-app.mount("/public", StaticFiles(directory="public"), name="public")
+app.mount("/public", StaticFiles(directory=os.path.join(BASE_DIR, "public")), name="public")
 # Servir SPA do Vite (dist)
-app.mount("/dist", StaticFiles(directory="dist"), name="dist")
-
-
-
-
-# Servir index.html em /
-
-# Endpoint raiz: serve index.html do build Vite
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    index_path = os.path.join(os.path.dirname(__file__), "dist/index.html")
-    if os.path.exists(index_path):
-        with open(index_path, encoding="utf-8") as f:
-            return HTMLResponse(f.read(), status_code=200)
-    return HTMLResponse(status_code=404, content="index.html não encontrado")
-
-
-# Fallback: servir index.html para qualquer GET não-API
-@app.get("/{full_path:path}", response_class=HTMLResponse)
-async def spa_fallback(full_path: str):
-    # Não intercepta APIs nem assets nem arquivos públicos
-    if full_path.startswith("api/") or full_path.startswith("assets/") or full_path.startswith("public/") or full_path.startswith("dist/"):
-        return HTMLResponse(status_code=404, content="Not Found")
-    index_path = os.path.join(os.path.dirname(__file__), "dist/index.html")
-    if os.path.exists(index_path):
-        with open(index_path, encoding="utf-8") as f:
-            return HTMLResponse(f.read(), status_code=200)
-    return HTMLResponse(status_code=404, content="index.html não encontrado")
+app.mount("/dist", StaticFiles(directory=DIST_DIR), name="dist")
 
 
-from fastapi.responses import StreamingResponse
-import zipfile
-import io
 
 
-from typing import Optional
-import json
 @app.post("/api/pdf2img")
-async def pdf_to_img(file: UploadFile = File(...), conv_id: Optional[str] = Form(None), pages: Optional[str] = Form(None)):
-    print(f"[LOG] Recebido upload para PDF2IMG com conv_id={conv_id}")
-    print(f"[LOG] Estado inicial do progresso: {conversion_progress.get(conv_id)}")
-    """Converte PDF em imagens (uma por página) e retorna um ZIP para download. Progresso via polling."""
+async def pdf_to_img(
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    conv_id: Optional[str] = Form(None),
+    pages: Optional[str] = Form(None),
+    dpi: int = Form(72),
+    format: str = Form("png"),
+    quality: int = Form(85),
+    scratch: ScratchDir = Depends(scratch_dir),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Converte PDF em imagens (uma por página) e retorna um ZIP para download. Progresso via polling.
+
+    As páginas são renderizadas em paralelo no pool de processos; o event loop
+    fica livre para atender outros pedidos (inclusive o polling de progresso).
+    O ZIP é enviado em streaming: cada página entra no arquivo assim que fica pronta.
+    """
     try:
         import fitz  # PyMuPDF
     except ImportError:
         raise HTTPException(status_code=500, detail="PyMuPDF não instalado. Use: pip install pymupdf")
+    fmt = format.lower()
+    if fmt not in workers.IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use png, jpeg ou webp.")
+    if not 1 <= dpi <= 600:
+        raise HTTPException(status_code=400, detail="DPI deve estar entre 1 e 600.")
+    quality = max(1, min(quality, 100))
+    ext = workers.IMAGE_FORMATS[fmt]
     if not conv_id:
-        from uuid import uuid4
         conv_id = str(uuid4())
-    pdf_path = os.path.join(UPLOAD_DIR, f"{conv_id}.pdf")
-    with open(pdf_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    doc = fitz.open(pdf_path)
-    img_paths = []
-    total = doc.page_count
-    # Se páginas foram especificadas, extrair apenas essas
+    progress = get_job_store()
+    await asyncio.to_thread(progress.track, conv_id)
+
+    def open_input():
+        # Cópia do upload e contagem de páginas numa thread só, fora do event loop
+        path = input_path(file, doc_id, scratch, f"{conv_id}.pdf")
+        try:
+            with fitz.open(path) as doc:
+                return path, doc.page_count
+        except Exception:
+            raise HTTPException(status_code=400, detail="Não foi possível ler o PDF.")
+
+    pdf_path, total = await asyncio.to_thread(open_input)
+    # Se páginas foram especificadas (lista JSON ou intervalos), renderizar apenas essas
     if pages:
         try:
-            selected_pages = json.loads(pages)
-            # Garantir que são inteiros válidos e dentro do range
-            selected_pages = [p for p in selected_pages if isinstance(p, int) and 1 <= p <= total]
-        except Exception as e:
-            selected_pages = []
+            selected_pages = [i + 1 for i in parse_pages(pages, total)]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Seleção de páginas inválida: {e}")
     else:
         selected_pages = list(range(1, total+1))
-    for idx, page_num in enumerate(selected_pages):
-        page = doc.load_page(page_num-1)
-        print(f"[LOG] PDF2IMG conv_id={conv_id} página {page_num}/{total}")
-        pix = page.get_pixmap()
-        img_path = os.path.join(UPLOAD_DIR, f"{conv_id}_page{page_num}.png")
-        pix.save(img_path)
-        img_paths.append(img_path)
-        conversion_progress[conv_id] = int(((idx+1)/len(selected_pages))*90)  # 0-90% durante conversão
-    doc.close()
-    # Compactar imagens em um ZIP
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zipf:
-        for img_path in img_paths:
-            zipf.write(img_path, os.path.basename(img_path))
-    zip_buffer.seek(0)
-    # Limpar imagens temporárias
-    for p in img_paths:
-        os.remove(p)
-    os.remove(pdf_path)
-    conversion_progress[conv_id] = 100  # 100% ao finalizar
-    print(f"[LOG] PDF2IMG conv_id={conv_id} FINALIZADO")
-    return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename=pdf2img_{conv_id}.zip", "X-Conversion-Id": conv_id})
+    # Cache de resultados por página: uma nova conversão só renderiza o que ainda não foi feito
+    page_keys = None
+    to_render = len(selected_pages)
+    if results.cacheable("pdf2img"):
+        digest = await asyncio.to_thread(results.input_digest, None, doc_id, None if doc_id else pdf_path)
+        params = {"dpi": dpi, "format": fmt, "quality": quality}
+        page_keys = {n: results.result_key("pdf2img", digest, dict(params, page=n)) for n in selected_pages}
+        to_render = await asyncio.to_thread(results.get_results().missing, page_keys.values())
+    try:
+        # Custo pelas páginas que serão de fato renderizadas, no DPI pedido
+        if to_render:
+            await ticket.admit("pdf2img", "pdf2img", os.path.getsize(pdf_path), to_render,
+                               dpi=dpi, in_flight=RENDER_WORKERS * 2)
+    except HTTPException:
+        await asyncio.to_thread(progress.finish, conv_id, error="servidor ocupado")
+        raise
+    log.info("pdf2img_started", conv_id=conv_id, pages=len(selected_pages), dpi=dpi, format=fmt)
+
+    async def pdf2img_stream():
+        # Janela deslizante: no máximo 2 páginas por worker em voo, para que a
+        # memória fique limitada a poucas páginas mesmo se o cliente for lento
+        zs = ZipStream()
+        loop = asyncio.get_running_loop()
+        pool = get_render_pool()
+
+        async def render(page_num):
+            async def compute():
+                _, data = await loop.run_in_executor(pool, workers.render_page, pdf_path, page_num, dpi, fmt, quality)
+                return data
+            return page_num, await results.get_results().cached(page_keys[page_num], compute)
+
+        pending_pages = iter(selected_pages)
+        in_flight = set()
+        done = 0
+        last = 0
+        finished_ok = False
+        started = time.perf_counter()
+        try:
+            while True:
+                while len(in_flight) < RENDER_WORKERS * 2:
+                    page_num = next(pending_pages, None)
+                    if page_num is None:
+                        break
+                    if page_keys is None:
+                        in_flight.add(loop.run_in_executor(pool, workers.render_page, pdf_path, page_num, dpi, fmt, quality))
+                    else:
+                        in_flight.add(asyncio.ensure_future(render(page_num)))
+                if not in_flight:
+                    break
+                finished, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    page_num, data = task.result()
+                    done += 1
+                    metrics.count_pages()
+                    log.debug("pdf2img_page", sample=0.01, conv_id=conv_id, page=page_num, size=len(data))
+                    value = int((done/len(selected_pages))*90)  # 0-90% durante conversão
+                    if value != last:
+                        await asyncio.to_thread(progress.set_progress, conv_id, value)
+                        last = value
+                    yield zs.add(f"{conv_id}_page{page_num}.{ext}", data, compress=False)
+            yield zs.close()
+            await asyncio.to_thread(progress.finish, conv_id)  # 100% ao finalizar
+            finished_ok = True
+            elapsed = time.perf_counter() - started
+            metrics.observe_stage("transform", elapsed)
+            log.info("pdf2img_finished", conv_id=conv_id, pages=done, ms=round(elapsed * 1000))
+        except BaseException as e:
+            if not finished_ok:
+                # Falha no meio (renderização, ZIP) ou cliente desconectado: o polling
+                # mostra o erro em vez de parar abaixo de 100%. Sem zs.close() o ZIP
+                # fica sem diretório central e a exceção aborta a resposta, então o
+                # corte é detectável no cliente. Sem await: numa desconexão o escopo
+                # já está cancelado e qualquer await seria interrompido
+                error = "falha na conversão" if isinstance(e, Exception) else "conversão cancelada"
+                loop.run_in_executor(None, functools.partial(progress.finish, conv_id, error=error))
+                log.warning("pdf2img_failed", conv_id=conv_id, pages=done, error=repr(e))
+            raise
+        finally:
+            # Cliente desconectou ou houve erro: descarta o que ainda não começou
+            # (o upload copiado é apagado junto com o diretório temporário)
+            for task in in_flight:
+                task.cancel()
+
+    return StreamingResponse(pdf2img_stream(), media_type="application/zip", headers={"Content-Disposition": f"attachment; filename=pdf2img_{conv_id}.zip", "X-Conversion-Id": conv_id})
 
 
 
 
 # Novo endpoint: aceita várias imagens e gera PDF multi-página
-from typing import List
 @app.post("/api/img2pdf")
-async def img_to_pdf(files: List[UploadFile] = File(...), conv_id: str = Form(...)):
-    print(f"[LOG] Recebido upload para IMG2PDF com conv_id={conv_id}")
-    print(f"[LOG] Estado inicial do progresso: {conversion_progress.get(conv_id)}")
-    """Converte várias imagens em um PDF multi-página. Progresso via polling."""
+async def img_to_pdf(
+    files: List[UploadFile] = File(...),
+    conv_id: str = Form(...),
+    page_size: Optional[str] = Form(None),
+    margin: int = Form(0),
+    max_size: Optional[int] = Form(None),
+    linearize: bool = Form(False),
+    scratch: ScratchDir = Depends(scratch_dir),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Converte várias imagens em um PDF multi-página. Progresso via polling.
+
+    As páginas são gravadas uma a uma: JPEGs entram no PDF sem recompressão e
+    os demais formatos são decodificados em paralelo no pool de processos.
+    page_size (a4, letter, ...) encaixa cada imagem numa página desse tamanho;
+    max_size reduz imagens cujo maior lado passe desse número de pixels;
+    linearize=true lineariza o PDF gerado.
+    """
+    from imagepdf import ImagePdfWriter, PAGE_SIZES
+    if page_size:
+        page_size = page_size.lower()
+        if page_size not in PAGE_SIZES:
+            raise HTTPException(status_code=400, detail=f"Tamanho de página inválido. Use {', '.join(PAGE_SIZES)}.")
+    if max_size is not None and max_size < 16:
+        raise HTTPException(status_code=400, detail="max_size deve ser pelo menos 16 pixels.")
+    linearizer.require(linearize)
+    margin = max(0, margin)
+    progress = get_job_store()
+    await asyncio.to_thread(progress.track, conv_id)
+    img_paths = [
+        await asyncio.to_thread(scratch.save, file, f"{idx}{os.path.splitext(file.filename or '')[1].lower()}")
+        for idx, file in enumerate(files)
+    ]
     try:
-        from PIL import Image
-    except ImportError:
-        raise HTTPException(status_code=500, detail="Pillow não instalado. Use: pip install pillow")
-    img_paths = []
-    for idx, file in enumerate(files):
-        img_path = os.path.join(UPLOAD_DIR, f"{conv_id}_{idx}.png")
-        with open(img_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        img_paths.append(img_path)
-    conversion_progress[conv_id] = 50
-    print(f"[LOG] IMG2PDF conv_id={conv_id} progresso 50%")
-    images = [Image.open(p).convert("RGB") for p in img_paths]
-    pdf_path = os.path.join(UPLOAD_DIR, f"{conv_id}.pdf")
-    if images:
-        images[0].save(pdf_path, save_all=True, append_images=images[1:])
-    for p in img_paths:
-        os.remove(p)
-    conversion_progress[conv_id] = 100
-    print(f"[LOG] IMG2PDF conv_id={conv_id} FINALIZADO")
+        await ticket.admit("img2pdf", "img2pdf", sum(os.path.getsize(p) for p in img_paths), len(img_paths))
+    except HTTPException:
+        await asyncio.to_thread(progress.finish, conv_id, error="servidor ocupado")
+        raise
+    # Saída também no diretório temporário: apagada depois que o FileResponse for enviado
+    pdf_path = scratch.file("output.pdf")
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    # Janela ordenada: até 2 imagens por worker sendo preparadas, páginas gravadas na ordem do envio
+    window = []
+    pending = iter(img_paths)
+    last = 0
+    log.info("img2pdf_started", conv_id=conv_id, images=len(img_paths))
+    started = time.perf_counter()
+    try:
+        with open(pdf_path, "wb") as out:
+            writer = ImagePdfWriter(out)
+            while True:
+                while len(window) < RENDER_WORKERS * 2:
+                    path = next(pending, None)
+                    if path is None:
+                        break
+                    window.append(loop.run_in_executor(pool, workers.prepare_image, path, max_size))
+                if not window:
+                    break
+                try:
+                    image = await window.pop(0)
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Imagem {writer.page_count + 1} inválida: {e}")
+                # Cópia dos bytes do JPEG (ou da imagem preparada) para o PDF: em thread
+                await asyncio.to_thread(writer.add_image, image, page_size, margin)
+                metrics.count_pages()
+                value = int(writer.page_count / len(img_paths) * 99)
+                if value != last:
+                    await asyncio.to_thread(progress.set_progress, conv_id, value)
+                    last = value
+            await asyncio.to_thread(writer.close)
+        if linearize:
+            await asyncio.to_thread(linearizer.linearize_in_place, pdf_path)
+    except BaseException:
+        for task in window:
+            task.cancel()
+        await asyncio.to_thread(progress.finish, conv_id, error="falha na conversão")
+        log.warning("img2pdf_failed", conv_id=conv_id)
+        raise
+    await asyncio.to_thread(progress.finish, conv_id)
+    elapsed = time.perf_counter() - started
+    metrics.observe_stage("transform", elapsed)
+    log.info("img2pdf_finished", conv_id=conv_id, pages=len(img_paths), ms=round(elapsed * 1000))
     return FileResponse(pdf_path, filename="output.pdf", headers={"X-Conversion-Id": conv_id})
+def input_path(upload, doc_id, scratch, name):
+    """Caminho em disco da entrada: o arquivo do armazenamento (doc_id) ou o upload copiado para o diretório temporário."""
+    if doc_id:
+        try:
+            return get_store().path(doc_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Documento não encontrado (ou expirado).")
+    if upload is None:
+        raise HTTPException(status_code=400, detail="Envie um arquivo ou um doc_id.")
+    return scratch.save(upload, name)
+
+
+# Armazenamento de documentos: envia uma vez, edita várias vezes por doc_id
+@app.post("/api/docs")
+def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """Armazena o PDF e devolve seu id (SHA-256 do conteúdo) para uso nos endpoints /api/edit/*.
+
+    Depois da resposta, as primeiras páginas são renderizadas em segundo plano
+    para que o /api/render já as encontre no cache.
+    """
+    store = get_store()
+    doc_id = store.put_stream(file.file)
+    pages = check_document(doc_id)
+    if pages and thumbnails.RENDER_PREFETCH_PAGES:
+        background_tasks.add_task(
+            thumbnails.get_renderer().prefetch, get_render_pool(), doc_id, min(pages, thumbnails.RENDER_PREFETCH_PAGES)
+        )
+    return {"id": doc_id, "size": store.size(doc_id), "pages": pages}
+
+
+def check_document(doc_id):
+    """Número de páginas do documento armazenado (None se criptografado); se não for um PDF, apaga-o e responde 400."""
+    store = get_store()
+    try:
+        reader = store.checkout_reader(doc_id)
+        # PDFs protegidos só revelam as páginas depois do decrypt (ex.: /api/edit/unprotect)
+        pages = None if reader.is_encrypted else page_count(reader)
+        store.release_reader(doc_id, reader)
+    except Exception:
+        store.delete(doc_id)
+        raise HTTPException(status_code=400, detail="Arquivo não é um PDF válido.")
+    return pages
+
+
+@app.get("/api/docs/{doc_id}")
+def download_document(doc_id: str):
+    """Baixa o documento armazenado (ex.: o resultado de uma edição com doc_id).
+
+    Aceita Range (206 com Content-Range, vários intervalos em multipart/byteranges,
+    416 fora do arquivo) e If-Range, via FileResponse (starlette >= 0.39): um
+    visualizador de PDF busca só os trechos que precisa, e com um PDF linearizado
+    (linearize=true) mostra a primeira página antes de baixar o resto.
+    """
+    try:
+        path = get_store().path(doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento não encontrado (ou expirado).")
+    return FileResponse(path, media_type="application/pdf", filename=f"{doc_id[:12]}.pdf")
+
+
+@app.delete("/api/docs/{doc_id}")
+def delete_document(doc_id: str):
+    try:
+        get_store().delete(doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento não encontrado.")
+    return {"deleted": doc_id}
+
+
+# Uploads retomáveis (tus 1.0.0, ver uploads.py): para arquivos grandes em
+# conexões instáveis; o upload completo vira um documento (X-Document-Id)
+def tus_check(request):
+    version = request.headers.get("tus-resumable")
+    if version is not None and version != uploads.TUS_VERSION:
+        raise HTTPException(
+            status_code=412, detail="Versão do protocolo tus não suportada.", headers={"Tus-Version": uploads.TUS_VERSION}
+        )
+
+
+def upload_headers(info):
+    headers = {
+        "Tus-Resumable": uploads.TUS_VERSION,
+        "Upload-Offset": str(info["offset"]),
+        "Upload-Length": str(info["length"]),
+        "Cache-Control": "no-store",
+    }
+    if info.get("expires"):
+        headers["Upload-Expires"] = uploads.http_date(info["expires"])
+    if info.get("doc_id"):
+        headers["X-Document-Id"] = info["doc_id"]
+    return headers
+
+
+@app.options("/api/uploads")
+def upload_options():
+    return Response(status_code=204, headers={
+        "Tus-Resumable": uploads.TUS_VERSION,
+        "Tus-Version": uploads.TUS_VERSION,
+        "Tus-Extension": uploads.TUS_EXTENSIONS,
+        "Tus-Max-Size": str(uploads.get_uploads().max_bytes),
+        "Tus-Checksum-Algorithm": ",".join(uploads.CHECKSUM_ALGORITHMS),
+    })
+
+
+@app.post("/api/uploads", status_code=201)
+async def create_upload(request: Request):
+    """Abre uma sessão de upload: Upload-Length (bytes) e, opcional, Upload-Metadata (ex.: filename em base64).
+
+    Devolve 201 com Location; os bytes vão em PATCH para essa URL.
+    """
+    tus_check(request)
+    try:
+        length = int(request.headers.get("upload-length", ""))
+        if length < 1:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Informe o tamanho do arquivo em Upload-Length.")
+    try:
+        metadata = uploads.parse_metadata(request.headers.get("upload-metadata"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    store = uploads.get_uploads()
+    upload_id = await asyncio.to_thread(store.create, length, metadata)
+    info = await asyncio.to_thread(store.status, upload_id)
+    return Response(status_code=201, headers=dict(upload_headers(info), Location=f"/api/uploads/{upload_id}"))
+
+
+@app.head("/api/uploads/{upload_id}")
+async def upload_status(upload_id: str, request: Request):
+    """Até onde o upload chegou (Upload-Offset); completo, traz também o X-Document-Id."""
+    tus_check(request)
+    try:
+        info = await asyncio.to_thread(uploads.get_uploads().status, upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload não encontrado (ou expirado).")
+    return Response(status_code=200, headers=upload_headers(info))
+
+
+@app.patch("/api/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    """Grava o corpo (application/offset+octet-stream) a partir de Upload-Offset, que deve ser o offset atual.
+
+    Upload-Checksum (ex.: "sha256 <base64>") confere o bloco; se não bater, o
+    bloco é descartado (460). O último bloco registra o arquivo como
+    documento: o doc_id vem em X-Document-Id e serve nos demais endpoints.
+    """
+    tus_check(request)
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Use Content-Type: application/offset+octet-stream.")
+    try:
+        offset = int(request.headers.get("upload-offset", ""))
+        if offset < 0:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Informe o Upload-Offset.")
+    checksum = uploads.parse_checksum(request.headers.get("upload-checksum"))
+    store = uploads.get_uploads()
+    try:
+        info = await store.append(upload_id, offset, request.stream(), checksum)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload não encontrado (ou expirado).")
+    if info.get("doc_id"):
+        try:
+            await asyncio.to_thread(check_document, info["doc_id"])
+        except HTTPException:
+            await asyncio.to_thread(store.delete, upload_id)
+            raise
+    return Response(status_code=204, headers=upload_headers(info))
+
+
+@app.delete("/api/uploads/{upload_id}", status_code=204)
+def delete_upload(upload_id: str, request: Request):
+    tus_check(request)
+    store = uploads.get_uploads()
+    try:
+        store.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload não encontrado (ou expirado).")
+    store.delete(upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": uploads.TUS_VERSION})
+
+
+@app.get("/api/render/{doc_id}/{page}")
+async def render_thumbnail(
+    request: Request,
+    doc_id: str,
+    page: int,
+    dpi: Optional[int] = None,
+    w: Optional[int] = None,
+    format: str = "webp",
+):
+    """Miniatura de uma página de um documento armazenado (w = largura em pixels, ou dpi).
+
+    Sem w nem dpi usa a largura padrão (RENDER_DEFAULT_WIDTH). As imagens ficam
+    em cache (memória + disco) e a resposta leva ETag e Cache-Control imutável.
+    """
+    fmt = format.lower()
+    if fmt not in thumbnails.THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use webp ou png.")
+    if w is None and dpi is None:
+        w = thumbnails.RENDER_DEFAULT_WIDTH
+    if w is not None:
+        if not 16 <= w <= 2000:
+            raise HTTPException(status_code=400, detail="w deve estar entre 16 e 2000 pixels.")
+        dpi = None
+    elif not 10 <= dpi <= 300:
+        raise HTTPException(status_code=400, detail="DPI deve estar entre 10 e 300.")
+    if page < 1 or not get_store().valid_id(doc_id):
+        raise HTTPException(status_code=404, detail="Página não encontrada.")
+    tag = thumbnails.etag(thumbnails.cache_key(doc_id, page, dpi, w, fmt))
+    headers = {"ETag": tag, "Cache-Control": thumbnails.CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if tag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    try:
+        data, hit = await thumbnails.get_renderer().get(get_render_pool(), doc_id, page, dpi, w, fmt)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Documento não encontrado (ou expirado).")
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Página não encontrada.")
+    except PermissionError:
+        raise HTTPException(status_code=400, detail="PDF protegido por senha.")
+    headers["X-Cache"] = "hit" if hit else "miss"
+    return Response(data, media_type=thumbnails.THUMBNAIL_FORMATS[fmt], headers=headers)
+
+
 # Endpoint para polling de progresso
 @app.get("/api/progress/{conv_id}")
 def get_progress(conv_id: str):
-    if conv_id in conversion_progress:
-        prog = conversion_progress[conv_id]
-        print(f"[LOG] Polling progresso conv_id={conv_id}: {prog}")
-        return {"progress": int(prog) if prog is not None else 0}
-    print(f"[LOG] Polling progresso conv_id={conv_id}: NÃO ENCONTRADO")
+    job = get_job_store().get(conv_id)
+    if job is not None:
+        log.debug("progress_polled", sample=0.01, conv_id=conv_id, progress=job["progress"])
+        return {"progress": job["progress"], "state": job["state"]}
+    log.debug("progress_polled", sample=0.01, conv_id=conv_id, progress=None)
     return {"progress": 100}
 
-@app.get("/api/tmp/{filename}")
-def get_tmp_file(filename: str):
-    """Permite baixar arquivos temporários gerados."""
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
-    return FileResponse(file_path)
+# Jobs em segundo plano: envia, acompanha por /api/jobs/{id} (ou /api/progress/{id}) e baixa o resultado
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    kind: str = Form(...),
+    files: List[UploadFile] = File(None),
+    doc_id: List[str] = Form(None),
+    params: str = Form("{}"),
+):
+    """Enfileira uma conversão (pdf2img, img2pdf, compress, merge) e devolve o id do job.
+
+    params é um objeto JSON com os mesmos parâmetros do endpoint síncrono
+    (ex.: {"dpi": 150, "format": "jpeg"}). Em merge, os doc_ids entram depois dos arquivos.
+    """
+    store = get_job_store()
+    await asyncio.to_thread(store.evict_expired)
+    files = files or []
+    doc_ids = doc_id or []
+    try:
+        params_dict = json.loads(params)
+        if not isinstance(params_dict, dict):
+            raise ValueError("params deve ser um objeto JSON.")
+        jobs.validate(kind, params_dict, len(files) + len(doc_ids))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    linearizer.require(bool(params_dict.get("linearize")) and kind != "pdf2img")
+    if await asyncio.to_thread(store.pending) >= jobs.JOB_MAX_PENDING:
+        raise HTTPException(status_code=429, detail="Fila de jobs cheia, tente novamente em instantes.", headers={"Retry-After": "5"})
+    job_id = str(uuid4())
+    job_dir = store.job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    # Cópia em thread (não segura o event loop) e contada na cota dos jobs (503 se estouraria)
+    job_files = ScratchDir(get_job_space(), job_dir)
+    inputs = []
+    try:
+        for idx, f in enumerate(files):
+            ext = os.path.splitext(f.filename or "")[1].lower() or ".bin"
+            inputs.append(await asyncio.to_thread(job_files.save, f, f"input_{idx}{ext}"))
+        for d in doc_ids:
+            try:
+                inputs.append(get_store().path(d))
+            except KeyError:
+                raise HTTPException(status_code=404, detail="Documento não encontrado (ou expirado).")
+        await asyncio.to_thread(store.create, job_id, kind)
+    except BaseException:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    future = get_job_pool().submit(jobs.run_job, job_id, kind, inputs, params_dict)
+
+    def job_crashed(fut):
+        # Processo do pool morreu (ou pool encerrado) antes de registrar o resultado
+        if not fut.cancelled() and fut.exception() is not None:
+            store.finish(job_id, error=str(fut.exception()) or "falha no worker")
+
+    future.add_done_callback(job_crashed)
+    return {"id": job_id, "state": "queued", "status_url": f"/api/jobs/{job_id}", "result_url": f"/api/jobs/{job_id}/result"}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado).")
+    return jobs.job_info(job)
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """Baixa o resultado do job; aceita Range e If-Range como /api/docs/{doc_id}."""
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None or job["kind"] == "conversion":
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado).")
+    if job["state"] == "error":
+        raise HTTPException(status_code=409, detail=f"O job falhou: {job['error']}")
+    if job["state"] != "done":
+        raise HTTPException(status_code=409, detail="O job ainda não terminou.")
+    path = store.result_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Resultado não encontrado (ou expirado).")
+    return FileResponse(path, media_type=job["media_type"], filename=job["result_name"])
+
+@app.delete("/api/jobs/{job_id}")
+def delete_job(job_id: str):
+    store = get_job_store()
+    if store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado).")
+    store.delete(job_id)
+    return {"ok": True}
 
 # Endpoint para rotacionar páginas do PDF
 @app.post("/api/edit/rotate")
 async def rotate_pdf(
-    file: UploadFile = File(...),
-    rotations: str = Form(...)
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    rotations: str = Form(...),
+    incremental: bool = Form(False),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    from PyPDF2 import PdfReader, PdfWriter
-    import json
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
     try:
         rotation_map = json.loads(rotations)  # {pagina: angulo}
     except Exception:
         rotation_map = {}
-    for i, page in enumerate(reader.pages):
-        page_num = str(i + 1)
-        angle = rotation_map.get(page_num) or rotation_map.get(i + 1) or 0
-        if angle:
-            page.rotate(angle)
-        writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=rotacionado.pdf"})
+    steps = [{"op": "rotate", "rotations": rotation_map}]
+    return await run_edit(request, spool, file, doc_id, "rotate", steps, "rotacionado.pdf", incremental, linearize=linearize)
 
 # Endpoint para remover páginas do PDF
 @app.post("/api/edit/remove")
 async def remove_pages_pdf(
-    file: UploadFile = File(...),
-    pages: str = Form(...)
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    pages: str = Form(...),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    from PyPDF2 import PdfReader, PdfWriter
-    import json
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    try:
-        pages_to_remove = json.loads(pages)  # lista de páginas (1-based)
-        pages_to_remove = [int(p) for p in pages_to_remove]
-    except Exception:
-        pages_to_remove = []
-    for i, page in enumerate(reader.pages):
-        if (i + 1) not in pages_to_remove:
-            writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=removido.pdf"})
+    # Seleção 1-based: lista JSON ou intervalos ("1-5,9,12-", "-1", "odd"; ver pages.py)
+    steps = [{"op": "remove", "pages": pages}]
+    return await run_edit(
+        request, spool, file, doc_id, "remove", steps, "removido.pdf", invalid="Seleção de páginas inválida", linearize=linearize
+    )
 # Endpoint para extrair páginas do PDF
-from fastapi.responses import StreamingResponse
 @app.post("/api/edit/extract")
 async def extract_pages_pdf(
-    file: UploadFile = File(...),
-    pages: str = Form(...)
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    pages: str = Form(...),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-
-    from PyPDF2 import PdfReader, PdfWriter
-    import json
-    print(f"[EXTRACT] Valor recebido em 'pages': {pages}")
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    try:
-        pages_to_extract = json.loads(pages)  # lista de páginas (1-based)
-        pages_to_extract = [int(p) for p in pages_to_extract]
-        print(f"[EXTRACT] Páginas para extrair após parsing: {pages_to_extract}")
-    except Exception as e:
-        print(f"[EXTRACT] Erro ao parsear páginas: {e}")
-        pages_to_extract = []
-    for i, page in enumerate(reader.pages):
-        if (i + 1) in pages_to_extract:
-            writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=extraido.pdf"})
+    # Só as páginas escolhidas são carregadas: o custo não depende do tamanho do documento
+    steps = [{"op": "extract", "pages": pages}]
+    return await run_edit(
+        request, spool, file, doc_id, "extract", steps, "extraido.pdf", invalid="Seleção de páginas inválida", linearize=linearize
+    )
 
 # Endpoint para reorganizar páginas
-from fastapi.responses import StreamingResponse
 @app.post("/api/edit/reorder")
 async def reorder_pdf(
-    file: UploadFile = File(...),
-    order: str = Form(...)
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    order: str = Form(...),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    from PyPDF2 import PdfReader, PdfWriter
-    import json
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    try:
-        new_order = json.loads(order)
-        new_order = [int(p) for p in new_order]
-    except Exception as e:
-        print(f"[REORDER] Erro ao parsear ordem: {e}")
-        new_order = list(range(1, len(reader.pages)+1))
-    for page_num in new_order:
-        idx = page_num - 1
-        if 0 <= idx < len(reader.pages):
-            writer.add_page(reader.pages[idx])
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=reorganizado.pdf"})
+    # Nova ordem: lista JSON ou intervalos (ex.: "5-1" inverte as cinco primeiras)
+    steps = [{"op": "reorder", "order": order}]
+    return await run_edit(
+        request, spool, file, doc_id, "reorder", steps, "reorganizado.pdf", invalid="Ordem de páginas inválida", linearize=linearize
+    )
 
 # Endpoint para adicionar números de páginas
-from fastapi.responses import StreamingResponse
 @app.post("/api/edit/pagenum")
 async def add_page_numbers(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
     position: str = Form("bottom-right"),
-    format: str = Form("Página {n}")
+    format: str = Form("Página {n}"),
+    incremental: bool = Form(False),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    from PyPDF2 import PdfReader, PdfWriter
-    from reportlab.pdfgen import canvas
-    import io
-    pdf_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for i, page in enumerate(reader.pages):
-        packet = io.BytesIO()
-        width = float(page.mediabox.width)
-        height = float(page.mediabox.height)
-        can = canvas.Canvas(packet, pagesize=(width, height))
-        # Determina posição do número
-        num_text = format.replace("{n}", str(i + 1))
-        font_size = 14
-        can.setFont("Helvetica", font_size)
-        margin = 20
-        x = margin
-        y = margin
-        if position == "bottom-right":
-            x = width - margin*2 - font_size*len(num_text)/2
-            y = margin
-        elif position == "bottom-center":
-            x = width/2 - font_size*len(num_text)/4
-            y = margin
-        elif position == "bottom-left":
-            x = margin
-            y = margin
-        elif position == "top-right":
-            x = width - margin*2 - font_size*len(num_text)/2
-            y = height - margin - font_size
-        elif position == "top-center":
-            x = width/2 - font_size*len(num_text)/4
-            y = height - margin - font_size
-        elif position == "top-left":
-            x = margin
-            y = height - margin - font_size
-        can.drawString(x, y, num_text)
-        can.save()
-        packet.seek(0)
-        from PyPDF2 import PdfReader as RLReader
-        num_pdf = RLReader(packet)
-        num_page = num_pdf.pages[0]
-        page.merge_page(num_page)
-        writer.add_page(page)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return StreamingResponse(out, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=pdf_numerado.pdf"})
+    steps = [{"op": "pagenum", "position": position, "format": format}]
+    return await run_edit(request, spool, file, doc_id, "pagenum", steps, "pdf_numerado.pdf", incremental, linearize=linearize)
 
 # Endpoint para adicionar marca d'água (texto ou imagem)
-from fastapi.responses import StreamingResponse
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from PyPDF2 import PdfReader, PdfWriter
-from PIL import Image
-
 @app.post("/api/edit/watermark")
 async def add_watermark(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
     watermark_text: str = Form(None),
     watermark_image: UploadFile = File(None),
     position: str = Form("center"),
-    opacity: float = Form(0.2)
+    opacity: float = Form(0.2),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
 ):
-    # Salva PDF original
-    pdf_bytes = await file.read()
-    input_pdf = PdfReader(io.BytesIO(pdf_bytes))
-    output_pdf = PdfWriter()
-
     # Validação: precisa de texto ou imagem
     if not watermark_text and not watermark_image:
         return JSONResponse(status_code=400, content={"error": "Envie texto ou imagem para marca d'água."})
+    img_bytes = await watermark_image.read() if watermark_image else None
+    steps = [{"op": "watermark", "watermark_text": watermark_text, "watermark_image": img_bytes, "position": position, "opacity": opacity}]
+    return await run_edit(request, spool, file, doc_id, "watermark", steps, "watermarked.pdf", linearize=linearize)
 
-    # Cria marca d'água temporária
-    watermark_stream = io.BytesIO()
-    c = canvas.Canvas(watermark_stream, pagesize=letter)
-    width, height = letter
-
-    # Adiciona texto se fornecido
-    if watermark_text:
-        c.setFont("Helvetica", 40)
-        c.setFillAlpha(opacity)
-        x = width / 2
-        y = height / 2
-        if position == "top":
-            y = height - 100
-        elif position == "bottom":
-            y = 100
-        c.drawCentredString(x, y, watermark_text)
-
-    # Adiciona imagem se fornecida
-    if watermark_image:
-        img_bytes = await watermark_image.read()
-        img_stream = io.BytesIO(img_bytes)
-        img = Image.open(img_stream)
-        img_path = "_tmp_watermark_img.png"
-        img.save(img_path)
-        img_width, img_height = img.size
-        x = (width - img_width) / 2
-        y = (height - img_height) / 2
-        if position == "top":
-            y = height - img_height - 50
-        elif position == "bottom":
-            y = 50
-        c.saveState()
-        c.setFillAlpha(opacity)
-        c.drawImage(img_path, x, y, width=img_width, height=img_height, mask='auto')
-        c.restoreState()
-        os.remove(img_path)
-
-    c.showPage()  # Garante que uma página será criada
-    c.save()
-    watermark_stream.seek(0)
-
-    # Aplica marca d'água em cada página
-    watermark_pdf = PdfReader(watermark_stream)
-    if not watermark_pdf.pages:
-        return JSONResponse(status_code=400, content={"error": "Falha ao gerar página de marca d'água."})
-    watermark_page = watermark_pdf.pages[0]
-    for page in input_pdf.pages:
-        page.merge_page(watermark_page)
-        output_pdf.add_page(page)
-
-    out_stream = io.BytesIO()
-    output_pdf.write(out_stream)
-    out_stream.seek(0)
-    return StreamingResponse(out_stream, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=watermarked.pdf"})
+# Endpoint para aplicar várias edições em sequência (um parse, uma gravação)
+@app.post("/api/pipeline")
+async def run_pipeline(
+    request: Request,
+    file: UploadFile = File(None),
+    doc_id: Optional[str] = Form(None),
+    operations_json: str = Form(..., alias="operations"),
+    password: Optional[str] = Form(None),
+    linearize: bool = Form(False),
+    spool: UploadSpool = Depends(upload_spool)
+):
+    """Aplica a lista ordenada de operações, ex: [{"op": "rotate", "rotations": {"1": 90}}, {"op": "pagenum"}].
+
+    Cada operação usa os mesmos parâmetros do endpoint /api/edit/* equivalente;
+    "compress" só pode ser a última. O tempo de cada etapa volta no header
+    Server-Timing (e em X-Pipeline-Timings, como JSON).
+    """
+    try:
+        steps = json.loads(operations_json)
+        if not isinstance(steps, list) or not all(isinstance(s, dict) for s in steps):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="operations deve ser uma lista JSON de objetos com o campo op.")
+    for n, step in enumerate(steps):
+        op = step.get("op")
+        if op not in operations.PIPELINE_OPS and op != "compress":
+            raise HTTPException(status_code=400, detail=f"Operação {n+1}: '{op}' não suportada.")
+        if op == "compress":
+            if n != len(steps) - 1:
+                raise HTTPException(status_code=400, detail="compress deve ser a última operação.")
+            if step.get("level", "default") not in workers.COMPRESSION_LEVELS:
+                raise HTTPException(status_code=400, detail="Nível inválido. Use low, default ou high.")
+            if any(s.get("op") == "protect" for s in steps):
+                raise HTTPException(status_code=400, detail="compress não pode ser combinado com protect.")
+    return await run_edit(
+        request, spool, file, doc_id, "pipeline", steps, "pipeline.pdf", password=password, invalid=None, timing=True,
+        linearize=linearize,
+    )
+
+# Endpoint para aplicar a mesma operação em vários PDFs de uma vez
+@app.post("/api/batch")
+async def run_batch(
+    request: Request,
+    operation: str = Form(...),
+    params: Optional[str] = Form(None),
+    files: List[UploadFile] = File(None),
+    doc_ids: Optional[str] = Form(None),
+    watermark_image: UploadFile = File(None),
+    linearize: bool = Form(False),
+    scratch: ScratchDir = Depends(scratch_dir),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Aplica uma operação (sign, watermark, pagenum, protect, rotate ou compress) a vários PDFs e devolve um ZIP em streaming.
+
+    params: objeto JSON com os parâmetros da operação, com os mesmos nomes do
+    /api/pipeline (ex.: {"watermark_text": "CONFIDENCIAL"}); a imagem da
+    marca d'água também pode vir no campo watermark_image. O que é comum a
+    todos os documentos (overlay, imagem redimensionada) é preparado uma vez
+    e os documentos são processados em paralelo no executor. Um documento com
+    erro não interrompe o lote: o motivo vai para errors.json, dentro do ZIP.
+    Com linearize=true, cada PDF do lote sai linearizado.
+    """
+    if operation not in operations.BATCH_OPS:
+        raise HTTPException(status_code=400, detail=f"Operação inválida. Use {', '.join(operations.BATCH_OPS)}.")
+    linearizer.require(linearize)
+    try:
+        step = json.loads(params) if params else {}
+        ids = json.loads(doc_ids) if doc_ids else []
+        if not isinstance(step, dict) or not isinstance(ids, list):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="params deve ser um objeto JSON e doc_ids uma lista JSON.")
+    step["op"] = operation
+    if operation == "compress" and step.get("level", "default") not in workers.COMPRESSION_LEVELS:
+        raise HTTPException(status_code=400, detail="Nível inválido. Use low, default ou high.")
+    if watermark_image is not None:
+        step["watermark_image"] = await watermark_image.read()
+    try:
+        step = await asyncio.to_thread(operations.prepare, step)
+    except (ValueError, TypeError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Parâmetros inválidos: {e}")
+    sources = [(f, None, f.filename or f"arquivo_{i + 1}.pdf") for i, f in enumerate(files or [])]
+    sources += [(None, doc_id, f"{doc_id[:12]}.pdf") for doc_id in ids]
+    if not sources:
+        raise HTTPException(status_code=400, detail="Envie pelo menos um arquivo PDF.")
+    if len(sources) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"No máximo {BATCH_MAX_FILES} arquivos por lote.")
+    await ticket.admit_inputs("batch", "edit", [(upload, doc_id) for upload, doc_id, _ in sources])
+    # Nomes das entradas no ZIP, sem repetição
+    names = []
+    for _, _, name in sources:
+        base = os.path.basename(name) or "arquivo.pdf"
+        stem, ext = os.path.splitext(base)
+        candidate, n = base, 2
+        while candidate in names:
+            candidate, n = f"{stem}_{n}{ext}", n + 1
+        names.append(candidate)
+    steps = [step]
+
+    async def process(index, upload, doc_id):
+        # Entrada e saída por caminho: serve ao executor em thread e em processo
+        if doc_id:
+            src = get_store().path(doc_id)
+        else:
+            src = await asyncio.to_thread(scratch.save, upload, f"in_{index}.pdf")
+        dest = scratch.file(f"out_{index}.pdf")
+        try:
+            await executor.run(operation, workers.edit_document, src, dest, steps, False, None, linearize, request=request)
+            with open(dest, "rb") as f:
+                return await asyncio.to_thread(f.read)
+        finally:
+            for path in (dest, None if doc_id else src):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    async def batch_stream():
+        # Janela ordenada: até 2 documentos por worker em andamento, entregues ao ZIP na ordem do envio
+        zs = ZipStream()
+        pending = iter(enumerate(sources))
+        window = []
+        errors = []
+        started = time.perf_counter()
+        try:
+            while True:
+                while len(window) < executor.CPU_WORKERS * 2:
+                    item = next(pending, None)
+                    if item is None:
+                        break
+                    index, (upload, doc_id, _) = item
+                    window.append((names[index], asyncio.ensure_future(process(index, upload, doc_id))))
+                if not window:
+                    break
+                name, task = window.pop(0)
+                try:
+                    data = await task
+                except HTTPException as e:
+                    if e.status_code == 499:
+                        raise
+                    errors.append({"file": name, "error": e.detail})
+                    continue
+                except KeyError:
+                    errors.append({"file": name, "error": "Documento não encontrado (ou expirado)."})
+                    continue
+                except operations.PasswordError:
+                    errors.append({"file": name, "error": "PDF protegido por senha."})
+                    continue
+                except operations.StepError as e:
+                    errors.append({"file": name, "error": f"Parâmetros inválidos: {e}"})
+                    continue
+                except Exception:
+                    errors.append({"file": name, "error": "Não foi possível processar o PDF."})
+                    continue
+                # PDFs já têm streams comprimidos: vão para o ZIP sem deflate
+                yield await asyncio.to_thread(zs.add, name, data, False)
+            if errors:
+                yield zs.add("errors.json", json.dumps(errors, ensure_ascii=False, indent=2).encode())
+            yield zs.close()
+            log.info("batch_finished", operation=operation, files=len(sources), errors=len(errors),
+                     ms=round((time.perf_counter() - started) * 1000))
+        finally:
+            for _, task in window:
+                task.cancel()
+
+    return StreamingResponse(
+        batch_stream(), media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={operation}_lote.zip", "X-Batch-Files": str(len(sources))},
+    )
 
 # Endpoint para comparar PDFs
 @app.post("/api/edit/compare")
-async def compare_pdfs(file1: UploadFile = File(...), file2: UploadFile = File(...)):
-    from PyPDF2 import PdfReader
-    import difflib
-    pdf1_bytes = await file1.read()
-    pdf2_bytes = await file2.read()
-    reader1 = PdfReader(io.BytesIO(pdf1_bytes))
-    reader2 = PdfReader(io.BytesIO(pdf2_bytes))
-
-    # Extrai texto de cada página
-    def extract_text(reader):
-        return [page.extract_text() or "" for page in reader.pages]
+async def compare_pdfs(
+    file1: UploadFile = File(None),
+    file2: UploadFile = File(None),
+    doc_id1: Optional[str] = Form(None),
+    doc_id2: Optional[str] = Form(None),
+    visual: bool = Form(False),
+    stream: bool = Form(False),
+    dpi: int = Form(50),
+    scratch: ScratchDir = Depends(scratch_dir),
+    ticket: admission.Ticket = Depends(admission.admission_ticket),
+):
+    """Compara dois PDFs página a página.
 
-    text1 = extract_text(reader1)
-    text2 = extract_text(reader2)
+    Páginas com a mesma impressão digital (conteúdo + recursos) são puladas sem
+    extrair texto; as demais são comparadas em paralelo no pool de processos.
+    Com visual=true também rasteriza as páginas e informa as regiões alteradas.
+    Com stream=true a resposta sai em JSON lines, conforme as diferenças aparecem.
+    """
+    if not 10 <= dpi <= 300:
+        raise HTTPException(status_code=400, detail="DPI deve estar entre 10 e 300.")
+    paths = [
+        await asyncio.to_thread(input_path, file1, doc_id1, scratch, "compare_1.pdf"),
+        await asyncio.to_thread(input_path, file2, doc_id2, scratch, "compare_2.pdf"),
+    ]
+    await ticket.admit_paths("compare", "compare", paths, dpi=dpi if visual else None)
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    try:
+        fp1, fp2 = await asyncio.gather(*(loop.run_in_executor(pool, workers.page_fingerprints, path) for path in paths))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Não foi possível ler um dos PDFs.")
 
     # Compara número de páginas
-    pages1 = len(text1)
-    pages2 = len(text2)
-    page_diff = abs(pages1 - pages2)
-
-    # Compara texto página a página
-    diffs = []
-    for i in range(max(pages1, pages2)):
-        t1 = text1[i] if i < pages1 else ""
-        t2 = text2[i] if i < pages2 else ""
-        if t1 != t2:
-            diff = list(difflib.unified_diff(t1.splitlines(), t2.splitlines(), lineterm=""))
-            diffs.append({"page": i+1, "diff": diff})
-
-    result = {
+    pages1 = len(fp1)
+    pages2 = len(fp2)
+    changed = [i for i in range(max(pages1, pages2)) if i >= pages1 or i >= pages2 or fp1[i] != fp2[i]]
+    summary = {
         "total_pages_pdf1": pages1,
         "total_pages_pdf2": pages2,
-        "page_difference": page_diff,
-        "diffs": diffs,
+        "page_difference": abs(pages1 - pages2),
+        "identical_pages": max(pages1, pages2) - len(changed),
     }
-    return JSONResponse(content={"result": result})
\ No newline at end of file
+    # Lotes contíguos: cada worker abre os dois documentos uma vez por lote
+    chunk_size = max(1, min(25, -(-len(changed) // (RENDER_WORKERS * 4))))
+    chunks = [changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size)]
+
+    async def iter_diffs():
+        tasks = [loop.run_in_executor(pool, workers.diff_pages, paths[0], paths[1], chunk, visual, dpi) for chunk in chunks]
+        try:
+            for task in asyncio.as_completed(tasks):
+                for item in await task:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if stream:
+        async def ndjson():
+            yield json.dumps(summary) + "\n"
+            count = 0
+            async for item in iter_diffs():
+                count += 1
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "diff_pages": count}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    diffs = [item async for item in iter_diffs()]
+    diffs.sort(key=lambda item: item["page"])
+    result = dict(summary, diffs=diffs)
+    return JSONResponse(content={"result": result})
+
+
+# Métricas no formato do Prometheus (por processo: com vários workers, cada um expõe as suas)
+@app.get("/api/metrics")
+def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Métricas desativadas (METRICS_ENABLED=0).")
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# index.html do build Vite: lido do disco uma vez por processo (ou no
+# PRELOAD) e servido da memória com ETag; o navegador revalida (no-cache) e
+# recebe 304 enquanto o build não mudar. Os assets têm hash no nome, então um
+# build novo só aparece com o restart do servidor, que recarrega o arquivo.
+_index_page = None
+_index_lock = threading.Lock()
+
+
+def index_page():
+    """(conteúdo, ETag) do dist/index.html; None se não houver build (tenta de novo na próxima)."""
+    global _index_page
+    with _index_lock:
+        if _index_page is None:
+            try:
+                with open(os.path.join(DIST_DIR, "index.html"), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                return None
+            _index_page = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    return _index_page
+
+
+def index_response(request):
+    page = index_page()
+    if page is None:
+        return HTMLResponse(status_code=404, content="index.html não encontrado")
+    body, tag = page
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if tag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
+
+
+# Endpoint raiz: serve index.html do build Vite
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    return index_response(request)
+
+
+# Fallback: servir index.html para qualquer GET não-API
+# (precisa ser a última rota registrada, senão encobre os GETs da API)
+@app.get("/{full_path:path}", response_class=HTMLResponse)
+async def spa_fallback(full_path: str, request: Request):
+    # Não intercepta APIs nem assets nem arquivos públicos
+    if full_path.startswith("api/") or full_path.startswith("assets/") or full_path.startswith("public/") or full_path.startswith("dist/"):
+        return HTMLResponse(status_code=404, content="Not Found")
+    return index_response(request)
+
+
+# PRELOAD: backends e index.html carregados já na importação. Com
+# gunicorn --preload isso acontece uma vez, no mestre, e os workers herdam tudo
+startup.warmup()
+if startup.PRELOAD:
+    index_page()
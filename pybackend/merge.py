@@ -0,0 +1,302 @@
+# Junção de PDFs (/api/merge e jobs de merge).
+# Em vez do PdfMerger (que monta o documento inteiro em memória antes de
+# gravar), os objetos de cada página são renumerados e gravados um a um, na
+# ordem das páginas: a saída pode ir para o cliente enquanto é gerada e a
+# memória fica nos mapas de numeração. Streams idênticos em documentos
+# diferentes (logotipos, fontes embutidas, perfis ICC) são gravados uma vez
+# só; a chave é o hash do conteúdo e de tudo o que o stream referencia,
+# independente da numeração de cada arquivo. Os marcadores de cada entrada
+# são mantidos, apontando para as páginas novas.
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+    TextStringObject,
+)
+
+from logs import get_logger
+from pages import get_page, page_count, parse_pages
+from split import link_target
+from workers import hash_pdf_object
+
+log = get_logger("merge")
+
+# Chaves da página que não são copiadas: /Parent aponta para a árvore nova;
+# /StructParents e /B referenciam estruturas do catálogo original
+_PAGE_SKIP = ("/Parent", "/StructParents", "/B")
+
+
+class MergeInput:
+    """Um documento a juntar: reader, páginas escolhidas (0-based) e nome (para mensagens de erro)."""
+
+    def __init__(self, reader, pages, name=None):
+        self.reader = reader
+        self.pages = pages
+        self.name = name
+
+
+def open_input(stream, pages=None, name=None):
+    """Lê o PDF e resolve a seleção de páginas (None = todas). ValueError se não der para juntar."""
+    reader = PdfReader(stream)
+    if reader.is_encrypted:
+        raise ValueError("PDF protegido por senha")
+    total = page_count(reader)
+    indices = list(range(total)) if pages is None or not str(pages).strip() else parse_pages(pages, total, strict=True)
+    # Carrega as páginas escolhidas aqui (na leitura em paralelo), e não durante a gravação
+    for index in indices:
+        get_page(reader, index)
+    return MergeInput(reader, indices, name)
+
+
+class _Ref(PdfObject):
+    """Referência para um objeto da saída (número novo)."""
+
+    __slots__ = ("num",)
+
+    def __init__(self, num):
+        self.num = num
+
+    def write_to_stream(self, stream, encryption_key=None):
+        stream.write(f"{self.num} 0 R".encode())
+
+
+class _Document:
+    """Estado da cópia de uma entrada: numeração nova dos objetos e das páginas."""
+
+    def __init__(self):
+        self.refs = {}
+        self.memo = {}
+        self.pending = []
+        # índice da página no original -> número novo (primeira ocorrência)
+        self.page_nums = {}
+
+
+class MergeWriter:
+    """Grava o PDF resultante em out (precisa de write e tell), documento por documento.
+
+    write_document() é um gerador que avança uma página por vez, para que
+    quem envia a saída em streaming possa entregar os bytes entre as páginas.
+    """
+
+    def __init__(self, out, version="1.4"):
+        self.out = out
+        self._offsets = {}
+        # 1 = catálogo e 2 = árvore de páginas, gravados em close()
+        self._next = 3
+        self._kids = []
+        self._streams = {}
+        self._outline = []
+        self.pages = 0
+        self.deduplicated = 0
+        out.write(f"%PDF-{version}\n".encode() + b"%\xe2\xe3\xcf\xd3\n")
+
+    def _alloc(self):
+        num = self._next
+        self._next += 1
+        return num
+
+    def _ref(self, value, doc):
+        num = doc.refs.get(value.idnum)
+        if num is not None:
+            return _Ref(num)
+        target = value.get_object()
+        if isinstance(target, DictionaryObject) and target.get("/Type") == "/Page":
+            # Página que não entrou na junção (ex.: /P de uma anotação, campo de formulário)
+            return NullObject()
+        if isinstance(target, StreamObject):
+            digest = hash_pdf_object(value, doc.memo, set())
+            num = self._streams.get(digest)
+            if num is not None:
+                self.deduplicated += 1
+                doc.refs[value.idnum] = num
+                return _Ref(num)
+            num = self._streams[digest] = self._alloc()
+        else:
+            num = self._alloc()
+        doc.refs[value.idnum] = num
+        doc.pending.append((num, target))
+        return _Ref(num)
+
+    def _translate(self, value, doc):
+        """Cópia do objeto com as referências trocadas pela numeração nova (as indiretas entram na fila)."""
+        if isinstance(value, IndirectObject):
+            return self._ref(value, doc)
+        if isinstance(value, DictionaryObject):
+            copy = DictionaryObject()
+            for key, item in value.items():
+                copy[NameObject(key)] = self._translate(item, doc)
+            return copy
+        if isinstance(value, ArrayObject):
+            return ArrayObject(self._translate(item, doc) for item in value)
+        return value
+
+    def _write(self, num, obj, data=None):
+        self._offsets[num] = self.out.tell()
+        self.out.write(f"{num} 0 obj\n".encode())
+        obj.write_to_stream(self.out, None)
+        if data is not None:
+            self.out.write(b"\nstream\n")
+            self.out.write(data)
+            self.out.write(b"\nendstream")
+        self.out.write(b"\nendobj\n")
+
+    def _drain(self, doc):
+        while doc.pending:
+            num, target = doc.pending.pop()
+            if isinstance(target, StreamObject):
+                entries = DictionaryObject()
+                for key, item in target.items():
+                    if key != "/Length":
+                        entries[NameObject(key)] = self._translate(item, doc)
+                # Dados brutos (ainda comprimidos): não decodifica nem recomprime
+                data = target._data or b""
+                entries[NameObject("/Length")] = NumberObject(len(data))
+                self._write(num, entries, data)
+            else:
+                self._write(num, self._translate(target, doc))
+
+    def write_document(self, doc):
+        """Grava as páginas escolhidas de doc (MergeInput), gerando após cada página."""
+        state = _Document()
+        reader = doc.reader
+        numbers = []
+        for index in doc.pages:
+            num = self._alloc()
+            numbers.append(num)
+            state.page_nums.setdefault(index, num)
+            state.refs.setdefault(get_page(reader, index).indirect_reference.idnum, num)
+        selected = set(state.refs) | {None}
+        for index, num in zip(doc.pages, numbers):
+            page = get_page(reader, index)
+            entries = DictionaryObject()
+            for key, value in page.items():
+                if key not in _PAGE_SKIP:
+                    entries[NameObject(key)] = value
+            if "/Annots" in page:
+                # Links para páginas que ficaram de fora trariam essas páginas junto
+                entries[NameObject("/Annots")] = ArrayObject(
+                    a for a in page["/Annots"].get_object() if link_target(a) in selected
+                )
+            entries = self._translate(entries, state)
+            entries[NameObject("/Parent")] = _Ref(2)
+            self._write(num, entries)
+            self._drain(state)
+            self._kids.append(num)
+            self.pages += 1
+            yield num
+        self._outline.extend(self._outline_nodes(reader, reader.outline, state))
+
+    def _outline_nodes(self, reader, items, state):
+        """(título, número da página nova, resto do destino, filhos); itens de páginas fora da seleção dão lugar aos filhos."""
+        nodes = []
+        for i, item in enumerate(items):
+            if isinstance(item, list):
+                continue
+            children = items[i + 1] if i + 1 < len(items) and isinstance(items[i + 1], list) else []
+            children = self._outline_nodes(reader, children, state)
+            try:
+                page = state.page_nums.get(reader.get_destination_page_number(item))
+            except Exception:
+                page = None
+            if page is None:
+                nodes.extend(children)
+                continue
+            nodes.append((item.title or "", page, list(item.dest_array)[1:], children))
+        return nodes
+
+    def _write_outline(self, nodes, parent):
+        """Grava os itens (irmãos ligados por /Prev e /Next) e devolve (primeiro, último, total visível)."""
+        nums = [self._alloc() for _ in nodes]
+        count = len(nodes)
+        for i, (title, page, dest, children) in enumerate(nodes):
+            item = DictionaryObject()
+            item[NameObject("/Title")] = TextStringObject(title)
+            item[NameObject("/Parent")] = _Ref(parent)
+            item[NameObject("/Dest")] = ArrayObject([_Ref(page)] + dest)
+            if i > 0:
+                item[NameObject("/Prev")] = _Ref(nums[i - 1])
+            if i + 1 < len(nodes):
+                item[NameObject("/Next")] = _Ref(nums[i + 1])
+            if children:
+                first, last, open_count = self._write_outline(children, nums[i])
+                item[NameObject("/First")] = _Ref(first)
+                item[NameObject("/Last")] = _Ref(last)
+                item[NameObject("/Count")] = NumberObject(open_count)
+                count += open_count
+            self._write(nums[i], item)
+        return nums[0], nums[-1], count
+
+    def close(self):
+        """Grava marcadores, árvore de páginas, catálogo, tabela xref e trailer."""
+        catalog = "<< /Type /Catalog /Pages 2 0 R"
+        if self._outline:
+            outlines = self._alloc()
+            first, last, count = self._write_outline(self._outline, outlines)
+            self._write(outlines, DictionaryObject({
+                NameObject("/Type"): NameObject("/Outlines"),
+                NameObject("/First"): _Ref(first),
+                NameObject("/Last"): _Ref(last),
+                NameObject("/Count"): NumberObject(count),
+            }))
+            catalog += f" /Outlines {outlines} 0 R /PageMode /UseOutlines"
+        kids = " ".join(f"{n} 0 R" for n in self._kids)
+        self._offsets[2] = self.out.tell()
+        self.out.write(f"2 0 obj\n<< /Type /Pages /Kids [{kids}] /Count {len(self._kids)} >>\nendobj\n".encode())
+        self._offsets[1] = self.out.tell()
+        self.out.write(f"1 0 obj\n{catalog} >>\nendobj\n".encode())
+        xref = self.out.tell()
+        lines = [f"xref\n0 {self._next}\n", "0000000000 65535 f \n"]
+        for num in range(1, self._next):
+            offset = self._offsets.get(num)
+            # Números reservados e não usados (não acontece hoje) ficam livres
+            lines.append(f"{offset:010d} 00000 n \n" if offset is not None else "0000000000 00000 f \n")
+        self.out.write("".join(lines).encode())
+        self.out.write(f"trailer\n<< /Size {self._next} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def pdf_version(inputs):
+    """Maior versão entre as entradas (ex.: "1.7")."""
+    versions = [doc.reader.pdf_header[5:8] for doc in inputs if doc.reader.pdf_header.startswith("%PDF-")]
+    return max(versions, default="1.4")
+
+
+class _ChunkSink:
+    """Destino da gravação em streaming: guarda os bytes até o próximo drain() e conta a posição para a xref."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.pending = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        self.pending += len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_merge(inputs, chunk_size=64 * 1024):
+    """Bytes do PDF resultante em blocos de ~chunk_size, gerados conforme as páginas são gravadas."""
+    sink = _ChunkSink()
+    writer = MergeWriter(sink, pdf_version(inputs))
+    for doc in inputs:
+        for _ in writer.write_document(doc):
+            if sink.pending >= chunk_size:
+                yield sink.drain()
+    writer.close()
+    yield sink.drain()
+    log.info("merge_finished", inputs=len(inputs), pages=writer.pages, deduplicated=writer.deduplicated, size=sink.tell())
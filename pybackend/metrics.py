@@ -0,0 +1,281 @@
+# Instrumentação do backend no formato de texto do Prometheus (/api/metrics).
+# Por rota: contagem de requisições, histograma de latência e bytes
+# recebidos/enviados (middleware ASGI). Dentro das rotas: tempo de cada etapa
+# (upload, parse, transform, serialize, response) e páginas processadas.
+# Sem dependências externas. METRICS_ENABLED=0 desliga tudo: o middleware
+# não é instalado e stage()/observe_stage()/count_pages() viram no-ops.
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+
+# Limites (segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name + _labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Valor instantâneo; com fn, é lido na hora da coleta (fn() -> número ou {labels: número})."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def samples(self):
+        if self.fn is None:
+            yield from super().samples()
+            return
+        value = self.fn()
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            yield self.name + _labels(self.labelnames, labels), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [contagem por faixa (não cumulativa) + faixa +Inf, soma]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield self.name + "_bucket" + _labels(self.labelnames, labels, f'le="{le}"'), cumulative
+            yield self.name + "_sum" + _labels(self.labelnames, labels), total
+            yield self.name + "_count" + _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas as métricas no formato de exposição em texto do Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter(
+    "pdftoolkit_http_requests_total", "Requisições HTTP atendidas.", ("method", "route", "status")))
+LATENCY = REGISTRY.register(Histogram(
+    "pdftoolkit_http_request_duration_seconds", "Tempo total da requisição, até o último byte da resposta.", ("method", "route")))
+BYTES_IN = REGISTRY.register(Counter(
+    "pdftoolkit_http_request_bytes_total", "Bytes recebidos no corpo das requisições.", ("route",)))
+BYTES_OUT = REGISTRY.register(Counter(
+    "pdftoolkit_http_response_bytes_total", "Bytes enviados no corpo das respostas.", ("route",)))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "pdftoolkit_http_requests_in_flight", "Requisições em andamento."))
+STAGES = REGISTRY.register(Histogram(
+    "pdftoolkit_stage_duration_seconds", "Tempo por etapa (upload, parse, transform, serialize, response).", ("route", "stage")))
+PAGES = REGISTRY.register(Counter(
+    "pdftoolkit_pages_processed_total", "Páginas processadas.", ("route",)))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "pdftoolkit_cache_lookups_total", "Consultas aos caches internos, por resultado (hit/miss).", ("cache", "result")))
+
+# Escopo ASGI da requisição atual (a rota casada só é conhecida depois do roteamento)
+_scope = contextvars.ContextVar("metrics_scope", default=None)
+
+
+def route_label(scope=None):
+    """Modelo da rota (ex.: /api/jobs/{job_id}), para não criar uma série por URL."""
+    scope = scope if scope is not None else _scope.get()
+    if scope is None:
+        return "-"
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "-")
+    return scope.get("root_path") or "unmatched"
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGES.observe(time.perf_counter() - self.started, route_label(), self.name)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+if METRICS_ENABLED:
+    def stage(name):
+        """Context manager que mede uma etapa da requisição atual."""
+        return _Stage(name)
+
+    def observe_stage(name, seconds):
+        STAGES.observe(seconds, route_label(), name)
+
+    def count_pages(n=1):
+        PAGES.inc(n, route_label())
+
+    def count_cache(cache, hit):
+        CACHE_LOOKUPS.inc(1, cache, "hit" if hit else "miss")
+else:
+    def stage(name):
+        return _NULL_STAGE
+
+    def observe_stage(name, seconds):
+        pass
+
+    def count_pages(n=1):
+        pass
+
+    def count_cache(cache, hit):
+        pass
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (não bufferiza streaming): latência, status e bytes por rota."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        state = {"in": 0, "out": 0, "status": 500, "uploaded": None, "first_byte": None}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["in"] += len(message.get("body", b""))
+                if not message.get("more_body") and state["uploaded"] is None:
+                    state["uploaded"] = time.perf_counter()
+            return message
+
+        async def counting_send(message):
+            kind = message["type"]
+            if kind == "http.response.start":
+                state["status"] = message["status"]
+            elif kind == "http.response.body":
+                if state["first_byte"] is None:
+                    state["first_byte"] = time.perf_counter()
+                state["out"] += len(message.get("body", b""))
+            elif kind == "http.response.pathsend":
+                state["first_byte"] = time.perf_counter()
+                state["out"] += os.path.getsize(message["path"])
+            await send(message)
+
+        token = _scope.set(scope)
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_FLIGHT.dec()
+            _scope.reset(token)
+            finished = time.perf_counter()
+            route = route_label(scope)
+            method = scope.get("method", "")
+            REQUESTS.inc(1, method, route, str(state["status"]))
+            LATENCY.observe(finished - started, method, route)
+            if state["in"]:
+                BYTES_IN.inc(state["in"], route)
+                # Upload: até o último pedaço do corpo (o multipart é gravado no spool enquanto chega)
+                if state["uploaded"] is not None:
+                    STAGES.observe(state["uploaded"] - started, route, "upload")
+            BYTES_OUT.inc(state["out"], route)
+            if state["first_byte"] is not None:
+                STAGES.observe(finished - state["first_byte"], route, "response")
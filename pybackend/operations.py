@@ -0,0 +1,403 @@
+# Operações de edição sobre um documento em memória.
+# Os endpoints /api/edit/* e o /api/pipeline usam as mesmas funções: o PDF é
+# lido uma vez, cada operação altera a lista de páginas (ou as próprias
+# páginas, já copiadas para o writer) e o resultado é serializado uma única vez.
+import base64
+import hashlib
+import io
+import json
+import re
+import time
+
+from PyPDF2 import PdfWriter
+from PyPDF2._page import PageObject
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+)
+
+import metrics
+from executor import checkpoint
+from pages import LazyPages, parse_pages
+from incremental import IncrementalDocument, supported as incremental_supported
+from overlay import Overlays, OverlayTemplate, page_box, page_number_position
+
+
+class EditDocument:
+    """Lista ordenada de páginas de um PdfReader, copiadas para o writer só quando alteradas."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.writer = PdfWriter()
+        # Páginas carregadas só quando acessadas (extrair 3 páginas não lê as outras)
+        self.pages = LazyPages(reader)
+        self.password = None
+        # True quando uma página já copiada para o writer foi descartada
+        self._orphans = False
+        self._started = time.perf_counter()
+
+    def _owned(self, page):
+        ref = page.indirect_reference
+        return ref is not None and ref.pdf is self.writer
+
+    def writable(self, index):
+        """Página na posição index (0-based) pronta para ser alterada (nunca a página do reader)."""
+        # Chamado a cada página alterada ou gravada: ponto de parada se o cliente desconectou
+        checkpoint()
+        page = self.pages[index]
+        if not self._owned(page):
+            page = self.writer.add_page(page)
+            self.pages[index] = page
+        return page
+
+    def select(self, indices):
+        """Nova ordem de páginas a partir das posições atuais (0-based); repetições geram cópias."""
+        old = self.pages
+        loaded = old.loaded() if isinstance(old, LazyPages) else old
+        seen = set()
+        pages = []
+        for index in indices:
+            page = old[index]
+            if self._owned(page) and id(page) in seen:
+                page = self._duplicate(page)
+            seen.add(id(page))
+            pages.append(page)
+        if any(self._owned(p) and id(p) not in seen for p in loaded):
+            self._orphans = True
+        self.pages = pages
+
+    def _duplicate(self, page):
+        # Cópia rasa do dicionário: conteúdo e recursos continuam compartilhados
+        dup = PageObject(self.writer)
+        dup.update(page)
+        self.writer._objects.append(dup)
+        dup.indirect_reference = IndirectObject(len(self.writer._objects), 0, self.writer)
+        return dup
+
+    def finish(self):
+        """Monta a árvore de páginas na ordem final e devolve o PdfWriter pronto para gravar."""
+        for index in range(len(self.pages)):
+            self.writable(index)
+        tree = self.writer.get_object(self.writer._pages)
+        tree[NameObject("/Kids")] = ArrayObject([p.indirect_reference for p in self.pages])
+        tree[NameObject("/Count")] = NumberObject(len(self.pages))
+        if self._orphans:
+            _drop_unreachable(self.writer)
+        if self.password is not None:
+            self.writer.encrypt(self.password)
+        metrics.observe_stage("transform", time.perf_counter() - self._started)
+        metrics.count_pages(len(self.pages))
+        return self.writer
+
+
+def open_document(reader, incremental=False):
+    """EditDocument ou, com incremental=True e um PDF que permita, IncrementalDocument (só anexa as alterações)."""
+    if incremental and incremental_supported(reader):
+        return IncrementalDocument(reader)
+    return EditDocument(reader)
+
+
+def save_mode(doc):
+    """Valor do header X-Save-Mode: "incremental" ou "full"."""
+    return "incremental" if isinstance(doc, IncrementalDocument) else "full"
+
+
+def _drop_unreachable(writer):
+    """Troca por null os objetos do writer que nenhuma página/catálogo referencia mais."""
+    reachable = set()
+    stack = [writer._root, writer._info]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is not writer or obj.idnum in reachable:
+                continue
+            reachable.add(obj.idnum)
+            stack.append(obj.get_object())
+        elif isinstance(obj, DictionaryObject):
+            stack.extend(dict.values(obj))
+        elif isinstance(obj, ArrayObject):
+            stack.extend(list.__iter__(obj))
+    for i, obj in enumerate(writer._objects):
+        if obj is not None and i + 1 not in reachable:
+            writer._objects[i] = NullObject()
+
+
+def rotate(doc, rotation_map):
+    """rotation_map: {página (1-based, str ou int): ângulo}."""
+    if not isinstance(rotation_map, dict):
+        raise ValueError("rotations deve ser um objeto {página: ângulo}.")
+    for i in range(len(doc.pages)):
+        angle = rotation_map.get(str(i + 1)) or rotation_map.get(i + 1) or 0
+        if angle:
+            doc.writable(i).rotate(int(angle))
+
+
+def remove(doc, pages):
+    """pages: seleção no formato de pages.parse_pages ("1-5,9", "odd", [1, 2]...)."""
+    drop = set(parse_pages(pages, len(doc.pages)))
+    doc.select([i for i in range(len(doc.pages)) if i not in drop])
+
+
+def extract(doc, pages):
+    # Na ordem do documento e sem repetições; só as páginas escolhidas são carregadas
+    doc.select(sorted(set(parse_pages(pages, len(doc.pages)))))
+
+
+def reorder(doc, order):
+    doc.select(parse_pages(order, len(doc.pages)))
+
+
+def page_numbers(doc, position="bottom-right", format="Página {n}", font_size=14):
+    def draw_number(text):
+        def draw(can, width, height):
+            can.setFont("Helvetica", font_size)
+            can.drawString(*page_number_position(position, width, height, text, font_size), text)
+        return draw
+
+    # Todos os números num único documento reportlab, aplicados numa só passada
+    overlays = Overlays()
+    for i in range(len(doc.pages)):
+        _, _, width, height = page_box(doc.pages[i])
+        overlays.add(width, height, draw_number(format.replace("{n}", str(i + 1))))
+    overlays.build(doc.writer)
+    for i in range(len(doc.pages)):
+        overlays.stamp(doc.writer, doc.writable(i), i)
+
+
+class WatermarkOverlay(OverlayTemplate):
+    """Marca d'água (texto e/ou imagem) centralizada, no topo ou na base da página."""
+
+    def __init__(self, text=None, image_bytes=None, position="center", opacity=0.2):
+        if not text and not image_bytes:
+            raise ValueError("Envie texto ou imagem para marca d'água.")
+        self.text = text
+        self.image_bytes = image_bytes
+        self.position = position
+        self.opacity = opacity
+        self._image = None
+        digest = hashlib.sha256(image_bytes).hexdigest() if image_bytes else None
+        super().__init__(text, digest, position, opacity)
+
+    def __getstate__(self):
+        # A imagem decodificada fica no processo que a usou
+        return dict(self.__dict__, _image=None)
+
+    def _reader(self):
+        if self._image is None:
+            from reportlab.lib.utils import ImageReader
+            from PIL import Image
+            img = Image.open(io.BytesIO(self.image_bytes))
+            # ImageReader em memória: sem arquivo temporário compartilhado entre requisições
+            self._image = (ImageReader(img), img.size)
+        return self._image
+
+    def draw(self, c, width, height):
+        position = self.position
+        # Adiciona texto se fornecido
+        if self.text:
+            c.setFont("Helvetica", 40)
+            c.setFillAlpha(self.opacity)
+            x = width / 2
+            y = height / 2
+            if position == "top":
+                y = height - 100
+            elif position == "bottom":
+                y = 100
+            c.drawCentredString(x, y, self.text)
+        # Adiciona imagem se fornecida
+        if self.image_bytes:
+            img_reader, (img_width, img_height) = self._reader()
+            x = (width - img_width) / 2
+            y = (height - img_height) / 2
+            if position == "top":
+                y = height - img_height - 50
+            elif position == "bottom":
+                y = 50
+            c.saveState()
+            c.setFillAlpha(self.opacity)
+            c.drawImage(img_reader, x, y, width=img_width, height=img_height, mask='auto')
+            c.restoreState()
+
+
+def watermark(doc, overlay):
+    # Um Form XObject por tamanho de página distinto (mediabox real, não "letter")
+    overlay.stamp(doc.writer, (doc.writable(i) for i in range(len(doc.pages))))
+
+
+_DATA_URL_RE = re.compile(r"data:image/(png|jpeg);base64,(.*)", re.S)
+
+
+def decode_data_url(data_url):
+    """Bytes de uma imagem enviada como dataUrl base64 (png/jpeg), ou None."""
+    match = _DATA_URL_RE.match(data_url or "")
+    if not match:
+        return None
+    return base64.b64decode(match.group(2))
+
+
+def _image_bytes(value):
+    # dataUrl (pipeline) ou os bytes do arquivo enviado (/api/edit/watermark)
+    return bytes(value) if isinstance(value, (bytes, bytearray)) else decode_data_url(value)
+
+
+class SignatureOverlay(OverlayTemplate):
+    """Imagem da assinatura, reduzida para caber em 200x60, a (x, y) do canto superior esquerdo."""
+
+    def __init__(self, x, y, img_data):
+        from PIL import Image
+        img = Image.open(io.BytesIO(img_data))
+        # Ajustar tamanho da assinatura se necessário
+        max_w, max_h = 200, 60
+        ratio = min(max_w / img.width, max_h / img.height, 1)
+        self.width, self.height = int(img.width * ratio), int(img.height * ratio)
+        img = img.resize((self.width, self.height), Image.LANCZOS)
+        img_io = io.BytesIO()
+        img.save(img_io, format='PNG')
+        self.png = img_io.getvalue()
+        self.x = x
+        self.y = y
+        super().__init__(x, y, hashlib.sha256(self.png).hexdigest())
+
+    def draw(self, c, width, height):
+        from reportlab.lib.utils import ImageReader
+        c.drawImage(ImageReader(io.BytesIO(self.png)), self.x, height - self.y - self.height,
+                    width=self.width, height=self.height, mask='auto')
+
+
+def signature_overlay(x=50, y=50, signature_img=None):
+    """SignatureOverlay da dataUrl base64, ou None se não houver imagem."""
+    img_data = decode_data_url(signature_img)
+    return SignatureOverlay(x, y, img_data) if img_data is not None else None
+
+
+def sign(doc, overlay):
+    """Assina a primeira página."""
+    if overlay is None or not doc.pages:
+        return
+    overlay.stamp(doc.writer, [doc.writable(0)])
+
+
+def protect(doc, password):
+    """A senha é aplicada em finish(), depois de todas as outras operações."""
+    doc.password = password
+
+
+def _watermark_overlay(p):
+    return WatermarkOverlay(
+        p.get("watermark_text"), _image_bytes(p.get("watermark_image")),
+        p.get("position", "center"), float(p.get("opacity", 0.2)),
+    )
+
+
+def _signature_overlay(p):
+    return signature_overlay(int(p.get("x", 50)), int(p.get("y", 50)), p.get("signature_img"))
+
+
+# Operações aceitas pelo /api/pipeline: nome -> função(doc, parâmetros).
+# Os parâmetros têm os mesmos nomes dos campos do endpoint /api/edit/* correspondente.
+PIPELINE_OPS = {
+    "rotate": lambda doc, p: rotate(doc, p.get("rotations") or {}),
+    "remove": lambda doc, p: remove(doc, p.get("pages") or []),
+    "extract": lambda doc, p: extract(doc, p.get("pages") or []),
+    "reorder": lambda doc, p: reorder(doc, p.get("order") or []),
+    "pagenum": lambda doc, p: page_numbers(doc, p.get("position", "bottom-right"), p.get("format", "Página {n}")),
+    "watermark": lambda doc, p: watermark(doc, p.get("overlay") or _watermark_overlay(p)),
+    "sign": lambda doc, p: sign(doc, p["overlay"] if "overlay" in p else _signature_overlay(p)),
+    "protect": lambda doc, p: protect(doc, str(p["password"])),
+}
+
+
+# Operações do /api/batch (uma operação, muitos documentos)
+BATCH_OPS = ("sign", "watermark", "pagenum", "protect", "rotate", "compress")
+
+
+def prepare(step):
+    """Cópia de step com a parte comum a todos os documentos de um lote já pronta.
+
+    Marca d'água e assinatura viram um OverlayTemplate (imagem decodificada e
+    redimensionada uma vez, overlay desenhado uma vez por tamanho de página);
+    as demais só têm os parâmetros validados. ValueError se não servirem.
+    """
+    step = dict(step)
+    op = step["op"]
+    if op == "watermark":
+        step["overlay"] = _watermark_overlay(step)
+        step.pop("watermark_image", None)
+    elif op == "sign":
+        step["overlay"] = _signature_overlay(step)
+        step.pop("signature_img", None)
+    elif op == "protect":
+        if not step.get("password"):
+            raise ValueError("Informe a senha em password.")
+        step["password"] = str(step["password"])
+    elif op == "rotate":
+        rotations = step.get("rotations") or {}
+        if not isinstance(rotations, dict):
+            raise ValueError("rotations deve ser um objeto {página: ângulo}.")
+        step["rotations"] = {str(page): int(angle) for page, angle in rotations.items()}
+    return step
+
+
+class StepError(ValueError):
+    """Parâmetros inválidos na operação index (0-based) de apply()."""
+
+    def __init__(self, index, op, message):
+        super().__init__(index, op, message)
+        self.index = index
+        self.op = op
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class PasswordError(ValueError):
+    """PDF protegido e senha ausente ou incorreta."""
+
+
+class Timings:
+    """Tempo de cada etapa, desde a anterior (header Server-Timing do /api/pipeline)."""
+
+    def __init__(self):
+        self.stages = []
+        self._started = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append({"stage": stage, "ms": round((now - self._started) * 1000, 2)})
+        self._started = now
+
+    def headers(self):
+        return {
+            "Server-Timing": ", ".join(f"{t['stage']};dur={t['ms']}" for t in self.stages),
+            "X-Pipeline-Timings": json.dumps(self.stages),
+        }
+
+
+def apply(reader, steps, incremental=False, password=None, timings=None):
+    """Abre o documento e aplica as operações (formato do /api/pipeline; compress fica para workers.save_edit).
+
+    Usado por todos os endpoints de edição, dentro do executor (executor.run).
+    PasswordError se o PDF for protegido e password não abri-lo; StepError se
+    uma operação rejeitar os parâmetros.
+    """
+    if reader.is_encrypted and not (password and reader.decrypt(password)):
+        raise PasswordError()
+    doc = open_document(reader, incremental)
+    if timings is not None:
+        timings.mark("parse")
+    for n, step in enumerate(steps):
+        if step["op"] == "compress":
+            continue
+        checkpoint()
+        try:
+            PIPELINE_OPS[step["op"]](doc, step)
+        except (ValueError, TypeError, KeyError) as e:
+            raise StepError(n, step["op"], str(e))
+        if timings is not None:
+            timings.mark(f"{n+1}-{step['op']}")
+    return doc
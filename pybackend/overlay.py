@@ -0,0 +1,204 @@
+# Motor de sobreposição (números de página, marca d'água, assinatura).
+# Todos os overlays de uma requisição são desenhados num único documento
+# reportlab, lido uma única vez pelo PyPDF2 e convertido em Form XObjects.
+# Cada página recebe só uma chamada "Do" para o seu overlay: fontes e imagens
+# ficam como recursos compartilhados, e o conteúdo original não é reprocessado.
+# Overlays iguais em todas as páginas (marca d'água, assinatura) usam
+# OverlayTemplate: desenhados uma vez por tamanho de página e reaproveitados
+# entre documentos (lotes, requisições repetidas).
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+)
+
+
+def page_box(page):
+    """(x0, y0, largura, altura) da mediabox da página."""
+    box = page.mediabox
+    return float(box.left), float(box.bottom), float(box.width), float(box.height)
+
+
+class Overlays:
+    """Coleção de overlays desenhados num único canvas reportlab."""
+
+    def __init__(self):
+        from reportlab.pdfgen import canvas
+        self._packet = io.BytesIO()
+        self.canvas = canvas.Canvas(self._packet)
+        self._sizes = []
+        self._forms = None
+        self._wrap = None
+
+    def add(self, width, height, draw):
+        """Desenha um overlay de width x height chamando draw(canvas, width, height); devolve o índice."""
+        self.canvas.setPageSize((width, height))
+        draw(self.canvas, width, height)
+        self.canvas.showPage()
+        self._sizes.append((width, height))
+        return len(self._sizes) - 1
+
+    def build(self, writer):
+        """Gera o PDF dos overlays (um build, um parse) e os registra como Form XObjects no writer."""
+        self.canvas.save()
+        self._packet.seek(0)
+        reader = PdfReader(self._packet)
+        self._forms = []
+        self._wrap = wrap_streams(writer)
+        for page, (width, height) in zip(reader.pages, self._sizes):
+            self._forms.append(import_form(writer, page, width, height))
+        return self._forms
+
+    def stamp(self, writer, page, index):
+        """Aplica o overlay `index` sobre uma página que já pertence ao writer."""
+        stamp_form(writer, page, self._forms[index], self._wrap)
+
+
+def import_form(writer, page, width, height):
+    """Converte uma página do PDF do reportlab num Form XObject do writer e devolve a referência."""
+    form = DecodedStreamObject()
+    form.set_data(page.get_contents().get_data() if page.get_contents() else b"")
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)])
+    resources = page.get("/Resources")
+    if resources is not None:
+        # clone() mapeia cada objeto do reader uma única vez: fontes e
+        # imagens repetidas entre overlays viram o mesmo objeto no writer
+        form[NameObject("/Resources")] = resources.get_object().clone(writer)
+    return writer._add_object(form)
+
+
+# PDFs de overlay já desenhados neste processo: (chave do template, largura, altura) -> bytes
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+_MAX_RENDERED = 64
+
+
+class OverlayTemplate:
+    """Overlay igual em todas as páginas de um tamanho, desenhado pelo reportlab uma vez por tamanho.
+
+    Subclasses guardam só dados serializáveis (texto, bytes da imagem) e
+    implementam draw(canvas, width, height): o template vai para os
+    processos do executor e cada processo guarda os overlays que desenhou.
+    """
+
+    def __init__(self, *spec):
+        self.key = hashlib.sha256(repr((type(self).__name__,) + spec).encode()).hexdigest()
+
+    def draw(self, canvas, width, height):
+        raise NotImplementedError
+
+    def pdf(self, width, height):
+        """Bytes do PDF (uma página) com o overlay no tamanho dado."""
+        key = (self.key, round(width, 2), round(height, 2))
+        with _rendered_lock:
+            data = _rendered.get(key)
+            if data is not None:
+                _rendered.move_to_end(key)
+                return data
+        from reportlab.pdfgen import canvas
+        packet = io.BytesIO()
+        c = canvas.Canvas(packet, pagesize=(width, height))
+        self.draw(c, width, height)
+        c.showPage()
+        c.save()
+        data = packet.getvalue()
+        with _rendered_lock:
+            _rendered[key] = data
+            while len(_rendered) > _MAX_RENDERED:
+                _rendered.popitem(last=False)
+        return data
+
+    def stamp(self, writer, pages):
+        """Aplica o overlay nas páginas (já do writer), com um Form XObject por tamanho de página."""
+        forms = {}
+        wrap = None
+        for page in pages:
+            _, _, width, height = page_box(page)
+            form = forms.get((width, height))
+            if form is None:
+                reader = PdfReader(io.BytesIO(self.pdf(width, height)))
+                form = forms[(width, height)] = import_form(writer, reader.pages[0], width, height)
+            if wrap is None:
+                wrap = wrap_streams(writer)
+            stamp_form(writer, page, form, wrap)
+
+
+def wrap_streams(writer):
+    """Streams "q" e "Q" usados para isolar o conteúdo original; um par por writer, compartilhado pelas páginas."""
+    push, pop = DecodedStreamObject(), DecodedStreamObject()
+    push.set_data(b"q\n")
+    pop.set_data(b"\nQ\n")
+    return writer._add_object(push), writer._add_object(pop)
+
+
+def stamp_form(writer, page, form_ref, wrap):
+    """Desenha o Form XObject form_ref por cima da página (no sistema de coordenadas da mediabox)."""
+    x0, y0, _, _ = page_box(page)
+    # Recursos próprios da página: o dicionário pode ser compartilhado com
+    # outras páginas, então é copiado (raso) antes de receber o novo nome
+    old_resources = page.get("/Resources")
+    resources = DictionaryObject()
+    if old_resources is not None:
+        resources.update(old_resources.get_object())
+    xobjects = DictionaryObject()
+    if "/XObject" in resources:
+        xobjects.update(resources["/XObject"].get_object())
+    n = len(xobjects)
+    while NameObject(f"/PdfToolkitOverlay{n}") in xobjects:
+        n += 1
+    name = NameObject(f"/PdfToolkitOverlay{n}")
+    xobjects[name] = form_ref
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    ops = DecodedStreamObject()
+    ops.set_data(f"q 1 0 0 1 {x0:g} {y0:g} cm {name} Do Q\n".encode())
+    # O conteúdo original fica entre q/Q para que estados gráficos não
+    # balanceados não afetem o overlay
+    push, pop = wrap
+    contents = ArrayObject([push])
+    old_contents = page.get("/Contents")
+    if old_contents is not None:
+        old = old_contents.get_object()
+        if isinstance(old, ArrayObject):
+            contents.extend(old)
+        else:
+            contents.append(old_contents)
+    contents.append(pop)
+    contents.append(writer._add_object(ops))
+    page[NameObject("/Contents")] = contents
+
+
+def page_number_position(position, width, height, text, font_size=14, margin=20):
+    """Coordenadas (x, y) do número de página para cada posição suportada."""
+    x = margin
+    y = margin
+    if position == "bottom-right":
+        x = width - margin*2 - font_size*len(text)/2
+        y = margin
+    elif position == "bottom-center":
+        x = width/2 - font_size*len(text)/4
+        y = margin
+    elif position == "bottom-left":
+        x = margin
+        y = margin
+    elif position == "top-right":
+        x = width - margin*2 - font_size*len(text)/2
+        y = height - margin - font_size
+    elif position == "top-center":
+        x = width/2 - font_size*len(text)/4
+        y = height - margin - font_size
+    elif position == "top-left":
+        x = margin
+        y = height - margin - font_size
+    return x, y
@@ -0,0 +1,177 @@
+# Seleção de páginas compartilhada pelos endpoints (extract, remove, reorder,
+# split, merge, pdf2img) e acesso preguiçoso às páginas de um PdfReader.
+#
+# Gramática (páginas 1-based, itens separados por vírgula):
+#   "5"       uma página           "-1"      a última (negativos contam do fim)
+#   "1-5"     intervalo            "12-"     da 12 até o fim
+#   "5-1"     intervalo invertido  "-3--1"   as três últimas
+#   "odd", "even", "all"
+# Listas JSON ([1, 2, 3] ou ["1-3", 9]) continuam aceitas.
+#
+# reader.pages achata a árvore de páginas inteira na primeira consulta (segundos
+# num PDF de 20.000 páginas); LazyPages desce pela árvore usando o /Count de
+# cada nó e só carrega as páginas pedidas.
+import json
+import re
+import weakref
+from collections.abc import Sequence
+
+from PyPDF2._page import PageObject
+
+_ITEM_RE = re.compile(r"^(-?\d+)(?:(-)(-?\d+)?)?$")
+_KEYWORDS = ("odd", "even", "all")
+# Atributos que a página herda dos nós da árvore (PDF 1.7, tabela 30)
+_INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def _resolve(number, total):
+    """Número 1-based (negativo = a partir do fim) -> índice 0-based, possivelmente fora do documento."""
+    return number - 1 if number > 0 else total + number
+
+
+def _items(spec):
+    if isinstance(spec, (list, tuple)):
+        return [str(item) for item in spec]
+    spec = str(spec).strip()
+    if spec.startswith("["):
+        try:
+            items = json.loads(spec)
+        except ValueError:
+            raise ValueError("lista JSON inválida")
+        if not isinstance(items, list):
+            raise ValueError("lista JSON inválida")
+        return [str(item) for item in items]
+    return spec.split(",") if spec else []
+
+
+def parse_pages(spec, total, strict=False):
+    """Índices 0-based da seleção, na ordem dada (repetições mantidas).
+
+    Páginas fora do documento são ignoradas, ou geram ValueError com
+    strict=True; sintaxe inválida sempre gera ValueError. Não carrega nenhuma
+    página: total vem de page_count().
+    """
+    indices = []
+    for raw in _items(spec):
+        item = raw.replace(" ", "").lower()
+        if item in _KEYWORDS:
+            start = 1 if item == "even" else 0
+            indices.extend(range(start, total, 1 if item == "all" else 2))
+            continue
+        match = _ITEM_RE.match(item)
+        if not match:
+            raise ValueError(f"item inválido: {raw.strip()!r}")
+        first = _resolve(int(match.group(1)), total)
+        if match.group(2) is None:
+            last = first
+        elif match.group(3) is None:
+            last = total - 1
+        else:
+            last = _resolve(int(match.group(3)), total)
+        if strict and not (0 <= first < total and 0 <= last < total):
+            raise ValueError(f"{raw.strip()} fora do documento ({total} páginas)")
+        step = 1 if last >= first else -1
+        # Só a parte do intervalo que cai dentro do documento
+        if step == 1:
+            span = range(max(first, 0), min(last, total - 1) + 1)
+        else:
+            span = range(min(first, total - 1), max(last, 0) - 1, -1)
+        indices.extend(span)
+    return indices
+
+
+def page_count(reader):
+    """Número de páginas sem achatar a árvore (o /Count da raiz)."""
+    if reader.flattened_pages is not None:
+        return len(reader.flattened_pages)
+    return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+
+def _descend(reader, index):
+    """(referência, dicionário, atributos herdados) da página index, descendo pelos /Count dos nós."""
+    node = reader.trailer["/Root"]["/Pages"]
+    inherited = {}
+    while True:
+        for attr in _INHERITABLE:
+            if attr in node:
+                inherited[attr] = node.raw_get(attr)
+        kids = node["/Kids"]
+        if int(node.get("/Count", -1)) == len(kids):
+            # Nó só com folhas (o caso comum, e o de árvores planas): acesso direto
+            ref = kids[index]
+            kid = ref.get_object()
+            if "/Kids" not in kid:
+                return ref, kid, inherited
+        for ref in kids:
+            kid = ref.get_object()
+            if "/Kids" in kid:
+                count = int(kid.get("/Count", 0))
+                if index < count:
+                    node = kid
+                    break
+                index -= count
+            else:
+                if index == 0:
+                    return ref, kid, inherited
+                index -= 1
+        else:
+            raise IndexError("página fora da árvore")
+
+
+# Páginas já carregadas, por reader (os readers do armazenamento de documentos são reaproveitados)
+_loaded = weakref.WeakKeyDictionary()
+
+
+def get_page(reader, index):
+    """Página index (0-based) como em reader.pages[index], carregando só os nós do caminho até ela."""
+    if reader.flattened_pages is not None:
+        return reader.flattened_pages[index]
+    cache = _loaded.setdefault(reader, {})
+    page = cache.get(index)
+    if page is None:
+        try:
+            ref, obj, inherited = _descend(reader, index)
+        except (IndexError, KeyError, TypeError, ValueError):
+            # /Count inconsistente: cai no caminho normal (achata a árvore inteira)
+            return reader.pages[index]
+        page = PageObject(reader, ref)
+        page.update(obj)
+        for attr, value in inherited.items():
+            if attr not in page:
+                page[attr] = value
+        cache[index] = page
+    return page
+
+
+class LazyPages(Sequence):
+    """Lista das páginas de um reader que só carrega as que forem acessadas."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._count = page_count(reader)
+        self._pages = {}
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return index
+
+    def __getitem__(self, index):
+        index = self._index(index)
+        page = self._pages.get(index)
+        if page is None:
+            page = self._pages[index] = get_page(self.reader, index)
+        return page
+
+    def __setitem__(self, index, page):
+        # Cópia gravável da página (EditDocument.writable, IncrementalDocument)
+        self._pages[self._index(index)] = page
+
+    def loaded(self):
+        """Páginas já acessadas (sem carregar as demais)."""
+        return list(self._pages.values())
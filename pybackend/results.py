@@ -0,0 +1,209 @@
+# Cache de resultados (opcional, RESULT_CACHE_ENABLED=1): a mesma entrada
+# com os mesmos parâmetros na mesma rota devolve o resultado já gerado, sem
+# parse, transformação nem gravação. A chave é o SHA-256 dos bytes da entrada
+# (o próprio doc_id, que já é o hash do conteúdo) + rota + parâmetros
+# normalizados. Rotas de criptografia (protect, unprotect, pipelines com
+# protect ou senha) nunca passam por aqui: nem a senha nem a saída
+# criptografada são guardadas.
+#
+# Armazenamento num TieredCache (LRU em memória limitado em bytes + disco).
+# Uma entrada é uma linha JSON com o tipo da resposta e os headers, seguida
+# do corpo; resultados enviados como doc_id guardam só o id do documento
+# gerado (que continua no armazenamento de documentos).
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+import metrics
+from cache import TieredCache
+from docstore import DOC_CACHE_TTL, get_store
+from logs import get_logger
+
+log = get_logger("results")
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "0").lower() in ("1", "true", "yes", "on")
+RESULT_CACHE_DIR = os.environ.get(
+    "RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "results")
+)
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get("RESULT_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+# Resultados maiores que isso não são guardados
+RESULT_CACHE_MAX_ITEM_BYTES = int(os.environ.get("RESULT_CACHE_MAX_ITEM_BYTES", 64 * 1024 * 1024))
+
+# Rotas que nunca entram no cache (senhas e saídas criptografadas)
+UNCACHEABLE_ROUTES = ("protect", "unprotect")
+# Headers que descrevem a execução original, e não o resultado
+_VOLATILE_HEADERS = ("content-length", "server-timing", "x-pipeline-timings")
+_HASH_CHUNK = 1024 * 1024
+
+
+def cacheable(route, steps=(), password=None):
+    """False para criptografia: rotas de senha, pipelines com protect ou entrada com senha."""
+    if not RESULT_CACHE_ENABLED or route in UNCACHEABLE_ROUTES or password:
+        return False
+    return not any(step.get("op") in UNCACHEABLE_ROUTES for step in steps)
+
+
+def _hash_stream(f):
+    h = hashlib.sha256()
+    while True:
+        chunk = f.read(_HASH_CHUNK)
+        if not chunk:
+            break
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def input_digest(upload=None, doc_id=None, path=None):
+    """SHA-256 dos bytes da entrada; None se não houver entrada (a rota responde o erro)."""
+    if doc_id:
+        return doc_id if get_store().valid_id(doc_id) else None
+    if path is not None:
+        with open(path, "rb") as f:
+            return _hash_stream(f)
+    if upload is None:
+        return None
+    f = upload.file
+    f.seek(0)
+    try:
+        return _hash_stream(f)
+    finally:
+        f.seek(0)
+
+
+def _normalize(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "sha256:" + hashlib.sha256(value).hexdigest()
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def result_key(route, digest, params):
+    """Chave do resultado: hash de rota + entrada + parâmetros normalizados (None some, strings sem espaços nas pontas)."""
+    payload = json.dumps([route, digest, _normalize(params)], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _encode(meta, body):
+    return json.dumps(meta, separators=(",", ":")).encode() + b"\n" + body
+
+
+def _decode(blob):
+    head, _, body = blob.partition(b"\n")
+    return json.loads(head), body
+
+
+def _headers(response):
+    return {k: v for k, v in response.headers.items() if k.lower() not in _VOLATILE_HEADERS and k.lower() != "content-type"}
+
+
+class ResultCache:
+    """Respostas já geradas, por chave de resultado (result_key)."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _load(self, key):
+        blob = self.cache.get(key)
+        if blob is None:
+            return None
+        meta, body = _decode(blob)
+        if meta.get("kind") == "doc":
+            # O documento gerado pode ter expirado do armazenamento
+            try:
+                get_store().path(meta["id"])
+            except KeyError:
+                self.cache.delete(key)
+                return None
+        return meta, body
+
+    async def lookup(self, key):
+        """Resposta guardada para a chave, ou None."""
+        entry = await asyncio.to_thread(self._load, key)
+        metrics.count_cache("result", entry is not None)
+        if entry is None:
+            return None
+        meta, body = entry
+        headers = dict(meta["headers"], **{"X-Result-Cache": "hit"})
+        if meta.get("kind") == "doc":
+            return JSONResponse(content=json.loads(body), headers=headers)
+        return Response(content=body, media_type=meta["media_type"], headers=headers)
+
+    async def remember(self, key, response):
+        """Guarda a resposta (só status 200) e a devolve; respostas em streaming são guardadas ao fim do envio."""
+        if response.status_code != 200:
+            return response
+        meta = {"media_type": response.media_type, "headers": _headers(response)}
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = self._tee(key, meta, response.body_iterator)
+        elif len(response.body) <= RESULT_CACHE_MAX_ITEM_BYTES:
+            body = response.body
+            if "x-document-id" in response.headers:
+                meta["kind"] = "doc"
+                meta["id"] = response.headers["x-document-id"]
+            await asyncio.to_thread(self.cache.put, key, _encode(meta, body))
+        response.headers["X-Result-Cache"] = "miss"
+        return response
+
+    async def _tee(self, key, meta, chunks):
+        parts = []
+        size = 0
+        async for chunk in chunks:
+            if parts is not None:
+                size += len(chunk)
+                if size > RESULT_CACHE_MAX_ITEM_BYTES:
+                    parts = None
+                else:
+                    parts.append(chunk if isinstance(chunk, bytes) else chunk.encode())
+            yield chunk
+        # Só chega aqui se o envio terminou: uma resposta interrompida não é guardada
+        if parts is not None:
+            await asyncio.to_thread(self.cache.put, key, _encode(meta, b"".join(parts)))
+
+    async def cached(self, key, compute):
+        """Bytes da chave; na falta, await compute() e guarda o resultado (ex.: páginas do pdf2img)."""
+        data = await asyncio.to_thread(self.cache.get, key)
+        metrics.count_cache("result", data is not None)
+        if data is None:
+            data = await compute()
+            if len(data) <= RESULT_CACHE_MAX_ITEM_BYTES:
+                await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    def missing(self, keys):
+        """Quantas chaves não estão no cache (sem carregar os dados)."""
+        return sum(1 for key in keys if self.cache.path(key) is None)
+
+
+async def find(route, params, upload=None, doc_id=None, path=None, steps=(), password=None):
+    """(chave, resposta guardada ou None) para a entrada; chave None se a requisição não usa o cache."""
+    if not cacheable(route, steps, password):
+        return None, None
+    digest = await asyncio.to_thread(input_digest, upload, doc_id, path)
+    if digest is None:
+        return None, None
+    key = result_key(route, digest, params)
+    return key, await get_results().lookup(key)
+
+
+_results = None
+_results_lock = threading.Lock()
+
+
+def get_results():
+    global _results
+    with _results_lock:
+        if _results is None:
+            _results = ResultCache(TieredCache(
+                RESULT_CACHE_DIR, RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DISK_BYTES, DOC_CACHE_TTL,
+            ))
+    return _results
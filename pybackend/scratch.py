@@ -0,0 +1,183 @@
+# Área de trabalho temporária (scratch) dos endpoints.
+# Cada requisição recebe um diretório próprio, apagado ao final (dependência
+# FastAPI com yield: roda depois que a resposta, inclusive streaming, termina).
+# A raiz é configurável (ex.: um tmpfs), o total em disco tem uma cota e
+# novas requisições são recusadas com 503 quando ela acabaria; um faxineiro
+# periódico remove diretórios órfãos (processo morto, cliente sumido) por idade.
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+
+SCRATCH_DIR = os.environ.get(
+    "SCRATCH_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "scratch")
+)
+# Limite de bytes em SCRATCH_DIR (0 = sem limite)
+SCRATCH_QUOTA_BYTES = int(os.environ.get("SCRATCH_QUOTA_BYTES", 4 * 1024 * 1024 * 1024))
+# Idade (segundos sem modificação) a partir da qual um diretório é considerado órfão
+SCRATCH_MAX_AGE = int(os.environ.get("SCRATCH_MAX_AGE", 3600))
+SCRATCH_SWEEP_INTERVAL = int(os.environ.get("SCRATCH_SWEEP_INTERVAL", 300))
+
+_COPY_CHUNK = 1024 * 1024
+# Por quanto tempo o total medido em disco é reaproveitado (segundos)
+_USAGE_TTL = 1.0
+
+
+def _tree_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class ScratchSpace:
+    """Raiz dos diretórios temporários, com cota de bytes e limpeza por idade."""
+
+    def __init__(self, root=SCRATCH_DIR, quota_bytes=SCRATCH_QUOTA_BYTES, max_age=SCRATCH_MAX_AGE):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._live = set()
+        # Bytes prometidos a cópias em andamento neste processo (ainda não medidos em disco)
+        self._reserved = 0
+        self._usage = 0
+        self._usage_at = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def usage(self):
+        """Bytes ocupados na raiz (por todos os processos), medidos no máximo a cada _USAGE_TTL segundos."""
+        now = time.monotonic()
+        if now - self._usage_at > _USAGE_TTL:
+            self._usage = _tree_size(self.root)
+            self._usage_at = now
+        return self._usage
+
+    def reserve(self, nbytes):
+        """Reserva espaço para uma escrita; 503 se a cota estouraria."""
+        with self._lock:
+            if self.quota_bytes and self.usage() + self._reserved + nbytes > self.quota_bytes:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Espaço temporário esgotado, tente novamente em instantes.",
+                    headers={"Retry-After": "10"},
+                )
+            self._reserved += nbytes
+
+    def release(self, nbytes):
+        with self._lock:
+            self._reserved -= nbytes
+            # A próxima verificação mede o disco de novo, já com o arquivo escrito
+            self._usage_at = 0.0
+
+    def session(self):
+        """Novo diretório temporário; 503 se a cota já estiver esgotada."""
+        self.reserve(0)
+        path = os.path.join(self.root, uuid.uuid4().hex)
+        os.makedirs(path)
+        with self._lock:
+            self._live.add(path)
+        return ScratchDir(self, path)
+
+    def _closed(self, path):
+        with self._lock:
+            self._live.discard(path)
+            self._usage_at = 0.0
+
+    def sweep(self):
+        """Remove entradas da raiz sem modificação há mais de max_age segundos; devolve quantas removeu."""
+        if not self.max_age:
+            return 0
+        limit = time.time() - self.max_age
+        removed = 0
+        for entry in list(os.scandir(self.root)):
+            with self._lock:
+                if entry.path in self._live:
+                    continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime > limit:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            with self._lock:
+                self._usage_at = 0.0
+        return removed
+
+
+class ScratchDir:
+    """Diretório temporário de uma requisição; tudo dentro dele é apagado em close()."""
+
+    def __init__(self, space, path):
+        self.space = space
+        self.path = path
+
+    def file(self, name):
+        """Caminho para um arquivo do diretório (só o nome base é usado)."""
+        return os.path.join(self.path, os.path.basename(name))
+
+    def save(self, src, name):
+        """Copia um upload (UploadFile ou arquivo aberto) para o diretório, respeitando a cota."""
+        f = getattr(src, "file", src)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        path = self.file(name)
+        self.space.reserve(size)
+        try:
+            with open(path, "wb") as out:
+                shutil.copyfileobj(f, out, _COPY_CHUNK)
+        finally:
+            self.space.release(size)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.space._closed(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_space = None
+_space_lock = threading.Lock()
+
+
+def get_scratch():
+    global _space
+    with _space_lock:
+        if _space is None:
+            _space = ScratchSpace()
+    return _space
+
+
+# Dependências com yield só são encerradas depois do envio de um StreamingResponse
+# a partir do FastAPI 0.118 (entre 0.106 e 0.117 o encerramento vinha antes do
+# corpo e as respostas saíam truncadas): por isso o fastapi>=0.118 no requirements.txt
+def scratch_dir():
+    """Dependência FastAPI: um ScratchDir por requisição, apagado após o envio da resposta."""
+    with get_scratch().session() as scratch:
+        yield scratch
@@ -0,0 +1,315 @@
+# Divisão de PDFs (/api/edit/split).
+# Planeja as partes (intervalos, a cada N páginas, por tamanho máximo ou pelos
+# marcadores de primeiro nível) e grava cada parte só com o que as suas
+# páginas usam: quando o documento inteiro compartilha um único /Resources
+# (comum em catálogos), fontes e imagens não citadas no conteúdo da página
+# ficam de fora, assim como links para páginas que não estão na parte.
+# Módulo leve, importado também pelos workers do pool (workers.split_part).
+import io
+import json
+import re
+import weakref
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2._page import PageObject
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+from pages import get_page, page_count, parse_pages
+
+SPLIT_MODES = ("ranges", "every", "size", "bookmarks")
+
+# Subdicionários de /Resources cujas entradas são citadas pelo nome no conteúdo (/F1 Tf, /Im0 Do, ...)
+_NAMED_RESOURCES = ("/Font", "/XObject", "/ExtGState", "/ColorSpace", "/Pattern", "/Shading", "/Properties")
+_NAME_RE = re.compile(rb"/([^\s/\[\]()<>{}%]*)")
+_NAME_ESCAPE_RE = re.compile(rb"#([0-9A-Fa-f]{2})")
+# Decodificar o conteúdo da página é caro (ASCII85/Flate no PyPDF2): só vale a
+# pena quando ela compartilha com outras páginas recursos que somam pelo menos isso
+PRUNE_MIN_BYTES = 32 * 1024
+# Estimativa do que cada parte tem além dos objetos copiados (cabeçalho, catálogo, trailer) e por objeto (xref)
+_PART_OVERHEAD = 512
+_OBJECT_OVERHEAD = 40
+
+
+def _streams(value):
+    value = value.get_object() if isinstance(value, IndirectObject) else value
+    if isinstance(value, StreamObject):
+        return [value]
+    if isinstance(value, ArrayObject):
+        return [item.get_object() for item in value if isinstance(item.get_object(), StreamObject)]
+    return []
+
+
+def _names(stream):
+    names = set()
+    for match in _NAME_RE.finditer(stream.get_data()):
+        raw = _NAME_ESCAPE_RE.sub(lambda m: bytes([int(m.group(1), 16)]), match.group(1))
+        try:
+            names.add("/" + raw.decode("utf-8"))
+        except UnicodeDecodeError:
+            names.add("/" + raw.decode("latin-1"))
+    return names
+
+
+def _used_names(contents, resources):
+    """Nomes citados no conteúdo, incluindo Form XObjects sem /Resources próprios (que herdam os da página)."""
+    names = set()
+    pending = list(contents)
+    visited = set()
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects is not None else {}
+    while pending:
+        stream = pending.pop()
+        found = _names(stream) - names
+        names |= found
+        for name in found & set(xobjects.keys()):
+            form = xobjects[name]
+            if id(form) not in visited and form.get("/Subtype") == "/Form" and "/Resources" not in form:
+                visited.add(id(form))
+                pending.append(form)
+    return names
+
+
+def prune_resources(page):
+    """Novo /Resources só com as entradas citadas no conteúdo da página, ou None se não der para saber quais são."""
+    resources = page.get("/Resources")
+    if resources is None:
+        return None
+    resources = resources.get_object()
+    try:
+        names = _used_names(_streams(page.raw_get("/Contents")) if "/Contents" in page else [], resources)
+    except Exception:
+        # Filtro desconhecido ou stream corrompido: copia os recursos inteiros
+        return None
+    pruned = DictionaryObject()
+    for key, value in resources.items():
+        if key not in _NAMED_RESOURCES:
+            pruned[NameObject(key)] = value
+            continue
+        entries = value.get_object()
+        kept = DictionaryObject({NameObject(k): v for k, v in entries.items() if k in names})
+        if kept:
+            pruned[NameObject(key)] = kept
+    return pruned
+
+
+def _identity(value):
+    return ("ref", value.idnum) if isinstance(value, IndirectObject) else ("obj", id(value))
+
+
+class ResourceIndex:
+    """Quais páginas de um reader valem a poda: as que compartilham com outras páginas recursos pesados.
+
+    Geradores como o ReportLab usam um /Font comum a todas as páginas com
+    poucas fontes não embutidas; aí a poda não economiza nada e decodificar
+    o conteúdo de cada página só custaria tempo.
+    """
+
+    def __init__(self, reader, sizes=None):
+        self.users = {}
+        self.sizes = {} if sizes is None else sizes
+        self._weights = {}
+        for page in reader.pages:
+            for value in self._named(page):
+                key = _identity(value)
+                self.users[key] = self.users.get(key, 0) + 1
+
+    @staticmethod
+    def _named(page):
+        if "/Resources" not in page:
+            return
+        resources = page.raw_get("/Resources")
+        yield resources
+        for key, value in resources.get_object().items():
+            if key in _NAMED_RESOURCES:
+                yield value
+
+    def worth_pruning(self, page):
+        named = list(self._named(page))
+        if not named:
+            return False
+        resources_shared = self.users.get(_identity(named[0]), 0) > 1
+        for value in named[1:]:
+            key = _identity(value)
+            if not resources_shared and self.users.get(key, 0) < 2:
+                continue
+            if key not in self._weights:
+                self._weights[key] = sum(_reachable(value.get_object().values(), self.sizes).values())
+            if self._weights[key] >= PRUNE_MIN_BYTES:
+                return True
+        return False
+
+
+# Um índice por reader: os workers reaproveitam o mesmo reader para várias partes
+_indexes = weakref.WeakKeyDictionary()
+
+
+def resource_index(reader):
+    index = _indexes.get(reader)
+    if index is None:
+        index = _indexes[reader] = ResourceIndex(reader)
+    return index
+
+
+def link_target(annot):
+    """idnum da página de destino de um link (/Dest ou ação GoTo com destino explícito), ou None."""
+    annot = annot.get_object()
+    dest = annot.get("/Dest")
+    if dest is None and "/A" in annot:
+        dest = annot["/A"].get_object().get("/D")
+    dest = dest.get_object() if isinstance(dest, IndirectObject) else dest
+    if isinstance(dest, ArrayObject) and dest and isinstance(dest[0], IndirectObject):
+        return dest[0].idnum
+    return None
+
+
+def part_page(page, part_refs, index=None):
+    """Cópia rasa da página para gravar numa parte: recursos podados e sem links para páginas de fora da parte.
+
+    Copiar a página original levaria junto tudo o que ela referencia, inclusive
+    as páginas de destino dos links (com seus conteúdos e recursos).
+    """
+    copy = PageObject(page.pdf, page.indirect_reference)
+    copy.update(page)
+    resources = prune_resources(page) if index is None or index.worth_pruning(page) else None
+    if resources is not None:
+        copy[NameObject("/Resources")] = resources
+    if "/Annots" in page:
+        annots = page["/Annots"].get_object()
+        allowed = set(part_refs) | {None}
+        kept = ArrayObject(a for a in annots if link_target(a) in allowed)
+        if len(kept) != len(annots):
+            copy[NameObject("/Annots")] = kept
+    return copy
+
+
+def write_part(reader, indices, out):
+    """Grava em out um PDF com as páginas indices (0-based) de reader."""
+    pages = [get_page(reader, i) for i in indices]
+    part_refs = {p.indirect_reference.idnum for p in pages if p.indirect_reference is not None}
+    index = resource_index(reader)
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(part_page(page, part_refs, index))
+    writer.write(out)
+
+
+# --- Planejamento das partes: lista de (nome do arquivo, índices 0-based) ---
+
+def plan_ranges(ranges, total):
+    """Uma parte por item: "1-3,4-4,5-8", "odd,even" ou lista JSON (["1-3", "-2-"]); páginas fora do documento são ignoradas."""
+    items = json.loads(ranges) if ranges.strip().startswith("[") else ranges.split(",")
+    return [(f"split_{n}.pdf", parse_pages([item], total)) for n, item in enumerate(items, 1)]
+
+
+def plan_every(total, every):
+    return [
+        (f"split_{n}.pdf", list(range(start, min(start + every, total))))
+        for n, start in enumerate(range(0, total, every), 1)
+    ]
+
+
+def _object_size(obj):
+    """Tamanho aproximado do objeto gravado (streams pelo tamanho dos dados ainda comprimidos)."""
+    buf = io.BytesIO()
+    DictionaryObject.write_to_stream(obj, buf, None) if isinstance(obj, StreamObject) else obj.write_to_stream(buf, None)
+    size = buf.tell() + _OBJECT_OVERHEAD
+    if isinstance(obj, StreamObject):
+        size += len(obj._data or b"")
+    return size
+
+
+def _reachable(values, sizes):
+    """{idnum: tamanho} dos objetos indiretos alcançáveis a partir de values, sem entrar em outras páginas."""
+    found = {}
+    stack = list(values)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            if value.idnum in found:
+                continue
+            target = value.get_object()
+            # Outras páginas (ex.: /P das anotações) não entram na conta
+            if isinstance(target, DictionaryObject) and target.get("/Type") == "/Page":
+                continue
+            if value.idnum not in sizes:
+                sizes[value.idnum] = _object_size(target)
+            found[value.idnum] = sizes[value.idnum]
+            value = target
+        if isinstance(value, DictionaryObject):
+            stack.extend(v for k, v in value.items() if k != "/Parent")
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+    return found
+
+
+def plan_size(reader, max_bytes):
+    """Agrupa páginas consecutivas enquanto a estimativa da parte (recursos compartilhados contados uma vez) couber em max_bytes.
+
+    Uma página que sozinha passa do limite vira uma parte só dela.
+    """
+    sizes = {}
+    resource_index = ResourceIndex(reader, sizes)
+    parts = []
+    current, seen, size = [], set(), _PART_OVERHEAD
+    for index, page in enumerate(reader.pages):
+        ref = page.indirect_reference
+        copy = part_page(page, {ref.idnum} if ref is not None else set(), resource_index)
+        objects = _reachable((v for k, v in copy.items() if k != "/Parent"), sizes)
+        page_size = _object_size(copy)
+        added = page_size + sum(s for num, s in objects.items() if num not in seen)
+        if current and size + added > max_bytes:
+            parts.append(current)
+            current, seen, size = [], set(), _PART_OVERHEAD
+            added = page_size + sum(objects.values())
+        current.append(index)
+        seen.update(objects)
+        size += added
+    if current:
+        parts.append(current)
+    return [(f"split_{n}.pdf", indices) for n, indices in enumerate(parts, 1)]
+
+
+def _slug(title):
+    slug = re.sub(r"[^\w-]+", "_", title, flags=re.UNICODE).strip("_")
+    return slug[:60] or "secao"
+
+
+def plan_bookmarks(reader):
+    """Uma parte por marcador de primeiro nível, da página dele até a anterior ao próximo."""
+    starts = {}
+    for item in reader.outline:
+        if isinstance(item, list):
+            continue  # filhos do marcador anterior
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        if page is not None and 0 <= page < len(reader.pages):
+            starts.setdefault(page, item.title or "")
+    if not starts:
+        raise ValueError("O PDF não tem marcadores de primeiro nível que apontem para páginas.")
+    bounds = sorted(starts)
+    parts = []
+    if bounds[0] > 0:
+        # Páginas antes do primeiro marcador (capa, sumário)
+        parts.append((None, list(range(0, bounds[0]))))
+    for start, end in zip(bounds, bounds[1:] + [len(reader.pages)]):
+        parts.append((starts[start], list(range(start, end))))
+    return [
+        (f"split_{n}.pdf" if title is None else f"split_{n}_{_slug(title)}.pdf", indices)
+        for n, (title, indices) in enumerate(parts, 1)
+    ]
+
+
+def plan(pdf_path, mode, ranges=None, every=None, max_bytes=None):
+    """Partes da divisão de pdf_path no modo dado. ValueError se a entrada ou os parâmetros não servirem."""
+    reader = PdfReader(pdf_path)
+    if reader.is_encrypted:
+        raise ValueError("PDF protegido por senha.")
+    if mode in ("ranges", "every"):
+        # Só o número de páginas, sem percorrer a árvore (quem carrega as páginas são os workers)
+        total = page_count(reader)
+        return plan_ranges(ranges, total) if mode == "ranges" else plan_every(total, every)
+    if mode == "size":
+        return plan_size(reader, max_bytes)
+    return plan_bookmarks(reader)
@@ -0,0 +1,189 @@
+# Camada compartilhada de upload/saída com memória limitada.
+# Em vez de `await file.read()` + io.BytesIO (o PDF inteiro em memória pelo
+# menos duas vezes), o PyPDF2 lê direto do arquivo temporário do upload,
+# mapeado em memória (mmap) quando ele já está em disco.
+# Também resolve documentos já armazenados (doc_id) no lugar de um upload.
+import mmap
+import os
+import tempfile
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import metrics
+from docstore import get_store
+from scratch import get_scratch
+
+# Uploads maiores que isso vão para disco (bytes)
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024))
+# Total de bytes de upload mantidos em memória por requisição
+UPLOAD_MEMORY_BUDGET = int(os.environ.get("UPLOAD_MEMORY_BUDGET", 8 * 1024 * 1024))
+# Tamanho máximo aceito por arquivo (0 = sem limite)
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 0))
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+class UploadSpool:
+    """Abre uploads como streams para o PyPDF2, respeitando o orçamento de memória da requisição."""
+
+    def __init__(self, memory_budget=UPLOAD_MEMORY_BUDGET, threshold=UPLOAD_SPOOL_THRESHOLD):
+        self.memory_budget = memory_budget
+        self.threshold = threshold
+        self.in_memory = 0
+        self._maps = []
+        self._views = []
+        self._readers = []
+        # True quando a entrada veio de um doc_id: o resultado também é armazenado
+        self.doc_mode = False
+
+    def _check_input(self, upload, doc_id):
+        if doc_id:
+            self.doc_mode = True
+            try:
+                return get_store().path(doc_id)
+            except KeyError:
+                raise HTTPException(status_code=404, detail="Documento não encontrado (ou expirado).")
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Envie um arquivo ou um doc_id.")
+        return None
+
+    def open(self, upload, doc_id=None):
+        path = self._check_input(upload, doc_id)
+        if path is not None:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            return mm
+        f = upload.file
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        if UPLOAD_MAX_BYTES and size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Arquivo maior que o limite permitido.")
+        rolled = getattr(f, "_rolled", True)
+        if not rolled:
+            if size <= self.threshold and self.in_memory + size <= self.memory_budget:
+                # Pequeno o bastante: lê do próprio buffer do upload, sem cópia
+                self.in_memory += size
+                return f
+            f.rollover()
+        if size == 0:
+            return f
+        try:
+            f.flush()
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, AttributeError):
+            # Sem descritor de arquivo real: usa o stream como está
+            return f
+        self._maps.append(mm)
+        return mm
+
+    def open_pdf(self, upload, doc_id=None):
+        """PdfReader para o upload ou, com doc_id, um reader emprestado do armazenamento."""
+        from PyPDF2 import PdfReader
+        with metrics.stage("parse"):
+            if self._check_input(upload, doc_id) is not None:
+                reader = get_store().checkout_reader(doc_id)
+                self._readers.append((doc_id, reader))
+                return reader
+            return PdfReader(self.open(upload))
+
+    def open_buffer(self, upload, doc_id=None):
+        """Como open(), mas devolve um buffer (memoryview) para bibliotecas como o PyMuPDF."""
+        stream = self.open(upload, doc_id)
+        if isinstance(stream, mmap.mmap):
+            view = memoryview(stream)
+        elif hasattr(stream, "_file") and hasattr(stream._file, "getbuffer"):
+            view = stream._file.getbuffer()
+        else:
+            view = memoryview(stream.read())
+        self._views.append(view)
+        return view
+
+    def pdf_response(self, writer, filename, headers=None):
+        """Resposta com o PDF gerado; se a entrada foi um doc_id, armazena o resultado e devolve o novo id."""
+        if not self.doc_mode and isinstance(getattr(writer, "source", None), mmap.mmap):
+            # Atualização incremental sobre upload mapeado: o original sai direto
+            # do mmap (fechado só depois do envio), seguido do trecho anexado
+            all_headers = {"Content-Disposition": f"attachment; filename={filename}", "Content-Length": str(writer.size)}
+            if headers:
+                all_headers.update(headers)
+            return StreamingResponse(writer.iter_chunks(OUTPUT_CHUNK_SIZE), media_type="application/pdf", headers=all_headers)
+        return self.file_response(write_spooled(writer), filename, headers)
+
+    def file_response(self, out, filename, headers=None):
+        if not self.doc_mode:
+            return spooled_response(out, filename, headers)
+        try:
+            out.seek(0)
+            doc_id = get_store().put_stream(out)
+            size = out.tell()
+        finally:
+            out.close()
+        all_headers = {"X-Document-Id": doc_id}
+        if headers:
+            all_headers.update(headers)
+        return JSONResponse(content={"id": doc_id, "size": size, "filename": filename}, headers=all_headers)
+
+    def close(self):
+        for doc_id, reader in self._readers:
+            get_store().release_reader(doc_id, reader)
+        self._readers.clear()
+        # Views precisam ser liberadas antes de fechar os mmaps
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        for mm in self._maps:
+            mm.close()
+        self._maps.clear()
+
+
+def upload_spool():
+    """Dependência FastAPI: um UploadSpool por requisição, fechado após o envio da resposta (FastAPI >= 0.118, ver scratch_dir)."""
+    spool = UploadSpool()
+    try:
+        yield spool
+    finally:
+        spool.close()
+
+
+def spooled_file():
+    """Arquivo temporário para saídas: fica em memória até UPLOAD_SPOOL_THRESHOLD e depois vai para disco (SCRATCH_DIR)."""
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, dir=get_scratch().root)
+
+
+def write_spooled(writer):
+    """Serializa o PdfWriter num arquivo temporário que só vai para disco se passar do limite."""
+    out = spooled_file()
+    with metrics.stage("serialize"):
+        writer.write(out)
+    out.seek(0)
+    return out
+
+
+def iter_file(f, chunk_size=OUTPUT_CHUNK_SIZE):
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def pdf_response(writer, filename, headers=None):
+    """Resposta de download para o PdfWriter, enviada em blocos a partir do arquivo temporário."""
+    return spooled_response(write_spooled(writer), filename, headers)
+
+
+def spooled_response(out, filename, headers=None, media_type="application/pdf"):
+    """Envia um arquivo temporário já escrito (e o fecha ao final)."""
+    out.seek(0, os.SEEK_END)
+    size = out.tell()
+    out.seek(0)
+    all_headers = {"Content-Disposition": f"attachment; filename={filename}", "Content-Length": str(size)}
+    if headers:
+        all_headers.update(headers)
+    return StreamingResponse(iter_file(out), media_type=media_type, headers=all_headers)
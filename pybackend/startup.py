@@ -0,0 +1,98 @@
+# Inicialização do processo e aquecimento (PRELOAD).
+# As bibliotecas pesadas (PyMuPDF, reportlab, Pillow, pikepdf) são importadas
+# só nas funções que as usam: o servidor sobe sem pagar por elas e quem nunca
+# converte PDF em imagem nunca carrega o PyMuPDF (o PyPDF2, usado por quase
+# todas as rotas, vem com main). O custo então cai na primeira requisição de
+# cada rota. Com PRELOAD, warmup() paga esse custo na subida: importa os
+# backends e exercita as partes carregadas sob demanda (fontes do reportlab,
+# plugins do Pillow, contexto do MuPDF).
+#
+# Num servidor prefork (gunicorn --preload), main é importado uma vez no
+# processo mestre, antes do fork: os workers herdam os módulos já carregados
+# e compartilham essas páginas de memória (copy-on-write) em vez de cada um
+# importar tudo de novo. Nada aqui abre pools, threads, arquivos ou conexões,
+# que não sobrevivem ao fork; isso continua no lifespan de cada worker.
+import os
+import time
+
+from logs import get_logger
+
+log = get_logger("startup")
+
+
+def _reportlab():
+    import io
+    from reportlab.lib.utils import ImageReader  # noqa: F401
+    from reportlab.pdfgen import canvas
+    c = canvas.Canvas(io.BytesIO())
+    c.setFont("Helvetica", 12)
+    c.drawString(0, 0, "0")
+    c.save()
+
+
+def _pillow():
+    from PIL import Image
+    Image.init()
+
+
+def _pymupdf():
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    doc.new_page()
+    doc.close()
+
+
+def _pikepdf():
+    try:
+        import pikepdf
+    except ImportError:
+        return
+    pikepdf.new().close()
+
+
+BACKENDS = {
+    "reportlab": _reportlab,
+    "pillow": _pillow,
+    "pymupdf": _pymupdf,
+    "pikepdf": _pikepdf,
+}
+
+
+def _parse_preload(spec):
+    spec = (spec or "").strip().lower()
+    if spec in ("", "0", "false", "no", "off"):
+        return ()
+    if spec in ("1", "true", "yes", "on", "all"):
+        return tuple(BACKENDS)
+    names = tuple(filter(None, (s.strip() for s in spec.split(","))))
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        raise ValueError(f"PRELOAD: backend desconhecido {', '.join(unknown)} (use {', '.join(BACKENDS)} ou 1)")
+    return names
+
+
+# Backends aquecidos na importação do app: 1 = todos, ou lista (ex.: "pymupdf,reportlab")
+PRELOAD = _parse_preload(os.environ.get("PRELOAD", "0"))
+
+
+def warmup(names=PRELOAD):
+    """Importa e aquece os backends pedidos, registrando o tempo de cada um."""
+    timings = {}
+    for name in names:
+        started = time.perf_counter()
+        BACKENDS[name]()
+        timings[name] = round((time.perf_counter() - started) * 1000)
+    if timings:
+        log.info("warmup_finished", pid=os.getpid(), **{f"{name}_ms": ms for name, ms in timings.items()})
+    return timings
+
+
+def warm_process(*names):
+    """Initializer dos pools de processos: aquece os backends que as tarefas do pool usam."""
+    warmup([name for name in names if name in PRELOAD])
+
+
+def prestart(pool, workers):
+    """Sobe os processos do pool (cada um roda o initializer, ex.: warm_process) sem esperar uma tarefa de verdade."""
+    for _ in range(workers):
+        pool.submit(os.getpid)
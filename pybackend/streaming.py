@@ -0,0 +1,48 @@
+# ZIP em streaming: cada entrada é serializada assim que fica pronta e os
+# bytes são entregues direto ao StreamingResponse, sem manter o arquivo
+# inteiro em memória nem reabrir o ZIP a cada parte.
+import io
+import time
+import zipfile
+
+
+class _ZipSink(io.RawIOBase):
+    """Destino não-posicionável: acumula o que o zipfile escreve até o próximo drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """Monta um ZIP entrada a entrada; add() e close() devolvem os bytes prontos para envio.
+
+    Como o destino não aceita seek, o zipfile grava descritores de dados após
+    cada entrada, e a memória usada fica limitada a uma entrada por vez.
+    """
+
+    def __init__(self):
+        self._sink = _ZipSink()
+        self._zip = zipfile.ZipFile(self._sink, "w")
+
+    def add(self, name, data, compress=True):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        # Imagens PNG/JPEG/WebP já são comprimidas: gravar sem deflate
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        return self._sink.drain()
@@ -0,0 +1,95 @@
+# Miniaturas de página renderizadas no servidor (GET /api/render/{doc_id}/{page}).
+# Usa o mesmo caminho do /api/pdf2img (workers.render_page no pool de
+# processos) e guarda o resultado num TieredCache (LRU em memória + disco),
+# com chave = hash do documento + página + tamanho + formato. Como o
+# documento é endereçado por conteúdo, a imagem de uma chave nunca muda:
+# o ETag é a própria chave e o navegador pode guardá-la como imutável.
+import asyncio
+import os
+import threading
+
+import metrics
+import workers
+from cache import TieredCache
+from docstore import DOC_CACHE_TTL, get_store
+
+RENDER_CACHE_DIR = os.environ.get(
+    "RENDER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "render")
+)
+RENDER_CACHE_MEMORY_BYTES = int(os.environ.get("RENDER_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+RENDER_CACHE_DISK_BYTES = int(os.environ.get("RENDER_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+# Largura padrão (pixels) quando nem w nem dpi são informados
+RENDER_DEFAULT_WIDTH = int(os.environ.get("RENDER_DEFAULT_WIDTH", 300))
+# Páginas renderizadas em segundo plano assim que um documento é enviado (0 desativa)
+RENDER_PREFETCH_PAGES = int(os.environ.get("RENDER_PREFETCH_PAGES", 3))
+
+THUMBNAIL_FORMATS = {"webp": "image/webp", "png": "image/png"}
+THUMBNAIL_QUALITY = 80
+CACHE_CONTROL = "private, max-age=86400, immutable"
+
+
+def cache_key(doc_id, page, dpi=None, width=None, fmt="webp"):
+    size = f"w{width}" if width else f"d{dpi}"
+    return f"{doc_id}-p{page}-{size}.{fmt}"
+
+
+def etag(key):
+    return f'"{key}"'
+
+
+class Renderer:
+    """Renderiza miniaturas via pool de processos, com cache e sem renderizar a mesma chave duas vezes ao mesmo tempo."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._in_flight = {}
+
+    async def get(self, pool, doc_id, page, dpi=None, width=None, fmt="webp"):
+        """(bytes da imagem, True se veio do cache). KeyError se o documento não existir."""
+        key = cache_key(doc_id, page, dpi, width, fmt)
+        # Em thread: mesmo um acerto em memória toca o arquivo no disco (TTL), e o tier em disco lê o arquivo
+        data = await asyncio.to_thread(self.cache.get, key)
+        metrics.count_cache("render", data is not None)
+        if data is not None:
+            return data, True
+        task = self._in_flight.get(key)
+        if task is None:
+            path = await asyncio.to_thread(get_store().path, doc_id)
+            # Outra requisição pode ter começado a mesma chave durante o await
+            task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(pool, key, path, page, dpi, width, fmt))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: um cliente que desconecta não cancela a renderização compartilhada
+        return await asyncio.shield(task), False
+
+    async def _render(self, pool, key, path, page, dpi, width, fmt):
+        loop = asyncio.get_running_loop()
+        _, data = await loop.run_in_executor(
+            pool, workers.render_page, path, page, dpi or 72, fmt, THUMBNAIL_QUALITY, width
+        )
+        await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    async def prefetch(self, pool, doc_id, pages=RENDER_PREFETCH_PAGES):
+        """Renderiza as primeiras páginas no tamanho padrão, para que a primeira visualização já encontre o cache."""
+        results = await asyncio.gather(
+            *(self.get(pool, doc_id, page, width=RENDER_DEFAULT_WIDTH) for page in range(1, pages + 1)),
+            return_exceptions=True,
+        )
+        return sum(1 for r in results if not isinstance(r, BaseException))
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = Renderer(TieredCache(
+                RENDER_CACHE_DIR, RENDER_CACHE_MEMORY_BYTES, RENDER_CACHE_DISK_BYTES, DOC_CACHE_TTL
+            ))
+    return _renderer
@@ -0,0 +1,291 @@
+# Uploads retomáveis (protocolo tus 1.0.0, em /api/uploads) para entradas de
+# vários GB: o cliente cria a sessão com o tamanho total (POST), envia os
+# bytes em um ou mais PATCH a partir do Upload-Offset e, se a conexão cair,
+# pergunta com HEAD até onde o servidor recebeu e continua dali, em vez de
+# reenviar tudo. Extensões: creation, checksum (Upload-Checksum por PATCH;
+# bloco que não confere é descartado), expiration e termination.
+#
+# Cada sessão é um diretório em UPLOAD_SESSION_DIR com info.json (tamanho
+# declarado, metadados) e o arquivo de dados, escrito direto do corpo da
+# requisição: o offset é o tamanho do arquivo, então qualquer worker do
+# uvicorn atende qualquer PATCH (um por vez por sessão, via flock). Completo,
+# o arquivo é movido para o armazenamento de documentos e o doc_id resultante
+# (X-Document-Id) serve de entrada para os endpoints (/api/merge, /api/pdf2img,
+# /api/edit/*...). Sessões sem atividade por UPLOAD_SESSION_TTL são apagadas.
+import asyncio
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from email.utils import formatdate
+
+from fastapi import HTTPException
+
+from docstore import get_store
+from logs import get_logger
+
+log = get_logger("uploads")
+
+UPLOAD_SESSION_DIR = os.environ.get(
+    "UPLOAD_SESSION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "uploads")
+)
+# Segundos sem atividade até a sessão expirar
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+# Tamanho máximo de um upload
+UPLOAD_SESSION_MAX_BYTES = int(os.environ.get("UPLOAD_SESSION_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+# Soma dos tamanhos declarados das sessões em aberto (0 = sem limite)
+UPLOAD_SESSION_QUOTA_BYTES = int(os.environ.get("UPLOAD_SESSION_QUOTA_BYTES", 16 * 1024 * 1024 * 1024))
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,checksum,expiration,termination"
+CHECKSUM_ALGORITHMS = ("sha1", "sha256", "md5")
+# Headers que um cliente em outra origem precisa ler (CORS)
+TUS_HEADERS = (
+    "Location", "Tus-Resumable", "Tus-Version", "Tus-Extension", "Tus-Max-Size", "Tus-Checksum-Algorithm",
+    "Upload-Offset", "Upload-Length", "Upload-Metadata", "Upload-Expires", "X-Document-Id",
+)
+# Status do tus para Upload-Checksum que não confere
+CHECKSUM_MISMATCH = 460
+
+_WRITE_CHUNK = 1024 * 1024
+_DATA = "data"
+_INFO = "info.json"
+_LOCK = "lock"
+
+
+def parse_metadata(header):
+    """Upload-Metadata ("chave base64,chave2 base64") -> dict; ValueError se malformado."""
+    metadata = {}
+    for item in filter(None, (s.strip() for s in (header or "").split(","))):
+        key, _, value = item.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode("utf-8") if value else ""
+        except (binascii.Error, UnicodeDecodeError):
+            raise ValueError(f"Upload-Metadata inválido em {key!r}")
+    return metadata
+
+
+def parse_checksum(header):
+    """Upload-Checksum ("algoritmo base64") -> (hash vazio, digest esperado); None sem header."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise HTTPException(status_code=400, detail=f"Algoritmo de checksum não suportado. Use {', '.join(CHECKSUM_ALGORITHMS)}.")
+    try:
+        expected = base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Upload-Checksum inválido.")
+    return hashlib.new(algorithm), expected
+
+
+class UploadStore:
+    """Sessões de upload retomável em disco, compartilhadas entre os workers."""
+
+    def __init__(self, directory=UPLOAD_SESSION_DIR, ttl=UPLOAD_SESSION_TTL,
+                 max_bytes=UPLOAD_SESSION_MAX_BYTES, quota_bytes=UPLOAD_SESSION_QUOTA_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _dir(self, upload_id):
+        try:
+            upload_id = uuid.UUID(upload_id, version=4).hex
+        except ValueError:
+            raise KeyError(upload_id)
+        return os.path.join(self.directory, upload_id)
+
+    def _expired(self, mtime, now=None):
+        return self.ttl and (now or time.time()) - mtime > self.ttl
+
+    def _read_info(self, path):
+        with open(os.path.join(path, _INFO)) as f:
+            return json.load(f)
+
+    def _write_info(self, path, info):
+        tmp = os.path.join(path, f"{_INFO}.{uuid.uuid4().hex}.part")
+        with open(tmp, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp, os.path.join(path, _INFO))
+
+    def _pending_bytes(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                info = self._read_info(entry.path)
+            except (OSError, ValueError):
+                continue
+            if not info.get("doc_id"):
+                total += info["length"]
+        return total
+
+    def create(self, length, metadata=None):
+        """Abre uma sessão para length bytes e devolve o id (413 acima do máximo, 503 sem cota)."""
+        if length > self.max_bytes:
+            raise HTTPException(status_code=413, detail="Arquivo maior que o limite permitido.")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, upload_id)
+        with self._lock:
+            if self.quota_bytes and self._pending_bytes() + length > self.quota_bytes:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Espaço para uploads esgotado, tente novamente mais tarde.",
+                    headers={"Retry-After": "60"},
+                )
+            os.makedirs(path)
+            open(os.path.join(path, _DATA), "wb").close()
+            self._write_info(path, {"length": length, "metadata": metadata or {}, "created": time.time()})
+        log.info("upload_created", upload_id=upload_id, length=length)
+        return upload_id
+
+    def status(self, upload_id):
+        """Estado da sessão (length, offset, expires, metadata, doc_id); KeyError se não existe ou expirou."""
+        path = self._dir(upload_id)
+        try:
+            info = self._read_info(path)
+            data = os.path.join(path, _DATA)
+            if info.get("doc_id"):
+                mtime = os.stat(os.path.join(path, _INFO)).st_mtime
+                offset = info["length"]
+            else:
+                st = os.stat(data)
+                mtime, offset = st.st_mtime, st.st_size
+        except (OSError, ValueError):
+            raise KeyError(upload_id)
+        if self._expired(mtime):
+            self.delete(upload_id)
+            raise KeyError(upload_id)
+        info.update(offset=offset, expires=mtime + self.ttl if self.ttl else None)
+        return info
+
+    async def append(self, upload_id, offset, chunks, checksum=None):
+        """Grava o corpo de um PATCH (iterador assíncrono de bytes) a partir de offset; devolve o estado da sessão.
+
+        Com o último byte, o arquivo vai para o armazenamento de documentos e
+        o estado traz o doc_id.
+
+        409 se offset não for o atual, 423 se outro PATCH da mesma sessão está
+        em andamento, 413 se passar do tamanho declarado e 460 se o checksum
+        não conferir (nesses dois casos, nada do bloco é mantido). Se a
+        conexão cair no meio, o que chegou fica (o cliente retoma do HEAD),
+        exceto com checksum, que só vale para o bloco inteiro.
+        """
+        path = self._dir(upload_id)
+        try:
+            lock = open(os.path.join(path, _LOCK), "a")
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise HTTPException(status_code=423, detail="Outro envio desta sessão está em andamento.")
+            info = await asyncio.to_thread(self.status, upload_id)
+            if info.get("doc_id"):
+                raise HTTPException(status_code=409, detail="Upload já concluído.", headers={"Upload-Offset": str(info["offset"])})
+            if offset != info["offset"]:
+                raise HTTPException(status_code=409, detail="Upload-Offset não confere.", headers={"Upload-Offset": str(info["offset"])})
+            received = await self._write(path, info, offset, chunks, checksum)
+            info["offset"] = offset + received
+            if self.ttl:
+                info["expires"] = time.time() + self.ttl
+            if info["offset"] == info["length"]:
+                info["doc_id"] = await asyncio.to_thread(self._complete, path, info)
+            return info
+        finally:
+            lock.close()
+
+    async def _write(self, path, info, offset, chunks, checksum):
+        digest, expected = checksum or (None, None)
+        received = 0
+        buf = bytearray()
+        out = await asyncio.to_thread(open, os.path.join(path, _DATA), "r+b")
+        try:
+            out.seek(offset)
+            try:
+                async for chunk in chunks:
+                    if offset + received + len(buf) + len(chunk) > info["length"]:
+                        raise HTTPException(status_code=413, detail="Mais bytes do que o Upload-Length declarado.")
+                    buf += chunk
+                    if len(buf) >= _WRITE_CHUNK:
+                        await asyncio.to_thread(out.write, buf)
+                        if digest is not None:
+                            digest.update(buf)
+                        received += len(buf)
+                        buf = bytearray()
+                if buf:
+                    await asyncio.to_thread(out.write, buf)
+                    if digest is not None:
+                        digest.update(buf)
+                    received += len(buf)
+                    buf = bytearray()
+                if digest is not None and digest.digest() != expected:
+                    raise HTTPException(status_code=CHECKSUM_MISMATCH, detail="Checksum do bloco não confere.")
+            except BaseException as e:
+                # Sem checksum, uma conexão interrompida mantém o que já chegou
+                keep = checksum is None and not isinstance(e, HTTPException)
+                if keep and buf:
+                    out.write(buf)
+                    received += len(buf)
+                else:
+                    received = 0
+                out.truncate(offset + received)
+                if received:
+                    log.info("upload_interrupted", upload_id=os.path.basename(path), offset=offset + received)
+                    return received
+                raise
+        finally:
+            out.close()
+        return received
+
+    def _complete(self, path, info):
+        # Move o arquivo completo para o armazenamento de documentos (sem cópia)
+        doc_id = get_store().put_path(os.path.join(path, _DATA))
+        self._write_info(path, dict(info, doc_id=doc_id))
+        log.info("upload_completed", upload_id=os.path.basename(path), length=info["length"], doc_id=doc_id)
+        return doc_id
+
+    def delete(self, upload_id):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def evict_expired(self):
+        """Apaga as sessões sem atividade há mais de ttl segundos; devolve quantas removeu."""
+        if not self.ttl:
+            return 0
+        now = time.time()
+        removed = 0
+        for entry in list(os.scandir(self.directory)):
+            try:
+                mtime = max(os.stat(os.path.join(entry.path, name)).st_mtime
+                            for name in os.listdir(entry.path) if name in (_DATA, _INFO))
+            except (OSError, ValueError):
+                mtime = entry.stat().st_mtime
+            if self._expired(mtime, now):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+_uploads = None
+_uploads_lock = threading.Lock()
+
+
+def get_uploads():
+    global _uploads
+    with _uploads_lock:
+        if _uploads is None:
+            _uploads = UploadStore()
+    return _uploads
@@ -0,0 +1,521 @@
+# Funções executadas nos processos do pool (fora do event loop do uvicorn).
+# Precisam ficar em um módulo leve e importável: com o contexto "spawn" cada
+# worker importa apenas este arquivo, e não o app FastAPI inteiro.
+import io
+import os
+import threading
+import time
+
+# Documentos PyMuPDF abertos neste processo. Handles do fitz não podem ser
+# compartilhados entre processos, então cada worker abre o PDF uma única vez
+# e reaproveita o handle para todas as páginas que receber.
+_open_docs = {}
+_MAX_OPEN_DOCS = 4
+# Protege só o dicionário: abrir e usar um documento acontece fora dele
+_docs_lock = threading.Lock()
+# Handles sem uso por mais que isso (segundos) são fechados no próximo acesso ao
+# cache, mesmo se o arquivo continua existindo (ex.: documentos do armazenamento usados pelo compare)
+DOC_IDLE_TTL = float(os.environ.get("DOC_IDLE_TTL", 30))
+# Último uso de cada handle aberto (time.monotonic)
+_last_used = {}
+
+# Formatos aceitos para rasterização (nome -> extensão do arquivo)
+IMAGE_FORMATS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+
+
+def _open_fitz(pdf_path):
+    import fitz  # PyMuPDF
+    return fitz.open(pdf_path)
+
+
+def _open_pypdf(pdf_path):
+    # Sobre o handle do arquivo: com um caminho, o PdfReader copia o PDF inteiro para um BytesIO
+    from PyPDF2 import PdfReader
+    stream = open(pdf_path, "rb")
+    try:
+        return PdfReader(stream)
+    except BaseException:
+        stream.close()
+        raise
+
+
+def _close(doc):
+    if hasattr(doc, "close"):
+        doc.close()
+    elif hasattr(doc, "stream"):
+        doc.stream.close()  # PdfReader aberto por _open_pypdf
+
+
+def _stale(key, now):
+    if now - _last_used.get(key, now) > DOC_IDLE_TTL:
+        return True
+    try:
+        st = os.stat(key[1])
+    except OSError:
+        return True
+    return (st.st_ino, st.st_size) != key[2:]
+
+
+def _get_doc(pdf_path, opener=_open_fitz):
+    st = os.stat(pdf_path)
+    # Inode + tamanho (não mtime): o armazenamento de documentos atualiza o
+    # mtime a cada acesso (LRU/TTL), o que reabriria o documento toda vez
+    key = (opener.__name__, pdf_path, st.st_ino, st.st_size)
+    now = time.monotonic()
+    with _docs_lock:
+        doc = _open_docs.get(key)
+        # Arquivos apagados (diretório temporário de uma requisição já encerrada),
+        # trocados ou ociosos: fecha os handles para liberar disco e memória
+        stale = [k for k in _open_docs if k != key and _stale(k, now)]
+        expired = [_open_docs.pop(k) for k in stale]
+        for k in stale:
+            _last_used.pop(k, None)
+        if doc is not None:
+            _last_used[key] = now
+    for old in expired:
+        _close(old)
+    if doc is not None:
+        return doc
+    doc = opener(pdf_path)
+    with _docs_lock:
+        current = _open_docs.get(key)
+        if current is None:
+            # Fecha o documento mais antigo para não acumular handles
+            while len(_open_docs) >= _MAX_OPEN_DOCS:
+                old_key = next(iter(_open_docs))
+                _last_used.pop(old_key, None)
+                expired.append(_open_docs.pop(old_key))
+            _open_docs[key] = doc
+            _last_used[key] = now
+    if current is not None:
+        _close(doc)
+        return current
+    for old in expired:
+        _close(old)
+    return doc
+
+
+def render_page(pdf_path, page_num, dpi=72, fmt="png", quality=85, width=None):
+    """Renderiza uma página (1-based) e devolve (page_num, bytes da imagem).
+
+    Com width, a escala é escolhida para que a imagem tenha essa largura em
+    pixels (dpi é ignorado). IndexError se a página não existir e
+    PermissionError se o PDF exigir senha.
+    """
+    doc = _get_doc(pdf_path)
+    if doc.needs_pass:
+        raise PermissionError("PDF protegido por senha")
+    if not 1 <= page_num <= doc.page_count:
+        raise IndexError(f"página {page_num} fora do documento ({doc.page_count} páginas)")
+    page = doc.load_page(page_num - 1)
+    if width:
+        import fitz
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    else:
+        pix = page.get_pixmap(dpi=dpi, alpha=False)
+    if fmt == "png":
+        return page_num, pix.tobytes("png")
+    if fmt in ("jpeg", "jpg"):
+        return page_num, pix.tobytes("jpeg", jpg_quality=quality)
+    # WebP não é suportado pelo MuPDF: converte via Pillow
+    from PIL import Image
+    mode = "RGB" if pix.n >= 3 else "L"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    buf = io.BytesIO()
+    img.save(buf, format="WEBP", quality=quality)
+    return page_num, buf.getvalue()
+
+
+# Níveis de compressão (/api/edit/compress):
+#   garbage: 1 remove objetos órfãos, 3 também funde objetos duplicados,
+#            4 também compara o conteúdo dos streams (fontes/imagens idênticas)
+#   images:  (dpi alvo, qualidade JPEG) para reamostrar imagens embutidas
+COMPRESSION_LEVELS = {
+    "low": {"garbage": 1, "clean": False, "use_objstms": False, "images": None},
+    "default": {"garbage": 3, "clean": True, "use_objstms": True, "images": None},
+    "high": {"garbage": 4, "clean": True, "use_objstms": True, "images": (150, 75)},
+}
+
+
+class _OutputProxy:
+    """Esconde o atributo `name` do arquivo de destino.
+
+    O PyMuPDF trata qualquer objeto com `name` como caminho, o que quebra com
+    SpooledTemporaryFile (name é None em memória e um fd inteiro em disco).
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, data):
+        return self._f.write(data)
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def truncate(self, *args):
+        return self._f.truncate(*args)
+
+    def flush(self):
+        return self._f.flush()
+
+
+def compress_document(src, dest, level="default", image_dpi=None, image_quality=None):
+    """Comprime o PDF src (caminho ou buffer) e grava em dest (caminho ou arquivo)."""
+    import fitz  # PyMuPDF
+    opts = COMPRESSION_LEVELS[level]
+    images = opts["images"]
+    if image_dpi or image_quality:
+        default_dpi, default_quality = images or (150, 75)
+        images = (image_dpi or default_dpi, image_quality or default_quality)
+    if isinstance(src, str):
+        doc = fitz.open(src)
+    else:
+        doc = fitz.open(stream=src, filetype="pdf")
+    try:
+        if doc.needs_pass:
+            raise ValueError("PDF protegido por senha")
+        if images:
+            dpi, quality = images
+            # Só reamostra imagens com resolução efetiva bem acima do alvo
+            doc.rewrite_images(dpi_threshold=int(dpi * 1.5), dpi_target=dpi, quality=quality)
+        doc.save(
+            dest if isinstance(dest, str) else _OutputProxy(dest),
+            garbage=opts["garbage"],
+            clean=opts["clean"],
+            deflate=True,
+            deflate_images=True,
+            deflate_fonts=True,
+            use_objstms=opts["use_objstms"],
+        )
+    finally:
+        doc.close()
+
+
+def save_edit(doc, out, steps=(), timings=None):
+    """Grava o documento editado (operations.apply) em out.
+
+    Se a última operação de steps for compress, comprime o resultado (mantendo
+    a versão sem compressão se ela for menor).
+    """
+    writer = doc.finish()
+    compress = steps[-1] if steps and steps[-1].get("op") == "compress" else None
+    if compress is None:
+        writer.write(out)
+        if timings is not None:
+            timings.mark("serialize")
+        return
+    buf = io.BytesIO()
+    writer.write(buf)
+    if timings is not None:
+        timings.mark("serialize")
+    data = buf.getbuffer()
+    compress_document(data, out, compress.get("level", "default"), compress.get("image_dpi"), compress.get("image_quality"))
+    if out.tell() >= len(data):
+        # Nada a ganhar: mantém a versão sem compressão
+        out.seek(0)
+        out.truncate()
+        out.write(data)
+    data.release()
+    if timings is not None:
+        timings.mark(f"{len(steps)}-compress")
+
+
+def edit_document(src, dest, steps, incremental=False, password=None, linearize=False):
+    """Edição completa a partir de caminhos, para o executor em modo processo (CPU_EXECUTOR=process).
+
+    Com linearize, o resultado é reescrito linearizado (sempre "full").
+    Devolve (modo de gravação, operations.Timings).
+    """
+    from PyPDF2 import PdfReader
+    import operations
+    timings = operations.Timings()
+    with open(src, "rb") as f:
+        doc = operations.apply(PdfReader(f), steps, incremental, password, timings)
+        with open(dest, "wb") as out:
+            save_edit(doc, out, steps, timings)
+    if linearize:
+        from linearize import linearize_in_place, output_password
+        linearize_in_place(dest, output_password(steps))
+        timings.mark("linearize")
+        return "full", timings
+    return operations.save_mode(doc), timings
+
+
+# Orientação EXIF -> /Rotate da página (só as rotações puras; espelhamentos exigem decodificar)
+_EXIF_ROTATION = {1: 0, 3: 180, 6: 90, 8: 270}
+
+
+def _png_idat(path):
+    """Dados IDAT de um PNG que o PDF decodifica sozinho (8 bits, cinza/RGB, sem entrelaçamento nem transparência).
+
+    Devolve (largura, altura, cores, dados) ou None se o PNG precisar ser decodificado.
+    """
+    import struct
+    with open(path, "rb") as f:
+        if f.read(8) != b"\x89PNG\r\n\x1a\n":
+            return None
+        idat = []
+        header = None
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return None
+            length, kind = struct.unpack(">I4s", head)
+            if kind == b"IHDR":
+                width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", f.read(13))
+                if depth != 8 or color not in (0, 2) or interlace:
+                    return None
+                header = (width, height, 1 if color == 0 else 3)
+                f.seek(4, os.SEEK_CUR)
+            elif kind == b"IDAT":
+                idat.append(f.read(length))
+                f.seek(4, os.SEEK_CUR)
+            elif kind == b"tRNS":
+                return None
+            elif kind == b"IEND":
+                break
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+    if header is None or not idat:
+        return None
+    return header + (b"".join(idat),)
+
+
+def prepare_image(path, max_size=None, quality=85):
+    """Prepara uma imagem para o ImagePdfWriter (imagepdf.py).
+
+    JPEGs que não precisam ser reduzidos não são decodificados: só o cabeçalho
+    é lido e o arquivo é copiado como está para o PDF. As demais imagens são
+    decodificadas e comprimidas com Flate (sem perdas); PNGs simples são
+    copiados com os preditores PNG, também sem decodificar. Com max_size
+    (maior lado em pixels) imagens maiores são reduzidas.
+    """
+    import zlib
+    from PIL import Image, ImageOps
+    with Image.open(path) as im:
+        too_big = max_size and max(im.size) > max_size
+        # Orientações espelhadas (2, 4, 5, 7) não viram um /Rotate: vão pela decodificação (exif_transpose)
+        orientation = im.getexif().get(0x0112, 1) if im.format == "JPEG" else 1
+        if im.format == "JPEG" and im.mode in ("L", "RGB", "CMYK") and not too_big and orientation in _EXIF_ROTATION:
+            colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[im.mode]
+            return {
+                "width": im.width, "height": im.height, "colorspace": colorspace,
+                "filter": "/DCTDecode",
+                # JPEGs CMYK (Adobe) são gravados invertidos
+                "decode": [1, 0, 1, 0, 1, 0, 1, 0] if im.mode == "CMYK" else None,
+                "rotate": _EXIF_ROTATION[orientation],
+                "path": path, "length": os.path.getsize(path),
+            }
+        if im.format == "PNG" and not too_big:
+            png = _png_idat(path)
+            if png is not None:
+                width, height, colors, data = png
+                return {
+                    "width": width, "height": height,
+                    "colorspace": "/DeviceGray" if colors == 1 else "/DeviceRGB",
+                    "filter": "/FlateDecode", "rotate": 0, "data": data,
+                    "decode_parms": f"<< /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >>",
+                }
+        was_jpeg = im.format == "JPEG"
+        im = ImageOps.exif_transpose(im)
+        if too_big:
+            im.thumbnail((max_size, max_size), Image.LANCZOS)
+        alpha = None
+        if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+            im = im.convert("RGBA")
+            alpha = im.getchannel("A")
+            if alpha.getextrema() == (255, 255):
+                alpha = None
+            im = im.convert("RGB")
+        elif im.mode not in ("L", "RGB", "CMYK"):
+            im = im.convert("RGB")
+        colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[im.mode]
+        image = {"width": im.width, "height": im.height, "colorspace": colorspace, "rotate": 0}
+        if was_jpeg and im.mode != "CMYK":
+            # Foto reduzida: continua JPEG
+            buf = io.BytesIO()
+            im.save(buf, format="JPEG", quality=quality)
+            image.update(filter="/DCTDecode", data=buf.getvalue())
+        else:
+            image.update(filter="/FlateDecode", data=zlib.compress(im.tobytes(), 6))
+        if alpha is not None:
+            image["smask"] = zlib.compress(alpha.tobytes(), 6)
+        return image
+
+
+def images_to_pdf(image_paths, dest, progress=None, page_size=None, margin=0, max_size=None):
+    """Junta as imagens num PDF multi-página (uma imagem por página), uma de cada vez."""
+    from imagepdf import ImagePdfWriter
+    with open(dest, "wb") as out:
+        writer = ImagePdfWriter(out)
+        for done, path in enumerate(image_paths, 1):
+            writer.add_image(prepare_image(path, max_size), page_size, margin)
+            if progress:
+                progress(done, len(image_paths))
+        writer.close()
+
+
+def split_part(pdf_path, indices, linearize=False):
+    """Grava uma parte da divisão (páginas 0-based) e devolve os bytes do PDF."""
+    from split import write_part
+    reader = _get_doc(pdf_path, _open_pypdf)
+    out = io.BytesIO()
+    write_part(reader, indices, out)
+    if linearize:
+        from linearize import linearize_bytes
+        return linearize_bytes(out.getvalue())
+    return out.getvalue()
+
+
+def merge_documents(pdf_paths, dest, progress=None):
+    """Concatena os PDFs na ordem dada e grava o resultado em dest (ver merge.py)."""
+    from merge import MergeWriter, open_input, pdf_version
+    inputs = [open_input(path) for path in pdf_paths]
+    with open(dest, "wb") as out:
+        writer = MergeWriter(out, pdf_version(inputs))
+        for done, doc in enumerate(inputs, 1):
+            for _ in writer.write_document(doc):
+                pass
+            if progress:
+                progress(done, len(inputs))
+        writer.close()
+
+
+# --- Comparação de PDFs (/api/edit/compare) ---
+
+# Chaves da página que afetam o que é exibido (/Parent fica de fora: aponta
+# para a árvore de páginas e não diz nada sobre o conteúdo)
+_FINGERPRINT_KEYS = ("/Contents", "/Resources", "/MediaBox", "/CropBox", "/Rotate", "/Annots")
+
+
+def hash_pdf_object(obj, memo, stack):
+    """Digest do objeto e de tudo o que ele referencia, independente da numeração dos objetos."""
+    import hashlib
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in memo:
+            return memo[key]
+        if key in stack:
+            return b"<ciclo>"
+        stack.add(key)
+        digest = hash_pdf_object(obj.get_object(), memo, stack)
+        stack.discard(key)
+        memo[key] = digest
+        return digest
+    h = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+        h.update(b"<<")
+        for k in sorted(obj.keys()):
+            if k in ("/Parent", "/Length"):
+                continue
+            h.update(k.encode("latin-1"))
+            h.update(hash_pdf_object(obj.raw_get(k), memo, stack))
+        h.update(b">>")
+        if isinstance(obj, StreamObject):
+            # Dados brutos (ainda comprimidos): não precisa decodificar o stream
+            h.update(obj._data or b"")
+    elif isinstance(obj, ArrayObject):
+        h.update(b"[")
+        for item in obj:
+            h.update(hash_pdf_object(item, memo, stack))
+        h.update(b"]")
+    else:
+        h.update(repr(obj).encode("utf-8", "replace"))
+    return h.digest()
+
+
+def _page_digest(page, memo):
+    import hashlib
+    h = hashlib.sha256()
+    for key in _FINGERPRINT_KEYS:
+        if key in page:
+            h.update(key.encode("latin-1"))
+            h.update(hash_pdf_object(page.raw_get(key), memo, set()))
+    return h.digest()
+
+
+def page_fingerprints(pdf_path):
+    """Um digest por página (conteúdo + recursos), para pular páginas idênticas sem extrair texto."""
+    reader = _get_doc(pdf_path, _open_pypdf)
+    memo = {}
+    return [_page_digest(page, memo).hex() for page in reader.pages]
+
+
+def _page_text(reader, index):
+    if index >= len(reader.pages):
+        return ""
+    return reader.pages[index].extract_text() or ""
+
+
+def _changed_regions(path1, path2, index, dpi, cell=16, threshold=32):
+    """Regiões alteradas entre as duas páginas rasterizadas, em pontos PDF [x0, y0, x1, y1] (origem no topo)."""
+    import fitz  # PyMuPDF
+    from PIL import Image, ImageChops
+    doc1 = _get_doc(path1)
+    doc2 = _get_doc(path2)
+    if index >= doc1.page_count or index >= doc2.page_count:
+        doc = doc1 if index < doc1.page_count else doc2
+        rect = doc.load_page(index).rect
+        return [[0, 0, round(rect.width, 1), round(rect.height, 1)]]
+    images = []
+    for doc in (doc1, doc2):
+        pix = doc.load_page(index).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        images.append(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+    if images[0].size != images[1].size:
+        width, height = images[0].size
+        scale = 72 / dpi
+        return [[0, 0, round(width * scale, 1), round(height * scale, 1)]]
+    diff = ImageChops.difference(images[0], images[1])
+    if diff.getbbox() is None:
+        return []
+    # Reduz a diferença a uma grade de células de `cell` pixels: uma célula
+    # conta como alterada se algum pixel dela mudou mais que `threshold`
+    mask = diff.point(lambda v: 255 if v > threshold else 0)
+    grid = mask.reduce(cell)
+    pixels = grid.load()
+    changed = {(cx, cy) for cy in range(grid.height) for cx in range(grid.width) if pixels[cx, cy] > 0}
+    # Agrupa células vizinhas alteradas em retângulos
+    regions = []
+    while changed:
+        stack = [changed.pop()]
+        x0 = x1 = stack[0][0]
+        y0 = y1 = stack[0][1]
+        while stack:
+            cx, cy = stack.pop()
+            x0, x1, y0, y1 = min(x0, cx), max(x1, cx), min(y0, cy), max(y1, cy)
+            for nx in (cx - 1, cx, cx + 1):
+                for ny in (cy - 1, cy, cy + 1):
+                    if (nx, ny) in changed:
+                        changed.remove((nx, ny))
+                        stack.append((nx, ny))
+        scale = cell * 72 / dpi
+        regions.append([round(x0 * scale, 1), round(y0 * scale, 1), round((x1 + 1) * scale, 1), round((y1 + 1) * scale, 1)])
+    return sorted(regions, key=lambda r: (r[1], r[0]))
+
+
+def diff_pages(path1, path2, indices, visual=False, dpi=50):
+    """Compara as páginas (0-based) indicadas dos dois PDFs; devolve só as que diferem."""
+    import difflib
+    reader1 = _get_doc(path1, _open_pypdf)
+    reader2 = _get_doc(path2, _open_pypdf)
+    results = []
+    for index in indices:
+        t1 = _page_text(reader1, index)
+        t2 = _page_text(reader2, index)
+        item = {"page": index + 1}
+        if t1 != t2:
+            item["diff"] = list(difflib.unified_diff(t1.splitlines(), t2.splitlines(), lineterm=""))
+        if visual:
+            regions = _changed_regions(path1, path2, index, dpi)
+            if regions:
+                item["regions"] = regions
+        if len(item) > 1:
+            item.setdefault("diff", [])
+            results.append(item)
+    return results